@@ -0,0 +1,637 @@
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from cache import LRUCache, mapUnique
+from jssb25 import (BRANDRULES, CACHESIZE, COLORRULES, HDDSNAP, NUMERICALDATA, OSRULES, OUTPUTORDER, ROWSTAGES, binHDD,
+                    cleanAllNum, cleanBrand, cleanBrandColumn, cleanCategorical, cleanCPUSpeed, cleanHDD,
+                    cleanModelAndBrand, cleanNum, cleanPostVisualize, cleanRows, explodeColors, featureMatrix,
+                    fillBrandFromModel, fillBrandFromModelColumns, finishClean, getSpecialFeature,
+                    getSpecialFeatureColumns, mhzToGhzCPU, moveBrand, removeBrandInModel, removeBrandInModelColumns,
+                    standardizeColor, standardizeCPU, standardizeCPUColumn, standardizeFeatures,
+                    standardizeFeaturesColumn, standardizeGPU, standardizeGPUColumn, standardizeOS, tbToGBHDD)
+from rules import applyRules
+
+# Load the sample listings and run the shared pre-cleaning so the mappers see the same
+# strings they see inside cleanData(), then repeat them up to the requested size
+def loadSample(rows):
+    df = pd.read_excel('amazon_laptop_2023.xlsx')
+    df.columns = df.columns.str.lower().str.strip()
+    categoricalData = ['brand', 'model', 'color', 'cpu', 'os', 'special_features', 'graphics', 'graphics_coprocessor']
+    df = cleanCategorical(df, categoricalData)
+    repeat = -(-rows // len(df))
+    return pd.concat([df] * repeat, ignore_index=True).head(rows)
+
+# Time a function, returning the best of a few runs and the last result
+def timeIt(func, *args, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+# Compare the per-row mappers against the compiled rule tables
+def benchRules(rows):
+    df = loadSample(rows)
+    color = df['color'].str.split(r'[,/]').explode().str.strip()
+    cases = {
+        'color': (color, standardizeColor, lambda s: applyRules(s, COLORRULES, 'NA')),
+        'os': (df['os'], standardizeOS, lambda s: applyRules(s, OSRULES, 'NA')),
+        'gpu': (df['graphics_coprocessor'], standardizeGPU, standardizeGPUColumn),
+        'cpu': (df['cpu'], standardizeCPU, standardizeCPUColumn),
+        'brand': (df['brand'], cleanBrand, lambda s: applyRules(s, BRANDRULES)),
+    }
+    print(f'{"mapper":<8}{"rows":>10}{"per-row s":>12}{"rules s":>12}{"speedup":>10}')
+    for name, (series, rowFunc, columnFunc) in cases.items():
+        rowTime, expected = timeIt(lambda s: s.apply(rowFunc), series)
+        columnTime, result = timeIt(columnFunc, series)
+        assert result.equals(expected.astype(object)), name + ' does not match the per-row mapper'
+        print(f'{name:<8}{len(series):>10}{rowTime:>12.3f}{columnTime:>12.3f}{rowTime / columnTime:>9.1f}x')
+
+# Compare the rule tables on every row with normalizing each distinct value once,
+# both with an empty cache (first feed) and a warm one (repeated feed)
+def benchUnique(rows):
+    df = loadSample(rows)
+    color = df['color'].str.split(r'[,/]').explode().str.strip()
+    cases = {
+        'color': (color, lambda s: applyRules(s, COLORRULES, 'NA')),
+        'os': (df['os'], lambda s: applyRules(s, OSRULES, 'NA')),
+        'gpu': (df['graphics_coprocessor'], standardizeGPUColumn),
+        'cpu': (df['cpu'], standardizeCPUColumn),
+        'brand': (df['brand'], lambda s: applyRules(s, BRANDRULES)),
+    }
+    print(f'{"mapper":<8}{"rows":>10}{"unique":>8}{"rules s":>10}{"cold s":>10}{"warm s":>10}{"hits":>10}{"misses":>8}')
+    for name, (series, func) in cases.items():
+        cache = LRUCache(CACHESIZE)
+        rulesTime, expected = timeIt(func, series)
+        coldTime, result = timeIt(lambda s: mapUnique(s, func, LRUCache(CACHESIZE)), series)
+        mapUnique(series, func, cache)
+        warmTime, _ = timeIt(lambda s: mapUnique(s, func, cache), series)
+        assert result.equals(expected), name + ' does not match the rule tables'
+        print(f'{name:<8}{len(series):>10}{series.nunique():>8}{rulesTime:>10.3f}{coldTime:>10.3f}{warmTime:>10.3f}'
+              f'{cache.hits:>10}{cache.misses:>8}')
+
+# Peak traced memory of the streaming mode for a few chunk sizes, against the in-memory stages
+def benchStream(rows):
+    import os
+    import tempfile
+    import tracemalloc
+    from streaming import cleanStream
+
+    with tempfile.TemporaryDirectory() as directory:
+        fileName = os.path.join(directory, 'input.csv')
+        raw = pd.read_excel('amazon_laptop_2023.xlsx')
+        pd.concat([raw] * -(-rows // len(raw)), ignore_index=True).head(rows).to_csv(fileName, index=False)
+
+        print(f'{"chunk":>10}{"seconds":>10}{"peak MB":>10}')
+        for chunkSize in [1000, 10000, 100000]:
+            tracemalloc.start()
+            start = time.perf_counter()
+            cleanStream(fileName, os.path.join(directory, 'output.csv'), chunkSize)
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+            print(f'{chunkSize:>10}{seconds:>10.2f}{peak:>10.1f}')
+
+# Time the row stages and brand/model cleaning serially and with 1, 2, 4 and 8 worker processes
+def benchParallel(rows):
+    from parallel import cleanParallel
+
+    raw = pd.read_excel('amazon_laptop_2023.xlsx').dropna(axis=0, subset=['model'])
+    raw.columns = raw.columns.str.lower().str.strip()
+    raw = pd.concat([raw] * -(-rows // len(raw)), ignore_index=True).head(rows)
+
+    serialTime, expected = timeIt(lambda df: cleanModelAndBrand(cleanRows(df.copy())), raw, repeat=1)
+    print(f'{"workers":>8}{"seconds":>10}{"speedup":>10}')
+    print(f'{"serial":>8}{serialTime:>10.2f}{1:>9.1f}x')
+    for workers in [1, 2, 4, 8]:
+        seconds, result = timeIt(lambda df: cleanParallel(df.copy(), workers), raw, repeat=1)
+        assert result.equals(expected), f'{workers} workers does not match the serial run'
+        print(f'{workers:>8}{seconds:>10.2f}{serialTime / seconds:>9.1f}x')
+
+# Brand, model and special features with the per-row apply(axis=1) passes and with the column versions
+# Some models get a random number appended, so there are many more distinct models than in the sample
+def benchBrandModel(rows):
+    rng = np.random.default_rng(0)
+    df = loadSample(rows)[['brand', 'model', 'special_features']]
+    suffix = rng.integers(0, 100000, size=rows).astype(str)
+    df['model'] = df['model'].where(rng.random(rows) < 0.5, df['model'] + ' ' + suffix)
+
+    def before(df):
+        df['special_features'] = df['special_features'].str.split(',')
+        df = df.apply(getSpecialFeature, axis=1)
+        df = df.apply(moveBrand, axis=1)
+        df['brand'] = df['brand'].apply(cleanBrand)
+        df = df.apply(removeBrandInModel, axis=1, brands=df['brand'].unique())
+        df = df.apply(fillBrandFromModel, axis=1)
+        return df
+
+    def after(df):
+        df['special_features'] = df['special_features'].str.split(',')
+        df = getSpecialFeatureColumns(df)
+        df = cleanBrandColumn(df)
+        df = removeBrandInModelColumns(df, df['brand'].unique())
+        df = fillBrandFromModelColumns(df)
+        return df
+
+    beforeTime, expected = timeIt(lambda df: before(df.copy()), df, repeat=1)
+    afterTime, result = timeIt(lambda df: after(df.copy()), df, repeat=1)
+    assert result.equals(expected), 'column versions do not match the per-row functions'
+    print(f'{rows} rows, {df["model"].nunique()} distinct models, {df["brand"].nunique()} brands')
+    print(f'apply(axis=1) {beforeTime:.2f}s, columns {afterTime:.2f}s, {beforeTime / afterTime:.1f}x faster')
+
+# Save and load times and file sizes of the cleaned output in every storage format
+# The output of the sample is repeated up to the requested size
+def benchStorage(rows):
+    import os
+    import tempfile
+    from storage import readTable, writeTable
+
+    df = pd.read_excel('amazon_laptop_2023.xlsx')
+    df.columns = df.columns.str.lower().str.strip()
+    df = df.dropna(axis=0, subset=['model']).drop_duplicates(ignore_index=True)
+    df = cleanPostVisualize(finishClean(cleanModelAndBrand(cleanRows(df))))
+    df = pd.concat([df[OUTPUTORDER]] * -(-rows // len(df)), ignore_index=True).head(rows)
+
+    with tempfile.TemporaryDirectory() as directory:
+        print(f'{"format":<10}{"rows":>10}{"save s":>10}{"load s":>10}{"MB":>10}')
+        for extension in ['.xlsx', '.csv', '.parquet', '.arrow']:
+            fileName = os.path.join(directory, 'output' + extension)
+            saveTime, _ = timeIt(writeTable, df, fileName, repeat=1)
+            loadTime, result = timeIt(readTable, fileName, repeat=1)
+            assert len(result) == len(df), extension + ' lost rows'
+            size = os.path.getsize(fileName) / 2**20
+            print(f'{extension[1:]:<10}{len(df):>10}{saveTime:>10.2f}{loadTime:>10.2f}{size:>10.1f}')
+
+# Memory of every column after the row stages, as Python objects and as the categories the pipeline
+# keeps them in, and of special_features as a multi-hot matrix
+# (pandas counts the object size of every row, even where rows share the same string)
+def benchMemory(rows):
+    raw = pd.read_excel('amazon_laptop_2023.xlsx').dropna(axis=0, subset=['model'])
+    raw.columns = raw.columns.str.lower().str.strip()
+    raw = pd.concat([raw] * -(-rows // len(raw)), ignore_index=True).head(rows)
+    df = finishClean(cleanModelAndBrand(cleanRows(raw)))
+
+    print(f'{"column":<18}{"dtype":>10}{"object MB":>12}{"MB":>10}{"saving":>10}')
+    total = [0, 0]
+    for column in df.columns:
+        size = df[column].memory_usage(deep=True, index=False) / 2**20
+        objectSize = size
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            objectSize = df[column].astype(object).memory_usage(deep=True, index=False) / 2**20
+        total[0] += objectSize
+        total[1] += size
+        print(f'{column:<18}{str(df[column].dtype):>10}{objectSize:>12.2f}{size:>10.2f}{objectSize / size:>9.1f}x')
+    print(f'{"total":<18}{"":>10}{total[0]:>12.2f}{total[1]:>10.2f}{total[0] / total[1]:>9.1f}x')
+    matrix = featureMatrix(df['special_features'])
+    print(f'special_features multi-hot: {matrix.shape[1]} features, '
+          f'{matrix.memory_usage(deep=True, index=False).sum() / 2**20:.2f} MB')
+
+# The numeric stages with the per-column parsing, per-row unit functions and masked hard disk snapping,
+# against the batched parse, np.where unit rules and the single snapping lookup
+# Half of the CPU speeds are random, so the rounding sees many different values
+def benchNumeric(rows):
+    rng = np.random.default_rng(0)
+    raw = pd.read_excel('amazon_laptop_2023.xlsx')
+    raw.columns = raw.columns.str.lower().str.strip()
+    raw = pd.concat([raw[NUMERICALDATA]] * -(-rows // len(raw)), ignore_index=True).head(rows)
+    speeds = pd.Series(np.round(rng.uniform(0, 5000, rows), 3).astype(str)) + ' ghz'
+    raw['cpu_speed'] = raw['cpu_speed'].where(rng.random(rows) < 0.5, speeds)
+
+    def before(df):
+        for column in NUMERICALDATA:
+            df[column] = cleanNum(df, column)
+        df['harddisk'] = df['harddisk'].apply(tbToGBHDD)
+        df['cpu_speed'] = df['cpu_speed'].apply(mhzToGhzCPU)
+        for size, snapped in HDDSNAP.items():
+            df.loc[df['harddisk'] == size, 'harddisk'] = snapped
+        return df
+
+    def after(df):
+        df = cleanCPUSpeed(cleanHDD(cleanAllNum(df, NUMERICALDATA)))
+        harddisk = binHDD(pd.DataFrame({'harddisk_gb': df['harddisk']}))['harddisk_gb']
+        return df.assign(harddisk=harddisk)
+
+    beforeTime, expected = timeIt(lambda df: before(df.copy()), raw, repeat=1)
+    afterTime, result = timeIt(lambda df: after(df.copy()), raw, repeat=1)
+    for column in NUMERICALDATA:
+        assert np.array_equal(result[column].to_numpy(), expected[column].to_numpy()), column + ' is not bit-identical'
+    print(f'{rows} rows, {raw["cpu_speed"].nunique()} distinct CPU speeds')
+    print(f'per column and row {beforeTime:.2f}s, batched {afterTime:.2f}s, {beforeTime / afterTime:.1f}x faster')
+
+# special_features with standardizeFeatures on every row against the exploded column version
+# Every row gets a random pick of the feature items found in the sample, so most lists are distinct
+def benchFeatures(rows):
+    rng = np.random.default_rng(0)
+    items = loadSample(rows)['special_features'].str.split(',').explode().unique()
+    sizes = rng.integers(1, 7, size=rows)
+    picks = np.split(rng.integers(0, len(items), size=sizes.sum()), np.cumsum(sizes)[:-1])
+    lists = pd.Series([list(items[pick]) for pick in picks], dtype=object)
+
+    rowTime, expected = timeIt(lambda s: s.apply(standardizeFeatures), lists, repeat=1)
+    columnTime, result = timeIt(standardizeFeaturesColumn, lists, repeat=1)
+    assert result.astype(object).equals(expected), 'standardizeFeaturesColumn does not match standardizeFeatures'
+    print(f'{rows} rows, {sizes.sum()} feature items ({len(items)} distinct), {result.nunique()} distinct feature sets')
+    print(f'per row {rowTime:.2f}s, column {columnTime:.2f}s, {rowTime / columnTime:.1f}x faster')
+
+# The row stages with the colors exploded right after cleanColor (every later stage sees a row per color)
+# against exploding them once the row stages are done. A third of the listings get 2 or 3 colors
+def benchColors(rows):
+    rng = np.random.default_rng(0)
+    raw = pd.read_excel('amazon_laptop_2023.xlsx').dropna(axis=0, subset=['model'])
+    raw.columns = raw.columns.str.lower().str.strip()
+    raw = pd.concat([raw] * -(-rows // len(raw)), ignore_index=True).head(rows)
+    colors = np.array(['black', 'silver', 'grey', 'blue', 'red', 'white'], dtype=object)
+    extra = pd.Series([', '.join(rng.choice(colors, size=rng.integers(2, 4))) for _ in range(rows)])
+    raw['color'] = raw['color'].where(rng.random(rows) < 2 / 3, extra)
+
+    def explodeFirst(df):
+        for stage in ROWSTAGES:
+            df = stage['func'](df)
+            if stage['name'] == 'cleanColor':
+                df = explodeColors(df)
+                stageRows = len(df)
+        return cleanModelAndBrand(df), stageRows
+
+    def explodeLast(df):
+        return explodeColors(cleanModelAndBrand(cleanRows(df))), len(df)
+
+    explodeLast(raw.copy()) # Fill the caches, so both runs see the same warm caches
+    firstTime, (expected, firstRows) = timeIt(lambda df: explodeFirst(df.copy()), raw, repeat=1)
+    lastTime, (result, lastRows) = timeIt(lambda df: explodeLast(df.copy()), raw, repeat=1)
+    expected, result = expected.drop_duplicates(ignore_index=True), result.drop_duplicates(ignore_index=True)
+    assert result.equals(expected), 'exploding at the end does not match exploding in cleanColor'
+    print(f'{rows} listings, {firstRows} listing colors, {len(result)} rows after drop_duplicates')
+    print(f'exploded in cleanColor {firstTime:.2f}s ({firstRows} rows per stage), '
+          f'exploded at the end {lastTime:.2f}s ({lastRows} rows per stage), {firstTime / lastTime:.1f}x faster')
+
+# drop_duplicates on the rows before dedup against the fingerprint dedup, with the peak memory
+# (tracemalloc) of each. Then near duplicates: a fifth of the rows get their model text
+# respaced and recased, which only the MinHash clustering of dropDuplicateRows(near={}) finds
+def benchDedup(rows):
+    import tracemalloc
+    from dedup import dropDuplicateRows, nearDuplicateClusters
+
+    rng = np.random.default_rng(0)
+    raw = pd.read_excel('amazon_laptop_2023.xlsx').dropna(axis=0, subset=['model'])
+    raw.columns = raw.columns.str.lower().str.strip()
+    df = explodeColors(cleanModelAndBrand(cleanRows(raw)))
+    df = pd.concat([df] * -(-rows // len(df)), ignore_index=True).head(rows)
+
+    def traced(func, *args):
+        tracemalloc.start()
+        seconds, result = timeIt(func, *args, repeat=1)
+        peak = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+        return seconds, peak, result
+
+    dropTime, dropPeak, expected = traced(lambda df: df.drop_duplicates(ignore_index=True, keep='first'), df)
+    hashTime, hashPeak, result = traced(dropDuplicateRows, df)
+    assert result.equals(expected), 'dropDuplicateRows does not match drop_duplicates'
+    print(f'{rows} rows, {len(result)} distinct')
+    print(f'drop_duplicates {dropTime:.2f}s ({dropPeak:.1f} MB peak), '
+          f'fingerprints {hashTime:.2f}s ({hashPeak:.1f} MB peak), {dropTime / hashTime:.1f}x faster')
+
+    perturbed = rng.random(rows) < 0.2
+    models = df['model'].astype(str)
+    respaced = models.str.replace(' ', '  ', n=1, regex=False).str.upper() + ' '
+    df['model'] = models.where(~perturbed, respaced)
+    nearTime, result = timeIt(dropDuplicateRows, df, {}, repeat=1)
+    clusters = nearDuplicateClusters(df['model'])
+    print(f'{perturbed.sum()} models perturbed, {df["model"].nunique()} distinct texts in '
+          f'{len(np.unique(clusters))} clusters')
+    print(f'exact dedup keeps {len(dropDuplicateRows(df))} rows, near dedup keeps {len(result)} in {nearTime:.2f}s')
+
+# Sizes of the scaling sweep, python bench.py scale <rows> runs the ones up to rows
+SCALES = [10000, 100000, 1000000, 10000000]
+
+# clean() end to end on synthetic listings (see synthetic.py) at every size of SCALES up to rows,
+# starting with empty caches. A first run times every stage, a second one traces the memory
+# (tracemalloc slows the stages down too much to time them in the same run). Each size is saved as
+# bench_scale_<rows>.json, a profiling.py report with the throughput and peak memory of every stage,
+# so python profiling.py <old report> <new report> compares two commits
+def benchScale(rows):
+    import json
+    from jssb25 import CACHES, clean
+    from profiling import Profiler, maxRss
+    from synthetic import syntheticListings
+
+    print(f'{"rows":>10}{"seconds":>10}{"rows/s":>12}{"peak MB":>10}{"max RSS MB":>12}')
+    for size in [scale for scale in SCALES if scale <= rows] or [rows]:
+        raw = syntheticListings(size)
+        reports = []
+        for traceMemory in [False, True]:
+            for name in CACHES:
+                CACHES[name] = LRUCache(CACHESIZE)
+            with Profiler(traceMemory=traceMemory) as profiler:
+                profiler.run('clean', clean, raw.copy(), {'profiler': profiler})
+            reports.append(profiler.report())
+        report, memory = reports
+        for record, traced in zip(report['stages'], memory['stages']):
+            record['rowsPerSecond'] = record['rowsIn'] / record['wallSeconds'] if record['wallSeconds'] else None
+            record['tracedPeakMB'] = traced['tracedPeakMB']
+        total = report['stages'][-1]
+        report.update({'rows': size, 'rowsPerSecond': total['rowsPerSecond'], 'tracedPeakMB': total['tracedPeakMB'],
+                       'maxRssMB': maxRss()})
+        with open(f'bench_scale_{size}.json', 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f'{size:>10}{total["wallSeconds"]:>10.2f}{total["rowsPerSecond"]:>12.0f}'
+              f'{total["tracedPeakMB"]:>10.1f}{report["maxRssMB"] or 0:>12.1f}')
+        for record in report['stages'][:-1]:
+            print(f'{"":>4}{record["path"]:<40}{record["wallSeconds"]:>8.2f}s{record["rowsPerSecond"] or 0:>12.0f} rows/s'
+                  f'{record["tracedPeakMB"]:>8.1f} MB')
+
+# The service (see service.py) with requests of 20 listings, 32 sent at a time, micro-batched
+# against a batch per request (maxBatchRows 1). Both start warm from the bundled file
+def benchService(rows):
+    import asyncio
+    from service import serve
+
+    raw = pd.read_excel('amazon_laptop_2023.xlsx')
+    raw = pd.concat([raw] * -(-rows // len(raw)), ignore_index=True).head(rows)
+    bodies = [raw.iloc[start:start + 20].to_json(orient='records').encode() for start in range(0, rows, 20)]
+
+    async def post(port, body):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(f'POST /clean HTTP/1.1\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n'
+                     f'Connection: close\r\n\r\n'.encode() + body)
+        response = await reader.read()
+        writer.close()
+        assert response.startswith(b'HTTP/1.1 200'), response[:200]
+
+    async def run(config):
+        started = asyncio.get_running_loop().create_future()
+        service = asyncio.create_task(serve(port=0, config=config, warmFile='amazon_laptop_2023.xlsx',
+                                            ready=lambda server, batcher: started.set_result((server, batcher))))
+        server, batcher = await started
+        port = server.sockets[0].getsockname()[1]
+        limit = asyncio.Semaphore(32)
+
+        async def send(body):
+            async with limit:
+                await post(port, body)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[send(body) for body in bodies])
+        seconds = time.perf_counter() - start
+        metrics = batcher.metrics()
+        service.cancel()
+        return seconds, metrics
+
+    print(f'{"mode":<14}{"requests":>10}{"batches":>10}{"rows/s":>10}{"p50 ms":>10}{"p99 ms":>10}')
+    for name, config in [('per request', {'maxBatchRows': 1}), ('micro-batched', {})]:
+        seconds, metrics = asyncio.run(run(config))
+        latency = metrics['latencyMs']
+        print(f'{name:<14}{metrics["requests"]:>10}{metrics["batches"]:>10}{rows / seconds:>10.0f}'
+              f'{latency["p50"]:>10.1f}{latency["p99"]:>10.1f}')
+
+# The GPU and CPU stages, cleaning each distinct value in one pass, against their chains of whole-column
+# passes (one per rewrite rule), both with empty caches, on the bundled sample and on synthetic listings
+def benchGpuCpu(rows):
+    from jssb25 import CACHES, cleanCPU, cleanCPUPasses, cleanGPU, cleanGPUPasses
+    from synthetic import syntheticListings
+
+    synthetic = syntheticListings(rows)
+    synthetic.columns = synthetic.columns.str.lower().str.strip()
+    categoricalData = ['brand', 'model', 'color', 'cpu', 'os', 'special_features', 'graphics', 'graphics_coprocessor']
+    samples = {'bundled': loadSample(rows), 'synthetic': cleanCategorical(synthetic, categoricalData)}
+
+    def coldRun(stage, df):
+        for name in ['gpu', 'cpu']:
+            CACHES[name] = LRUCache(CACHESIZE)
+        return stage(df.copy())
+
+    print(f'{"stage":<10}{"sample":<11}{"rows":>9}{"unique":>8}{"passes s":>10}{"fused s":>10}{"rows/s":>11}{"speedup":>9}')
+    for sample, df in samples.items():
+        for name, stage, reference, column in [('gpu', cleanGPU, cleanGPUPasses, 'graphics_coprocessor'),
+                                               ('cpu', cleanCPU, cleanCPUPasses, 'cpu')]:
+            passesTime, expected = timeIt(coldRun, reference, df)
+            fusedTime, result = timeIt(coldRun, stage, df)
+            assert result.equals(expected), f'{name} stage does not match its chain of passes on the {sample} rows'
+            print(f'{name:<10}{sample:<11}{len(df):>9}{df[column].nunique():>8}{passesTime:>10.3f}{fusedTime:>10.3f}'
+                  f'{len(df) / fusedTime:>11.0f}{passesTime / fusedTime:>8.1f}x')
+
+# Rows of the final stage held as partitions: the merged t-digests against the exact quantiles of the outlier
+# columns, and finishPartitions (two passes over the spilled partitions) against cleanPostVisualize in memory
+def benchSketches(rows):
+    import os
+    import tempfile
+    import tracemalloc
+    from jssb25 import OUTLIERLIMITS, outlierDigests
+    from sketches import mergeSketches
+    from streaming import finishPartitions
+    from synthetic import syntheticListings
+
+    df = syntheticListings(rows)
+    df.columns = df.columns.str.lower().str.strip()
+    df = cleanRows(df.dropna(axis=0, subset=['model']).drop_duplicates(ignore_index=True))
+    df = finishClean(explodeColors(cleanModelAndBrand(df)))
+    partitions = np.array_split(np.arange(len(df)), 10)
+
+    digests = mergeSketches(outlierDigests(df.iloc[partition]) for partition in partitions)
+    print(f'{"column":<16}{"quantile":>10}{"exact":>10}{"digest":>10}{"error":>9}')
+    for column in OUTLIERLIMITS:
+        for q in [0.5, 0.99, 0.999]:
+            exact = df[column].quantile(q)
+            estimate = digests[column].quantile(q)
+            print(f'{column:<16}{q:>10}{exact:>10.1f}{estimate:>10.1f}{abs(estimate - exact) / exact:>8.2%}')
+
+    class Collect:
+        def __init__(self):
+            self.frames = []
+        def write(self, frame):
+            self.frames.append(frame[OUTPUTORDER])
+        def close(self):
+            pass
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for i, partition in enumerate(partitions):
+            paths.append(os.path.join(directory, f'part_{i}.pkl'))
+            df.iloc[partition].to_pickle(paths[-1])
+        print(f'{"final stage":<24}{"rows":>10}{"seconds":>10}{"peak MB":>10}')
+        for name, run in [('in memory', lambda: cleanPostVisualize(pd.concat([pd.read_pickle(path) for path in paths]))),
+                          ('two passes, 10 parts', lambda: finishPartitions(paths, collect))]:
+            collect = Collect()
+            tracemalloc.start()
+            start = time.perf_counter()
+            result = run()
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+            result = (result[OUTPUTORDER] if result is not None else pd.concat(collect.frames)).astype(object)
+            if name == 'in memory':
+                expected = result.reset_index(drop=True)
+            assert result.reset_index(drop=True).equals(expected), name + ' does not match cleanPostVisualize'
+            print(f'{name:<24}{len(result):>10}{seconds:>10.2f}{peak:>10.1f}')
+
+# clean() with the pandas stages against the polars engine (one lazy plan, see lazy.py), both with
+# empty caches, on synthetic listings
+def benchLazy(rows):
+    import polars as pl
+    from jssb25 import CACHES, clean
+    from synthetic import syntheticListings
+
+    def coldRun(raw, engine):
+        for name in CACHES:
+            CACHES[name] = LRUCache(CACHESIZE)
+        return clean(raw.copy(), {'engine': engine})
+
+    print(f'polars threads: {pl.thread_pool_size()}')
+    print(f'{"rows":>10}{"pandas s":>10}{"polars s":>10}{"speedup":>9}')
+    for size in [scale for scale in SCALES if scale <= rows] or [rows]:
+        raw = syntheticListings(size)
+        pandasTime, expected = timeIt(coldRun, raw, 'pandas', repeat=1)
+        polarsTime, result = timeIt(coldRun, raw, 'polars', repeat=1)
+        assert result.equals(expected), 'the polars engine does not match clean()'
+        print(f'{size:>10}{pandasTime:>10.2f}{polarsTime:>10.2f}{pandasTime / polarsTime:>8.1f}x')
+
+# clean() of synthetic listings without checkpoints, then with a checkpoint cache: the first run (which saves
+# every stage), a rerun (which loads the last one), a rerun after a change of the rare value count of
+# cleanPostVisualize and one after a change of the brand rules of cleanModelAndBrand (which run the stages
+# from there again). The normalization caches start empty in every run
+def benchCheckpoints(rows):
+    import tempfile
+    import jssb25
+    from checkpoints import CheckpointCache
+    from synthetic import syntheticListings
+
+    def coldRun(raw, checkpoints):
+        for name in jssb25.CACHES:
+            jssb25.CACHES[name] = LRUCache(CACHESIZE)
+        return jssb25.clean(raw.copy(), {'checkpoints': checkpoints})
+
+    def changed(name, value):
+        def run(raw, checkpoints):
+            saved = getattr(jssb25, name)
+            setattr(jssb25, name, value)
+            try:
+                return coldRun(raw, checkpoints)
+            finally:
+                setattr(jssb25, name, saved)
+        return run
+
+    runs = [
+        ('first run', coldRun),
+        ('rerun', coldRun),
+        ('changed cleanPostVisualize', changed('RARECOUNT', jssb25.RARECOUNT + 1)),
+        ('changed cleanModelAndBrand', changed('BRANDRULES', jssb25.compileRules({**jssb25.BRANDMAPPING, 'not a brand': 'none'}))),
+    ]
+    print(f'{"rows":>10}{"run":>28}{"seconds":>10}{"stages run":>12}{"cache MB":>10}')
+    for size in [scale for scale in SCALES if scale <= rows] or [rows]:
+        raw = syntheticListings(size)
+        seconds, _ = timeIt(coldRun, raw, None, repeat=1)
+        print(f'{size:>10}{"no checkpoints":>28}{seconds:>10.2f}')
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoints = CheckpointCache(directory)
+            for name, run in runs:
+                misses = checkpoints.misses
+                seconds, _ = timeIt(run, raw, checkpoints, repeat=1)
+                megabytes = checkpoints.entries()["MB"].sum()
+                print(f'{"":>10}{name:>28}{seconds:>10.2f}{checkpoints.misses - misses:>12}{megabytes:>10.1f}')
+
+# Catalog of cleaned synthetic listings (100000 cleaned rows repeated up to the requested size): the time to
+# build, save and load it, then the microseconds of a few queries (count, top 10 and the matching rows)
+# against the same filter as a pandas mask over the frame
+def benchCatalog(rows):
+    import tempfile
+    from catalog import buildCatalog, loadCatalog, saveCatalog
+    from jssb25 import clean
+    from synthetic import syntheticListings
+
+    cleaned = clean(syntheticListings(min(rows, 100000)))
+    df = pd.concat([cleaned] * -(-rows // len(cleaned)), ignore_index=True).head(rows)
+    rareModel = df['cpuModel'].value_counts().index[-1]
+    diskRange = next(value for value in df['harddisk_range_gb'].dropna().unique() if str(value) == '[512.0, 1024.0)')
+    queries = {
+        'brand ram price': ({'brand': 'dell', 'ram_gb': (16, None), 'price_dollar': (500, 1500)},
+                            lambda: (df['brand'] == 'dell') & (df['ram_gb'] >= 16) & df['price_dollar'].between(500, 1500)),
+        'cpu gpu feature': ({'cpuBrand': ['intel', 'amd'], 'gpuBrand': 'nvidia', 'special_features': 'backlit keyboard'},
+                            lambda: df['cpuBrand'].isin(['intel', 'amd']) & (df['gpuBrand'] == 'nvidia')
+                                    & df['special_features'].map(lambda terms: 'backlit keyboard' in terms, na_action='ignore').fillna(False).astype(bool)),
+        'rare cpu price': ({'cpuModel': rareModel, 'price_dollar': (None, 800)},
+                           lambda: (df['cpuModel'] == rareModel) & (df['price_dollar'] <= 800)),
+        'screen disk': ({'screen_size_in': (13, 14), 'harddisk_range_gb': '[512.0, 1024.0)'},
+                        lambda: df['screen_size_in'].between(13, 14) & (df['harddisk_range_gb'] == diskRange)),
+    }
+
+    def perQuery(func, *args, repeat=100):
+        func(*args)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            func(*args)
+        return (time.perf_counter() - start) / repeat * 1e6
+
+    with tempfile.TemporaryDirectory() as directory:
+        buildTime, catalog = timeIt(buildCatalog, df, repeat=1)
+        saveTime, _ = timeIt(saveCatalog, catalog, directory, repeat=1)
+        loadTime, catalog = timeIt(loadCatalog, directory)
+        print(f'{len(df)} rows: build {buildTime:.2f} s, save {saveTime:.2f} s, load {loadTime * 1000:.1f} ms')
+        print(catalog.describe())
+        print(f'{"query":<18}{"matches":>10}{"count us":>10}{"top10 us":>10}{"rows us":>10}{"pandas us":>11}')
+        for name, (filters, scan) in queries.items():
+            matches = catalog.count(filters)
+            assert matches == scan().sum(), f'the catalog count of {name} does not match pandas'
+            print(f'{name:<18}{matches:>10}{perQuery(catalog.count, filters):>10.0f}{perQuery(catalog.top, filters):>10.0f}'
+                  f'{perQuery(catalog.select, filters, repeat=10):>10.0f}{perQuery(lambda: scan().to_numpy().nonzero(), repeat=3):>11.0f}')
+
+# modelIds on listings of known laptops: the distinct (brand, cpuModel, gpuModel, model) of cleaned synthetic
+# listings, each row one of them with half the titles perturbed (see synthetic.perturbedTitles). The time at
+# every scale up to rows (about the same per row when it grows linearly) and how well the ids match the
+# laptops: the share of pairs of rows of one laptop with the same id (recall) and of pairs with the same id
+# which are one laptop (precision)
+def benchModelIds(rows):
+    from dedup import modelIds, modelKeys
+    from jssb25 import clean
+    from synthetic import perturbedTitles, syntheticListings
+
+    columns = ['brand', 'cpuModel', 'gpuModel', 'model']
+    laptops = clean(syntheticListings(20000))[columns]
+    laptops = laptops[~laptops[columns[:3]].assign(model=modelKeys(laptops['model'])).duplicated()].reset_index(drop=True)
+    rng = np.random.default_rng(0)
+
+    def pairs(counts):
+        return (counts * (counts - 1) // 2).sum()
+
+    print(f'{len(laptops)} laptops')
+    print(f'{"rows":>10}{"seconds":>9}{"us/row":>8}{"ids":>9}{"recall":>8}{"precision":>11}')
+    for size in [scale for scale in SCALES if scale <= rows] or [rows]:
+        laptop = rng.integers(0, len(laptops), size)
+        df = laptops.iloc[laptop].reset_index(drop=True)
+        perturbed = np.flatnonzero(rng.random(size) < 0.5)
+        df.loc[perturbed, 'model'] = perturbedTitles(df.loc[perturbed, 'model'].astype(str), 1)
+        seconds, ids = timeIt(modelIds, df, repeat=1)
+        same = pd.Series(ids).groupby([laptop, ids]).size().to_numpy()
+        print(f'{size:>10}{seconds:>9.2f}{seconds / size * 1e6:>8.1f}{len(np.unique(ids)):>9}'
+              f'{pairs(same) / pairs(np.bincount(laptop)):>8.3f}{pairs(same) / pairs(np.bincount(ids)):>11.4f}')
+
+BENCHMARKS = {
+    'rules': benchRules,
+    'unique': benchUnique,
+    'stream': benchStream,
+    'parallel': benchParallel,
+    'brandmodel': benchBrandModel,
+    'storage': benchStorage,
+    'memory': benchMemory,
+    'numeric': benchNumeric,
+    'features': benchFeatures,
+    'colors': benchColors,
+    'dedup': benchDedup,
+    'scale': benchScale,
+    'service': benchService,
+    'gpucpu': benchGpuCpu,
+    'sketches': benchSketches,
+    'lazy': benchLazy,
+    'checkpoints': benchCheckpoints,
+    'catalog': benchCatalog,
+    'modelids': benchModelIds,
+}
+
+# Usage: python bench.py <benchmark> [rows]
+if __name__ == '__main__':
+    name = sys.argv[1] if len(sys.argv) > 1 else 'rules'
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    BENCHMARKS[name](rows)
@@ -0,0 +1,113 @@
+from collections import OrderedDict
+import hashlib
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+# Bounded least-recently-used mapping from a raw string to its normalized value
+# Keeps hit and miss counts so a run can report how much work the cache saved
+class LRUCache:
+    def __init__(self, maxsize=65536):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key):
+        self.data.move_to_end(key)
+        return self.data[key]
+
+    def put(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def clear(self):
+        self.data.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.data), 'maxsize': self.maxsize}
+
+# Factorize the column, normalize each distinct value once and broadcast back through the codes
+# func takes and returns a Series, values already in the cache are not passed to it
+def mapUnique(series, func, cache):
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    values = np.empty(len(uniques), dtype=object)
+    missing = []
+    for i, value in enumerate(uniques):
+        if value in cache:
+            values[i] = cache.get(value)
+            cache.hits += 1
+        else:
+            missing.append(i)
+    cache.misses += len(missing)
+
+    if missing:
+        computed = func(pd.Series(np.asarray(uniques, dtype=object)[missing], dtype=object)).to_numpy()
+        values[missing] = computed
+        for i, value in zip(missing, computed):
+            cache.put(uniques[i], value)
+
+    return pd.Series(values[codes], index=series.index, dtype=object)
+
+# Fingerprint of the rule tables, so a saved cache is only reused with the rules it was built from
+def rulesVersion(*tables):
+    return hashlib.sha256(repr(tables).encode()).hexdigest()
+
+# Load saved caches into the given ones, ignoring the file if it was built from other rules
+def loadCaches(caches, path, version):
+    if not path or not os.path.exists(path):
+        return
+    with open(path, 'rb') as file:
+        saved = pickle.load(file)
+    if saved.get('version') != version:
+        return
+    for name, items in saved['caches'].items():
+        if name in caches:
+            for key, value in items:
+                caches[name].put(key, value)
+
+def saveCaches(caches, path, version):
+    saved = {
+        'version': version,
+        'caches': {name: list(cache.data.items()) for name, cache in caches.items()},
+    }
+    with open(path, 'wb') as file:
+        pickle.dump(saved, file)
+
+# Counters and keys of the caches, to find what a piece of work added to them
+def cacheMarks(caches):
+    return {name: (cache.hits, cache.misses, set(cache.data)) for name, cache in caches.items()}
+
+# Hits, misses and new entries of the caches since cacheMarks, small enough to send between processes
+def cacheChanges(caches, marks):
+    changes = {}
+    for name, cache in caches.items():
+        hits, misses, keys = marks[name]
+        changes[name] = (cache.hits - hits, cache.misses - misses,
+                         [(key, value) for key, value in cache.data.items() if key not in keys])
+    return changes
+
+# Add the changes made by another process to the caches
+def mergeCaches(caches, changes):
+    for name, (hits, misses, items) in changes.items():
+        cache = caches[name]
+        cache.hits += hits
+        cache.misses += misses
+        for key, value in items:
+            cache.put(key, value)
+
+# Fill the caches with saved entries (the entries of the parent process, in a worker)
+def seedCaches(caches, entries):
+    for name, items in entries.items():
+        for key, value in items:
+            caches[name].put(key, value)
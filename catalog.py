@@ -0,0 +1,473 @@
+import argparse
+import ast
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from jssb25 import isTupleColumn
+from storage import arrowTable, readArrowTable, readTable
+
+# Columns of the cleaned listings the catalog indexes:
+# a bitmap index (and posting lists) on the categories, sorted arrays for ranges of numbers,
+# and an inverted index on the columns of tuples (a categorical column of tuples, like color
+# with colors='sets', gets one too)
+BITMAPCOLUMNS = ['brand', 'color', 'os', 'cpuBrand', 'cpuModel', 'gpuBrand', 'gpuModel', 'graphics', 'harddisk_range_gb']
+RANGECOLUMNS = ['price_dollar', 'ram_gb', 'screen_size_in', 'harddisk_gb', 'rating']
+INVERTEDCOLUMNS = ['special_features']
+
+# Options of buildCatalog, keys missing from the given config keep these values
+CATALOGCONFIG = {
+    # The sorted rows of every range column are split into about this many bins, with a bitmap of the rows
+    # before each bin. A range query reads two bitmaps and checks the rows of at most two bins one by one
+    'rangeBins': 128,
+    # Values (and terms) on at least this share of the rows get a bitmap, the others only a posting list
+    'denseShare': 1 / 64,
+}
+
+# Files of a saved catalog: the description of the indexes, the listings and one .npy file per array
+MANIFESTFILE = 'manifest.json'
+ROWSFILE = 'rows.arrow'
+CATALOGLAYOUT = 1
+
+# Rows as a bitmap: bit i of word i // 64 is row i
+def wordCount(rows):
+    return -(-rows // 64)
+
+# Bitmap of some rows
+def rowBits(ids, rows):
+    mask = np.zeros(wordCount(rows) * 64, dtype=bool)
+    mask[ids] = True
+    return np.packbits(mask, bitorder='little').view(np.uint64)
+
+# Bitmap of every row (the bits after the last row stay 0)
+def allBits(rows):
+    bits = np.full(wordCount(rows), np.uint64(2**64 - 1))
+    if rows % 64:
+        bits[-1] = np.packbits(np.arange(64) < rows % 64, bitorder='little').view(np.uint64)[0]
+    return bits
+
+# Whether each row is in a bitmap
+def hasBits(bits, ids):
+    return (bits.view(np.uint8)[ids >> 3] >> (ids & 7).astype(np.uint8)) & 1 == 1
+
+# Sorted rows of a bitmap. Sparse bitmaps only unpack their nonzero words
+def bitsRows(bits):
+    nonzero = np.flatnonzero(bits)
+    if len(nonzero) * 8 > len(bits):
+        return np.flatnonzero(np.unpackbits(bits.view(np.uint8), bitorder='little'))
+    flat = np.flatnonzero(np.unpackbits(bits[nonzero].view(np.uint8), bitorder='little'))
+    return nonzero[flat >> 6] * 64 + (flat & 63)
+
+# Posting lists of codes (-1 for none): the sorted rows of every code, as one array and the offsets of each
+# code in it. codes may list a row several times (a row with several terms), rows gives the row of each code
+def postingLists(codes, count, rows=None):
+    rows = np.arange(len(codes)) if rows is None else rows
+    order = np.argsort(codes, kind='stable')
+    order = order[np.searchsorted(codes[order], 0):]
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(codes[order], minlength=count))])
+    return rows[order].astype(idType(len(rows))), offsets
+
+def idType(rows):
+    return np.int32 if rows < 2**31 else np.int64
+
+# Index of a column of categories: the code of every row, posting lists, and a bitmap for the dense values
+def bitmapIndex(values, rows, config):
+    categorical = pd.Categorical(values)
+    labels = [str(value) for value in categorical.categories]
+    codes = categorical.codes.astype(np.int32)
+    postings, offsets = postingLists(codes, len(labels))
+    return {'kind': 'bitmap', 'values': labels, 'codes': codes, 'postings': postings, 'offsets': offsets,
+            **denseBitmaps(postings, offsets, rows, config)}
+
+# Index of a column of tuples: the posting list of every term (the rows with it in their tuple)
+# and a bitmap for the dense terms
+def invertedIndex(values, rows, config):
+    codes, tuples = pd.factorize(values)
+    terms, termCodes = {}, []
+    for value in tuples:
+        termCodes.append([terms.setdefault(str(term), len(terms)) for term in value])
+    lengths = np.array([len(value) for value in termCodes] + [0])
+    flat = np.array([term for value in termCodes for term in value], dtype=np.int64)
+    starts = np.concatenate([[0], np.cumsum(lengths[:-1])])
+    perRow = lengths[codes] # codes of missing values are -1, the last length (0)
+    rowOf = np.repeat(np.arange(rows), perRow)
+    within = np.arange(len(rowOf)) - np.repeat(np.cumsum(perRow) - perRow, perRow)
+    rowTerms = flat[starts[codes[rowOf]] + within] if len(rowOf) else np.empty(0, dtype=np.int64)
+    postings, offsets = postingLists(rowTerms, len(terms), rowOf)
+    return {'kind': 'inverted', 'values': list(terms), 'postings': postings, 'offsets': offsets,
+            **denseBitmaps(postings, offsets, rows, config)}
+
+def denseBitmaps(postings, offsets, rows, config):
+    counts = np.diff(offsets)
+    dense = np.flatnonzero(counts >= max(config['denseShare'] * rows, 1))
+    bitmaps = np.zeros((len(dense), wordCount(rows)), dtype=np.uint64)
+    for i, value in enumerate(dense):
+        bitmaps[i] = rowBits(postings[offsets[value]:offsets[value + 1]], rows)
+    slots = np.full(len(counts), -1, dtype=np.int32)
+    slots[dense] = np.arange(len(dense))
+    return {'bitmaps': bitmaps, 'slots': slots}
+
+# Index of a column of numbers: the values, the rows sorted by value (missing values last), the edges of
+# about rangeBins bins of sorted rows and, for every edge, the bitmap of the rows sorted before it
+def rangeIndex(values, rows, config):
+    values = np.asarray(values, dtype=float)
+    order = np.argsort(values, kind='stable').astype(idType(rows))
+    sortedValues = values[order]
+    valid = int(np.count_nonzero(~np.isnan(values)))
+    edges = binEdges(sortedValues[:valid], config['rangeBins'])
+    cumulative = np.zeros((len(edges), wordCount(rows)), dtype=np.uint64)
+    for b in range(1, len(edges)):
+        cumulative[b] = cumulative[b - 1] | rowBits(order[edges[b - 1]:edges[b]], rows)
+    return {'kind': 'range', 'values': values, 'order': order, 'sorted': sortedValues, 'valid': valid,
+            'edges': edges, 'cumulative': cumulative}
+
+# Bins only start where the sorted value changes, so a range of whole values (ram_gb=8:16) has no partial rows.
+# A column with few distinct values gets a bin per value, the others bins of about the same size
+def binEdges(sortedValues, bins):
+    count = len(sortedValues)
+    changes = np.concatenate([[0], np.flatnonzero(sortedValues[1:] != sortedValues[:-1]) + 1, [count]])
+    if len(changes) <= bins + 1:
+        return np.unique(changes).astype(np.int64)
+    position = np.searchsorted(changes, np.linspace(0, count, bins + 1))
+    before, after = changes[np.maximum(position - 1, 0)], changes[np.minimum(position, len(changes) - 1)]
+    targets = np.linspace(0, count, bins + 1)
+    return np.unique(np.where(targets - before <= after - targets, before, after)).astype(np.int64)
+
+# Arrays of an index, the rest is saved in the manifest
+ARRAYS = ['codes', 'postings', 'offsets', 'bitmaps', 'slots', 'values', 'order', 'sorted', 'edges', 'cumulative']
+
+# Columns of tuples: special_features, and color when a listing keeps all its colors. Read back from a file
+# they are lists (Parquet and Arrow) or the text of the tuples (Excel and CSV)
+def isTupleLike(df, column):
+    if column in INVERTEDCOLUMNS or isTupleColumn(df[column]):
+        return True
+    values = df[column].dropna()
+    first = values.iloc[0] if len(values) else None
+    return isinstance(first, (tuple, list, np.ndarray)) or (isinstance(first, str) and first.startswith('('))
+
+# Cleaned listings numbered from 0, with the columns of tuples as tuples
+def catalogFrame(df):
+    df = df.reset_index(drop=True)
+    for column in df.columns:
+        if isTupleLike(df, column) and not isTupleColumn(df[column]):
+            df[column] = df[column].astype(object).map(tupleValue, na_action='ignore')
+    return df
+
+def tupleValue(value):
+    if isinstance(value, str):
+        value = ast.literal_eval(value) if value.startswith('(') else (value,)
+    return tuple(value)
+
+# (low, high) of the filter of a range column, a single value is both
+def rangeBounds(condition):
+    return tuple(condition) if isinstance(condition, (list, tuple)) else (condition, condition)
+
+# Indexes of the cleaned listings and the listings themselves (as an Arrow table)
+# Queries take filters, a dict of column to:
+#   a value or a list of values for a bitmap column (rows with any of them),
+#   a (low, high) pair for a range column (inclusive, None leaves a side open) or a single value,
+#   a term or a list of terms for an inverted column (rows with all of them)
+class Catalog:
+    def __init__(self, indexes, table):
+        self.indexes = indexes
+        self.table = table
+        self.rows = table.num_rows
+        self.lookups = {column: {value: i for i, value in enumerate(index['values'])}
+                        for column, index in indexes.items() if index['kind'] != 'range'}
+
+    # Rows of one filter: covered is a bitmap of rows which match (None: no bitmap, empty), partial holds
+    # the rows which may match and must be checked one by one. Every matching row is in one of them.
+    # test is the exact check of rows, size the number of rows in covered and partial
+    def predicate(self, column, condition):
+        if column not in self.indexes:
+            raise ValueError(f'No index on column {column!r}, indexed: {sorted(self.indexes)}')
+        index = self.indexes[column]
+        if index['kind'] == 'range':
+            return self.rangePredicate(index, condition)
+        wanted = condition if isinstance(condition, (list, tuple, set, frozenset)) else [condition]
+        codes = list(dict.fromkeys(self.lookups[column][str(value)] for value in wanted if str(value) in self.lookups[column]))
+        if index['kind'] == 'bitmap':
+            return self.bitmapPredicate(index, codes)
+        known = all(str(value) in self.lookups[column] for value in wanted)
+        return self.invertedPredicate(index, codes if known else None) # None: a term no row has
+
+    def bitmapPredicate(self, index, codes):
+        covered, partial = None, []
+        for code in codes:
+            slot = index['slots'][code]
+            if slot >= 0:
+                covered = index['bitmaps'][slot] if covered is None else covered | index['bitmaps'][slot]
+            else:
+                partial.append(index['postings'][index['offsets'][code]:index['offsets'][code + 1]])
+        accepted = np.zeros(len(index['values']) + 1, dtype=bool)
+        accepted[np.array(codes, dtype=np.int64) + 1] = True # Missing values are code -1
+        partial = np.concatenate(partial) if partial else np.empty(0, dtype=np.int64)
+        size = sum(index['offsets'][code + 1] - index['offsets'][code] for code in codes)
+        return {'covered': covered, 'partial': partial, 'size': size,
+                'test': lambda ids: accepted[index['codes'][ids] + 1]}
+
+    # Rows with all the terms: the bitmaps of the terms if they all have one, otherwise the rows of the rarest
+    def invertedPredicate(self, index, codes):
+        if codes is None:
+            return {'covered': None, 'partial': np.empty(0, dtype=np.int64), 'size': 0,
+                    'test': lambda ids: np.zeros(len(ids), dtype=bool)}
+        postings = [index['postings'][index['offsets'][code]:index['offsets'][code + 1]] for code in codes]
+        def test(ids):
+            keep = np.ones(len(ids), dtype=bool)
+            for rows in postings:
+                position = np.minimum(np.searchsorted(rows, ids), len(rows) - 1)
+                keep &= rows[position] == ids
+            return keep
+        slots = [index['slots'][code] for code in codes]
+        if all(slot >= 0 for slot in slots):
+            covered = allBits(self.rows)
+            for slot in slots:
+                covered &= index['bitmaps'][slot]
+            return {'covered': covered, 'partial': np.empty(0, dtype=np.int64),
+                    'size': min(map(len, postings), default=self.rows), 'test': test}
+        rarest = min(postings, key=len)
+        return {'covered': None, 'partial': rarest, 'size': len(rarest), 'test': test}
+
+    # The rows between low and high are a slice of the sorted rows: the whole bins inside it are covered
+    # by two cumulative bitmaps, the rows of the bins at its ends are partial
+    def rangePredicate(self, index, condition):
+        low, high = rangeBounds(condition)
+        start, stop = self.rangePositions(index, low, high)
+        edges, order = index['edges'], index['order']
+        first = int(np.searchsorted(edges, start, side='left'))
+        last = int(np.searchsorted(edges, stop, side='right')) - 1
+        values = index['values']
+        low = -np.inf if low is None else low
+        high = np.inf if high is None else high
+        test = lambda ids: (values[ids] >= low) & (values[ids] <= high)
+        if first >= last:
+            return {'covered': None, 'partial': order[start:stop], 'size': stop - start, 'test': test}
+        covered = index['cumulative'][last]
+        if first:
+            covered = covered & ~index['cumulative'][first]
+        partial = np.concatenate([order[start:edges[first]], order[edges[last]:stop]])
+        return {'covered': covered, 'partial': partial, 'size': stop - start, 'test': test}
+
+    # Slice of the sorted rows with values from low to high (missing values are never in it)
+    def rangePositions(self, index, low, high):
+        valid = index['sorted'][:index['valid']]
+        start = 0 if low is None else int(np.searchsorted(valid, low, side='left'))
+        stop = index['valid'] if high is None else int(np.searchsorted(valid, high, side='right'))
+        return start, max(start, stop)
+
+    def predicates(self, filters):
+        return [self.predicate(column, condition) for column, condition in (filters or {}).items()]
+
+    # Matching rows: the rows covered by every filter, and the sorted partial rows passing every exact check.
+    # If a filter covers nothing, every match is one of its partial rows, only the smallest such set is checked.
+    # A matching row may be partial for several filters, it is kept for the first one only: its partial rows
+    # are dropped from the next ones by their bit in its covered bitmap (a matching row is in one of the two)
+    def match(self, predicates):
+        if not predicates:
+            return allBits(self.rows), np.empty(0, dtype=np.int64)
+        uncovered = [predicate for predicate in predicates if predicate['covered'] is None]
+        if uncovered:
+            candidates = min(uncovered, key=lambda predicate: len(predicate['partial']))['partial']
+            return None, self.check(np.sort(candidates), predicates)
+        covered = predicates[0]['covered']
+        for predicate in predicates[1:]:
+            covered = covered & predicate['covered']
+        extra = []
+        for i, predicate in enumerate(predicates):
+            ids = predicate['partial']
+            for earlier in predicates[:i]:
+                ids = ids[hasBits(earlier['covered'], ids)]
+            extra.append(self.check(ids, predicates))
+        return covered, np.sort(np.concatenate(extra))
+
+    def check(self, ids, predicates):
+        for predicate in sorted(predicates, key=lambda predicate: predicate['size']):
+            if not len(ids):
+                break
+            ids = ids[predicate['test'](ids)]
+        return ids
+
+    # Number of matching rows
+    def count(self, filters=None):
+        covered, extra = self.match(self.predicates(filters))
+        return len(extra) + (int(np.bitwise_count(covered).sum()) if covered is not None else 0)
+
+    # Sorted matching rows
+    def select(self, filters=None):
+        predicates = self.predicates(filters)
+        if not predicates:
+            return np.arange(self.rows)
+        covered, extra = self.match(predicates)
+        if covered is None:
+            return extra
+        return np.sort(np.concatenate([bitsRows(covered), extra]), kind='stable') # Two sorted runs, covered rows are not partial
+
+    # The k first matching rows by orderBy (a range column), missing values last and equal values in row order,
+    # the rows of df[mask].sort_values(orderBy, ascending=not descending, kind='stable').head(k)
+    # Few matches are sorted. Otherwise the rows are read in the order of orderBy (only the slice of its
+    # filter, if it has one) and checked until k match, which reads about k / (share of the rows matching) rows
+    def top(self, filters=None, orderBy='price_dollar', k=10, descending=False):
+        index = self.indexes.get(orderBy)
+        if index is None or index['kind'] != 'range':
+            raise ValueError(f'Cannot order by {orderBy!r}, the range columns are {sorted(self.rangeColumns())}')
+        predicates = self.predicates(filters)
+        covered, extra = self.match(predicates)
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        count = len(extra) + (int(np.bitwise_count(covered).sum()) if covered is not None else 0)
+        if covered is None or count < k * 64:
+            ids = extra if covered is None else np.concatenate([bitsRows(covered), extra])
+            return self.sortRows(index, ids, descending)[:k]
+        if orderBy in (filters or {}):
+            start, stop = self.rangePositions(index, *rangeBounds(filters[orderBy]))
+            spans = [(stop, start)] if descending else [(start, stop)]
+        else:
+            spans = [(index['valid'], 0), (index['valid'], self.rows)] if descending else [(0, self.rows)]
+        ids = self.sortRows(index, self.collect(index, spans, predicates, k), descending)[:k]
+        # Rows with the value of the k-th row come in row order, the ones not read yet may come before it
+        tie = index['values'][ids[-1]]
+        before = ids[~np.isnan(index['values'][ids]) if np.isnan(tie) else index['values'][ids] != tie]
+        start, stop = (index['valid'], self.rows) if np.isnan(tie) else self.rangePositions(index, tie, tie)
+        ties = self.collect(index, [(start, stop)], predicates, k - len(before))
+        return np.concatenate([before, ties[:k - len(before)]])
+
+    # The first matching rows of the spans of sorted rows, at least k of them if there are
+    def collect(self, index, spans, predicates, k):
+        found, count = [], 0
+        for positions in self.walk(spans):
+            found.append(self.check(index['order'][positions], predicates))
+            count += len(found[-1])
+            if count >= k:
+                break
+        return np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+
+    # Positions of spans of the sorted rows, (start, stop) read up from start or down when stop is before it,
+    # a chunk at a time (growing, for small k). Descending reads the values from the last one down,
+    # then the missing values
+    def walk(self, spans):
+        size = 1024
+        for start, stop in spans:
+            while start != stop:
+                if start < stop:
+                    end = min(start + size, stop)
+                    yield np.arange(start, end)
+                else:
+                    end = max(start - size, stop)
+                    yield np.arange(start - 1, end - 1, -1)
+                start = end
+                size = min(size * 2, 2**16)
+
+    def sortRows(self, index, ids, descending):
+        values = index['values'][ids]
+        missing = np.isnan(values)
+        return ids[np.lexsort((ids, -values if descending else values, missing))]
+
+    def rangeColumns(self):
+        return [column for column, index in self.indexes.items() if index['kind'] == 'range']
+
+    # Listings of the rows in the given order, indexed by row
+    def listings(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        return self.table.take(ids).to_pandas().set_axis(pd.Index(ids), axis=0)
+
+    # One line per index: its kind, distinct values (or the value range) and memory
+    def describe(self):
+        lines = []
+        for column, index in self.indexes.items():
+            size = sum(index[name].nbytes for name in ARRAYS if isinstance(index.get(name), np.ndarray)) / 2**20
+            if index['kind'] == 'range':
+                valid = index['sorted'][:index['valid']]
+                detail = f'{valid[0]:g} to {valid[-1]:g}' if len(valid) else 'no values'
+            else:
+                detail = f"{len(index['values'])} values, {len(index['bitmaps'])} bitmaps"
+            lines.append(f"{column:<20}{index['kind']:<10}{detail:<32}{size:>8.1f} MB")
+        return '\n'.join(lines)
+
+# Catalog of cleaned listings (a frame as clean() returns or as read back from the cleaned file)
+def buildCatalog(df, config=None):
+    config = {**CATALOGCONFIG, **(config or {})}
+    if config['rangeBins'] < 1 or not 0 < config['denseShare'] <= 1:
+        raise ValueError(f'Invalid catalog options: {config}')
+    df = catalogFrame(df)
+    rows = len(df)
+    indexes = {}
+    for column in df.columns:
+        if isTupleLike(df, column):
+            indexes[column] = invertedIndex(df[column], rows, config)
+        elif column in BITMAPCOLUMNS:
+            indexes[column] = bitmapIndex(df[column], rows, config)
+        elif column in RANGECOLUMNS:
+            indexes[column] = rangeIndex(df[column], rows, config)
+    return Catalog(indexes, arrowTable(df))
+
+# A directory with the manifest, the listings as an Arrow file and every array as a .npy file
+def saveCatalog(catalog, directory):
+    import pyarrow as pa
+    os.makedirs(directory, exist_ok=True)
+    manifest = {'layout': CATALOGLAYOUT, 'rows': catalog.rows, 'indexes': {}}
+    for column, index in catalog.indexes.items():
+        manifest['indexes'][column] = {name: value for name, value in index.items() if name not in ARRAYS}
+        if index['kind'] != 'range':
+            manifest['indexes'][column]['values'] = index['values']
+        for name in ARRAYS:
+            if name in index and not (name == 'values' and index['kind'] != 'range'):
+                np.save(os.path.join(directory, f'{column}.{name}.npy'), index[name])
+    with pa.OSFile(os.path.join(directory, ROWSFILE), 'wb') as sink, pa.ipc.new_file(sink, catalog.table.schema) as writer:
+        writer.write_table(catalog.table)
+    with open(os.path.join(directory, MANIFESTFILE), 'w') as file:
+        json.dump(manifest, file)
+
+# The arrays and the listings are memory-mapped, only the pages a query reads are loaded
+def loadCatalog(directory):
+    with open(os.path.join(directory, MANIFESTFILE)) as file:
+        manifest = json.load(file)
+    if manifest.get('layout') != CATALOGLAYOUT:
+        raise ValueError(f"Catalog layout {manifest.get('layout')!r} is not {CATALOGLAYOUT}")
+    indexes = {}
+    for column, index in manifest['indexes'].items():
+        for name in ARRAYS:
+            path = os.path.join(directory, f'{column}.{name}.npy')
+            if os.path.exists(path):
+                index[name] = np.load(path, mmap_mode='r').view(np.ndarray) # Indexing a np.memmap is slow
+        indexes[column] = index
+    return Catalog(indexes, readArrowTable(os.path.join(directory, ROWSFILE)))
+
+# A filter of the command line: column=value[,value...] or, for a range column, column=low:high (a side may
+# be left empty). Values of bitmap and inverted columns are matched as text
+def parseFilter(text):
+    column, _, condition = text.partition('=')
+    if column not in RANGECOLUMNS:
+        return column, condition.split(',')
+    if ':' not in condition:
+        return column, float(condition)
+    low, high = condition.split(':', 1)
+    return column, (float(low) if low else None, float(high) if high else None)
+
+# Usage: python catalog.py build <cleaned file> <directory>
+#        python catalog.py query <directory> [--filter column=value ...] [--order-by column] [--descending] [--limit k]
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build or query the indexes of the cleaned listings.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='index a cleaned file into a directory')
+    build.add_argument('input')
+    build.add_argument('directory')
+    query = commands.add_parser('query', help='print the first matching listings')
+    query.add_argument('directory')
+    query.add_argument('--filter', action='append', default=[], help='column=value[,value] or column=low:high')
+    query.add_argument('--order-by', default='price_dollar')
+    query.add_argument('--descending', action='store_true')
+    query.add_argument('--limit', type=int, default=10)
+    args = parser.parse_args()
+    if args.command == 'build':
+        catalog = buildCatalog(readTable(args.input))
+        saveCatalog(catalog, args.directory)
+        print(catalog.describe())
+    else:
+        catalog = loadCatalog(args.directory)
+        filters = dict(parseFilter(text) for text in args.filter)
+        ids = catalog.top(filters, args.order_by, args.limit, args.descending)
+        print(f'{catalog.count(filters)} of {catalog.rows} listings match')
+        with pd.option_context('display.width', 200, 'display.max_columns', None):
+            print(catalog.listings(ids))
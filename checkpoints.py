@@ -0,0 +1,344 @@
+import argparse
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import re
+import sys
+import types
+
+import numpy as np
+import pandas as pd
+
+from incremental import fileDigest
+from profiling import profiled
+from rules import RuleFile
+
+# Checkpoints are kept here unless another directory is given, up to CHECKPOINTSIZE bytes in all
+CHECKPOINTDIR = '.checkpoints'
+CHECKPOINTSIZE = 2**30
+# File formats a checkpoint can be written in, and their extensions
+CHECKPOINTFORMATS = {'feather': '.feather', 'parquet': '.parquet'}
+# Layout of the checkpoint files. The layout, Python, pandas and numpy versions are part of every key,
+# so a checkpoint is never read by code that could decode it differently
+CHECKPOINTLAYOUT = 1
+ENVIRONMENT = repr((CHECKPOINTLAYOUT, sys.version, pd.__version__, np.__version__))
+
+CODEDIR = os.path.dirname(os.path.abspath(__file__))
+
+# Whether a function or class is defined by this code (and not by a library)
+def isOwnCode(value):
+    module = sys.modules.get(getattr(value, '__module__', None))
+    fileName = getattr(module, '__file__', None)
+    return fileName is not None and os.path.dirname(os.path.abspath(fileName)) == CODEDIR
+
+# Global names a code object looks up, with the ones of the lambdas and comprehensions inside it
+def codeNames(code):
+    names = list(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names += codeNames(const)
+    return names
+
+# Source of a function or class, kept per code object: the code which runs does not change when its
+# file is edited, until the module is imported again
+SOURCES = {}
+
+def sourceOf(value):
+    code = getattr(value, '__code__', value)
+    if code not in SOURCES:
+        SOURCES[code] = inspect.getsource(value)
+    return SOURCES[code]
+
+# Add the text of what value computes to parts: the source of the functions and classes of this code,
+# followed through the globals they use (the functions they call, the rule tables and mappings they read).
+# Rule files give the digest of their rules, library functions only their names (the library versions
+# are part of every key) and other objects, like the normalization caches, only their type
+def fingerprintParts(value, parts, seen):
+    if isinstance(value, functools.partial):
+        fingerprintParts(value.func, parts, seen)
+        fingerprintParts(value.args, parts, seen)
+        fingerprintParts(value.keywords, parts, seen)
+    elif isinstance(value, RuleFile):
+        parts.append(value.digest)
+    elif isinstance(value, re.Pattern):
+        parts.append(repr((value.pattern, value.flags)))
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            fingerprintParts(key, parts, seen)
+            fingerprintParts(item, parts, seen)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            fingerprintParts(item, parts, seen)
+    elif isinstance(value, (set, frozenset)):
+        parts.append(repr(sorted(map(repr, value))))
+    elif isinstance(value, (str, bytes, int, float, bool, type(None), np.generic)):
+        parts.append(repr(value))
+    elif isinstance(value, np.ndarray):
+        parts.append(hashlib.sha256(repr((value.dtype, value.shape)).encode() + value.tobytes()).hexdigest())
+    elif (inspect.isfunction(value) or inspect.isclass(value)) and isOwnCode(value):
+        parts.append(value.__qualname__)
+        if id(value) in seen:
+            return
+        seen.add(id(value))
+        parts.append(sourceOf(value))
+        functions = [value] if inspect.isfunction(value) else [item for item in vars(value).values() if inspect.isfunction(item)]
+        for function in functions:
+            for name in dict.fromkeys(codeNames(function.__code__)):
+                if name in function.__globals__:
+                    parts.append(name)
+                    fingerprintParts(function.__globals__[name], parts, seen)
+            fingerprintParts(function.__defaults__, parts, seen)
+            fingerprintParts([cell.cell_contents for cell in function.__closure__ or []], parts, seen)
+    elif hasattr(value, '__qualname__'):
+        parts.append(f"{getattr(value, '__module__', None)}.{value.__qualname__}")
+    else:
+        parts.append(type(value).__qualname__)
+
+# Fingerprint of a stage function (or partial): changes when its source, the source of anything of this
+# code it uses or a rule table it reads changes
+def stageFingerprint(func):
+    parts = []
+    fingerprintParts(func, parts, set())
+    return hashlib.sha256('\n'.join(parts).encode()).hexdigest()
+
+# Key of the output of a stage: the key of its input (the output of the stage before), its name and fingerprint
+def stageKey(inputKey, name, func):
+    return hashlib.sha256(f'{inputKey}\n{name}\n{stageFingerprint(func)}'.encode()).hexdigest()
+
+# Key of a raw frame: its columns, types, index and values
+# hash_pandas_object hashes the text of the values of a mixed column (5 and '5' hash the same),
+# so the types of the values of those columns are hashed too
+def frameKey(df):
+    digest = hashlib.sha256(ENVIRONMENT.encode())
+    digest.update(repr((list(df.columns), list(df.dtypes.astype(str)), str(df.index.dtype))).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    for column in df.columns:
+        values = df[column].to_numpy()
+        if values.dtype == object and pd.api.types.infer_dtype(values, skipna=True) != 'string':
+            digest.update(repr([type(value).__name__ for value in values]).encode())
+    return digest.hexdigest()
+
+# Key of a raw file, from its bytes (no need to read it as a table)
+def fileKey(fileName):
+    return hashlib.sha256(f'{ENVIRONMENT}\n{fileDigest(fileName)}'.encode()).hexdigest()
+
+# Arrow table of a frame, which decodeFrame turns back into an equal frame
+# Numbers are stored as they are. Categories are stored as their codes, object columns (text, mixed types,
+# tuples) as the codes of their distinct values, which also makes the files smaller. The categories and
+# distinct values are pickled into the schema metadata, with info (the stage and row count)
+def encodeFrame(df, info):
+    import pyarrow as pa
+    columns, kinds = {}, {}
+    for column in df.columns:
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            columns[column] = values.cat.codes.to_numpy()
+            kinds[column] = ('category', values.cat.categories, values.cat.ordered)
+        elif values.dtype == object:
+            columns[column], uniques = objectCodes(values.to_numpy())
+            kinds[column] = ('object', uniques)
+        else:
+            columns[column] = values.array # Not the Series, which would be aligned on a repeated index
+            kinds[column] = ('plain',)
+    frame = pd.DataFrame(columns, index=df.index)
+    frame.columns = df.columns
+    table = pa.Table.from_pandas(frame, preserve_index=True)
+    metadata = {**(table.schema.metadata or {}), b'checkpoint': pickle.dumps({**info, 'kinds': kinds, 'rows': len(df)})}
+    return table.replace_schema_metadata(metadata)
+
+# Codes and distinct values of an object column. factorize turns None into NaN,
+# so the None among the missing values get a code of their own
+def objectCodes(values):
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    uniques = np.asarray(uniques, dtype=object)
+    missing = np.flatnonzero(pd.isna(values))
+    isNone = np.equal(values[missing], None)
+    if isNone.any():
+        codes[missing[isNone]] = len(uniques)
+        uniques = np.append(uniques, np.array([None], dtype=object))
+    return codes, uniques
+
+def decodeFrame(table):
+    info = checkpointInfo(table.schema)
+    df = table.to_pandas()
+    for column, kind in info['kinds'].items():
+        if kind[0] == 'category':
+            df[column] = pd.Categorical.from_codes(df[column].to_numpy(), categories=kind[1], ordered=kind[2])
+        elif kind[0] == 'object':
+            df[column] = pd.Series(kind[1][df[column].to_numpy()], index=df.index, dtype=object)
+    return df
+
+def checkpointInfo(schema):
+    return pickle.loads(schema.metadata[b'checkpoint'])
+
+def writeCheckpoint(table, fileName, fileFormat):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    if fileFormat == 'parquet':
+        pq.write_table(table, fileName)
+    else:
+        with pa.OSFile(fileName, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+# Feather files are memory-mapped, the columns are only copied when converted to pandas
+def readCheckpoint(fileName):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    if fileName.endswith(CHECKPOINTFORMATS['parquet']):
+        return pq.read_table(fileName, memory_map=True)
+    return pa.ipc.open_file(pa.memory_map(fileName)).read_all()
+
+# Schema of a checkpoint file, without reading its columns
+def readCheckpointSchema(fileName):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    if fileName.endswith(CHECKPOINTFORMATS['parquet']):
+        return pq.read_schema(fileName)
+    return pa.ipc.open_file(pa.memory_map(fileName)).schema
+
+# Directory of stage outputs, one file per key (content addressed: the key is a hash of the input and
+# of every stage up to the output). Files are used least recently first when the directory grows over
+# maxBytes. hits counts the stages skipped thanks to a checkpoint, misses the stages run
+class CheckpointCache:
+    def __init__(self, directory=CHECKPOINTDIR, maxBytes=None, fileFormat='feather'):
+        if fileFormat not in CHECKPOINTFORMATS:
+            raise ValueError(f'Unknown checkpoint format: {fileFormat!r}')
+        self.directory = directory
+        self.maxBytes = CHECKPOINTSIZE if maxBytes is None else maxBytes
+        self.format = fileFormat
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key + CHECKPOINTFORMATS[self.format])
+
+    # Frame saved under key, None if there is none or it cannot be read (a damaged file is written again)
+    # Loading a checkpoint marks it as used, for the eviction
+    def load(self, key):
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            df = decodeFrame(readCheckpoint(path))
+        except (OSError, ValueError, KeyError, pickle.UnpicklingError):
+            return None
+        os.utime(path)
+        return df
+
+    # Written to a temporary file first, so a run stopped halfway (or another run) never sees half a file
+    def save(self, key, df, stage):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        temporary = f'{path}.{os.getpid()}.tmp'
+        writeCheckpoint(encodeFrame(df, {'stage': stage}), temporary, self.format)
+        os.replace(temporary, path)
+        self.writes += 1
+        self.evict(keep=path)
+
+    # Size, last use and path of every checkpoint file
+    def files(self):
+        if not os.path.isdir(self.directory):
+            return []
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and os.path.splitext(entry.name)[1] in CHECKPOINTFORMATS.values():
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError: # Evicted by another run meanwhile
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    # Remove the checkpoints used longest ago until the directory holds at most maxBytes,
+    # never the one just written
+    def evict(self, keep=None):
+        files = self.files()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.maxBytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
+
+    # One row per checkpoint: its key, stage, rows, size and last use, most recently used first
+    def entries(self):
+        rows = []
+        for used, size, path in self.files():
+            try:
+                info = checkpointInfo(readCheckpointSchema(path))
+            except (OSError, ValueError, KeyError, pickle.UnpicklingError):
+                info = {'stage': None, 'rows': None}
+            rows.append({
+                'key': os.path.splitext(os.path.basename(path))[0],
+                'stage': info['stage'],
+                'rows': info['rows'],
+                'MB': size / 2**20,
+                'used': pd.Timestamp(used, unit='s'),
+            })
+        columns = ['key', 'stage', 'rows', 'MB', 'used']
+        return pd.DataFrame(rows, columns=columns).sort_values('used', ascending=False, ignore_index=True)
+
+    # Remove every checkpoint (and the temporary files of runs which stopped halfway), returns how many
+    def clear(self):
+        removed = 0
+        if not os.path.isdir(self.directory):
+            return removed
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and (os.path.splitext(entry.name)[1] in CHECKPOINTFORMATS.values()
+                                    or entry.name.endswith('.tmp')):
+                os.remove(entry.path)
+                removed += 1
+        return removed
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'writes': self.writes, 'evictions': self.evictions}
+
+    # Run the stages, (name, function of the frame) pairs, on df. The key of each stage chains the key
+    # of its input with its name and fingerprint, so the output of a stage is only found when the input
+    # and every stage up to it are unchanged. The run starts from the output of the last stage found
+    # (the longest unchanged prefix, df is not used then) and saves the output of every stage it runs.
+    # Returns the output and its key
+    def run(self, df, stages, key, profiler=None):
+        keys = []
+        for name, func in stages:
+            key = stageKey(key, name, func)
+            keys.append(key)
+        start = 0
+        for i in reversed(range(len(stages))):
+            if not os.path.exists(self.path(keys[i])):
+                continue
+            cached = profiled(profiler, f'loadCheckpoint ({stages[i][0]})', self.load, keys[i])
+            if cached is not None:
+                df, start = cached, i + 1
+                break
+        self.hits += start
+        self.misses += len(stages) - start
+        for (name, func), stageKeyOf in zip(stages[start:], keys[start:]):
+            df = profiled(profiler, name, func, df)
+            profiled(profiler, f'saveCheckpoint ({name})', self.save, stageKeyOf, df, name)
+        return df, key
+
+# Usage: python checkpoints.py {list,clear} [--dir DIR]
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inspect or clear the stage checkpoints of cleanData.')
+    parser.add_argument('command', choices=['list', 'clear'])
+    parser.add_argument('--dir', default=CHECKPOINTDIR, help='checkpoint directory')
+    args = parser.parse_args()
+    checkpoints = CheckpointCache(args.dir)
+    if args.command == 'clear':
+        print(f'Removed {checkpoints.clear()} checkpoint files from {args.dir}')
+    else:
+        entries = checkpoints.entries()
+        with pd.option_context('display.width', 200, 'display.max_rows', None, 'display.max_colwidth', 20):
+            print(entries.to_string(index=False, float_format='{:.2f}'.format) if len(entries) else 'No checkpoints')
+        print(f"{len(entries)} checkpoints, {entries['MB'].sum():.1f} MB in {args.dir}")
@@ -0,0 +1,234 @@
+import os
+import sys
+import tempfile
+
+import pandas as pd
+
+from jssb25 import clean, cleanCategorical, cleanCPU, cleanCPUPasses, cleanGPU, cleanGPUPasses
+from storage import readTable, writeTable
+
+# First rows of the bundled listings, as read by cleanData
+def loadSlice(rows):
+    return pd.read_excel('amazon_laptop_2023.xlsx').head(rows)
+
+# The streamed output, written and read back as CSV, against clean() on the whole slice
+# written the same way (CSV loses the column types, so both go through it), with the fixed
+# outlier limits and with limits at a quantile of the data
+def checkStream(rows):
+    from streaming import cleanStream
+
+    raw = loadSlice(rows)
+    with tempfile.TemporaryDirectory() as directory:
+        fileName = os.path.join(directory, 'input.csv')
+        raw.to_csv(fileName, index=False)
+        for quantile in [None, 0.99]:
+            writeTable(clean(readTable(fileName), {'outlierQuantile': quantile}), os.path.join(directory, 'expected.csv'))
+            expected = readTable(os.path.join(directory, 'expected.csv'))
+            for chunkSize in [max(rows // 7, 1), max(rows // 2, 1), rows]:
+                cleanStream(fileName, os.path.join(directory, 'output.csv'), chunkSize, outlierQuantile=quantile)
+                result = readTable(os.path.join(directory, 'output.csv'))
+                assert result.equals(expected), f'chunks of {chunkSize} rows do not match clean() (outlierQuantile {quantile})'
+                print(f'stream: chunks of {chunkSize} rows match clean() on {len(expected)} rows (outlierQuantile {quantile})')
+
+# clean() with worker processes against clean() in this process
+def checkParallel(rows):
+    raw = loadSlice(rows)
+    expected = clean(raw)
+    for workers in [2, 3]:
+        result = clean(raw, {'workers': workers})
+        assert result.equals(expected), f'{workers} workers do not match clean()'
+        print(f'parallel: {workers} workers match clean() on {len(expected)} rows')
+
+# cleanGPU and cleanCPU, which clean every distinct value once, against their chains of whole-column
+# passes on the rows they get inside cleanData, for the bundled listings and synthetic ones
+def checkGpuCpu(rows):
+    from synthetic import syntheticListings
+
+    categoricalData = ['brand', 'model', 'color', 'cpu', 'os', 'special_features', 'graphics', 'graphics_coprocessor']
+    for name, raw in [('bundled', loadSlice(rows)), ('synthetic', syntheticListings(rows))]:
+        raw.columns = raw.columns.str.lower().str.strip()
+        df = cleanCategorical(raw, categoricalData)
+        for stage, reference in [(cleanGPU, cleanGPUPasses), (cleanCPU, cleanCPUPasses)]:
+            result = stage(df.copy())
+            expected = reference(df.copy())
+            assert result.equals(expected), f'{stage.__name__} does not match {reference.__name__} on the {name} rows'
+            print(f'gpucpu: {stage.__name__} matches {reference.__name__} on {len(df)} {name} rows')
+
+# clean() with the polars engine (one lazy plan, see lazy.py) against the pandas stages, on the bundled
+# listings and on synthetic ones. The frames must be equal: rows, index, values and column types
+def checkLazy(rows):
+    from synthetic import syntheticListings
+
+    for name, raw in [('bundled', loadSlice(rows)), ('synthetic', syntheticListings(rows))]:
+        expected = clean(raw.copy())
+        result = clean(raw.copy(), {'engine': 'polars'})
+        assert result.equals(expected), f'the polars engine does not match clean() on the {name} rows'
+        print(f'lazy: the polars engine matches clean() on {len(expected)} {name} rows')
+
+# clean() with a checkpoint cache against clean() without one: a first run saving every stage, a run loading
+# the last one, a run after a change of the brand rules (which only runs cleanModelAndBrand and the stages
+# after it again), runs resuming after every stage, and the eviction down to the size limit
+def checkCheckpoints(rows):
+    import jssb25
+    from checkpoints import CheckpointCache
+
+    raw = loadSlice(rows)
+    expected = clean(raw.copy())
+    before, after = jssb25.cleanStages({**jssb25.CLEANCONFIG, 'checkpoints': True})
+    names = [name for name, _ in before + after]
+    with tempfile.TemporaryDirectory() as directory:
+        for fileFormat in ['feather', 'parquet']:
+            checkpoints = CheckpointCache(os.path.join(directory, fileFormat), fileFormat=fileFormat)
+            for run in ['first', 'second']:
+                result = clean(raw.copy(), {'checkpoints': checkpoints})
+                assert result.equals(expected), f'the {run} run with {fileFormat} checkpoints does not match clean()'
+            assert checkpoints.stats()['hits'] == len(names), f'the second run with {fileFormat} checkpoints ran stages'
+            print(f'checkpoints: {fileFormat} checkpoints of {len(names)} stages match clean() on {len(expected)} rows')
+
+        checkpoints = CheckpointCache(os.path.join(directory, 'feather'))
+        brandRules = jssb25.BRANDRULES
+        jssb25.BRANDRULES = jssb25.compileRules({**jssb25.BRANDMAPPING, 'not a brand': 'none'})
+        try:
+            result = clean(raw.copy(), {'checkpoints': checkpoints})
+        finally:
+            jssb25.BRANDRULES = brandRules
+        assert result.equals(expected), 'the run after a change of the brand rules does not match clean()'
+        assert checkpoints.misses == len(names) - names.index('cleanModelAndBrand'), \
+            f'a change of the brand rules ran {checkpoints.misses} stages'
+        print(f'checkpoints: a change of the brand rules runs the last {checkpoints.misses} stages')
+
+        for i, name in enumerate(names):
+            for entry in checkpoints.entries().itertuples():
+                if entry.stage in names[i + 1:]:
+                    os.remove(checkpoints.path(entry.key))
+            result = clean(raw.copy(), {'checkpoints': checkpoints})
+            assert result.equals(expected), f'the run resuming after {name} does not match clean()'
+        print(f'checkpoints: runs resuming after each of the {len(names)} stages match clean()')
+
+        checkpoints.maxBytes = checkpoints.entries()['MB'].max() * 2**20 * 3
+        checkpoints.evict()
+        assert checkpoints.entries()['MB'].sum() * 2**20 <= checkpoints.maxBytes, 'eviction left too many checkpoints'
+        result = clean(raw.copy(), {'checkpoints': checkpoints})
+        assert result.equals(expected), 'the run after the eviction does not match clean()'
+        print(f'checkpoints: {len(checkpoints.entries())} checkpoints are left under {checkpoints.maxBytes / 2**20:.2f} MB')
+
+# Catalog queries against masks of the cleaned frame: random filters on every kind of index, the count,
+# the matching rows and the top rows by a range column, on the built catalog, the saved and loaded one,
+# and one built from the cleaned file read back as Parquet (colors='sets' gives a column of tuples)
+def checkCatalog(rows, queries=200):
+    import numpy as np
+    from catalog import RANGECOLUMNS, buildCatalog, catalogFrame, loadCatalog, saveCatalog
+
+    def mask(df, filters):
+        keep = np.ones(len(df), dtype=bool)
+        for column, condition in filters.items():
+            if column in RANGECOLUMNS:
+                low, high = condition
+                values = df[column].to_numpy(dtype=float)
+                keep &= (values >= (-np.inf if low is None else low)) & (values <= (np.inf if high is None else high))
+            elif isinstance(df[column].dropna().iloc[0], tuple):
+                keep &= df[column].map(lambda terms: isinstance(terms, tuple) and all(term in terms for term in condition),
+                                       na_action='ignore').fillna(False).to_numpy(dtype=bool)
+            else:
+                keep &= df[column].astype(str).isin(condition).to_numpy() & df[column].notna().to_numpy()
+        return keep
+
+    def randomFilters(df, rng):
+        filters = {}
+        columns = ['brand', 'cpuBrand', 'cpuModel', 'gpuBrand', 'os', 'color', 'harddisk_range_gb', 'special_features'] + RANGECOLUMNS
+        for column in rng.choice(columns, rng.integers(0, 5), replace=False):
+            values = df[column].dropna()
+            if column in RANGECOLUMNS:
+                low, high = np.sort(rng.choice(values.to_numpy(dtype=float), 2))
+                filters[column] = [(low, high), (None, high), (low, None), (low, low)][rng.integers(0, 4)]
+            elif isinstance(values.iloc[0], tuple):
+                terms = sorted({term for value in values for term in value})
+                filters[column] = [str(term) for term in rng.choice(terms, min(len(terms), rng.integers(1, 3)), replace=False)]
+            else:
+                filters[column] = [str(value) for value in rng.choice(values.astype(str).unique(), rng.integers(1, 4))]
+        return filters
+
+    raw = loadSlice(rows)
+    for colors in ['rows', 'sets']:
+        expected = catalogFrame(clean(raw.copy(), {'colors': colors}))
+        with tempfile.TemporaryDirectory() as directory:
+            writeTable(expected, os.path.join(directory, 'cleaned.parquet'))
+            catalogs = {'built': buildCatalog(expected), 'small bins': buildCatalog(expected, {'rangeBins': 4, 'denseShare': 0.2}),
+                        'from Parquet': buildCatalog(readTable(os.path.join(directory, 'cleaned.parquet')))}
+            saveCatalog(catalogs['built'], os.path.join(directory, 'catalog'))
+            catalogs['loaded'] = loadCatalog(os.path.join(directory, 'catalog'))
+            rng = np.random.default_rng(0)
+            for _ in range(queries):
+                filters = randomFilters(expected, rng)
+                keep = mask(expected, filters)
+                orderBy, descending, k = str(rng.choice(RANGECOLUMNS)), bool(rng.integers(0, 2)), int(rng.choice([1, 10, 100]))
+                top = expected[keep].sort_values(orderBy, ascending=not descending, kind='stable', na_position='last').head(k)
+                for name, catalog in catalogs.items():
+                    assert catalog.count(filters) == keep.sum(), f'the count of the {name} catalog is wrong for {filters}'
+                    assert np.array_equal(catalog.select(filters), np.flatnonzero(keep)), f'the rows of the {name} catalog are wrong for {filters}'
+                    assert np.array_equal(catalog.top(filters, orderBy, k, descending), top.index.to_numpy()), \
+                        f'the top {k} rows by {orderBy} of the {name} catalog are wrong for {filters}'
+        print(f'catalog: {queries} queries with colors={colors!r} match the cleaned frame on {len(expected)} rows')
+
+# Model ids against every pair of distinct texts of a block compared one by one: modelIds comparing all the
+# pairs of every block must give the same ids, and with LSH in every block (blockSize 1) each id must be
+# within one of them (LSH only misses pairs). Then clean() with modelIds, on one process and on two
+def checkModelIds(rows):
+    import numpy as np
+    from dedup import MODELIDS, components, minHashSignatures, modelIds, modelKeys
+    from jssb25 import cleanModelAndBrand, cleanRows, prepareRaw
+    from synthetic import perturbedTitles, syntheticListings
+
+    def reference(df):
+        keys = modelKeys(df['model'].dropna())
+        numbers = keys.str.findall(r'[a-z]*[0-9][0-9a-z]*').map(lambda words: ' '.join(sorted(words)))
+        entries = df.loc[keys.index, MODELIDS['blockColumns']].astype(str).assign(numbers=numbers, key=keys)
+        entry = entries.groupby(list(entries.columns), sort=False, dropna=False).ngroup().to_numpy()
+        distinct = entries.drop_duplicates().reset_index(drop=True)
+        signatures = minHashSignatures(distinct['key'], MODELIDS['permutations'], MODELIDS['shingle'], MODELIDS['seed'])
+        pairs = []
+        for block in distinct.groupby(MODELIDS['blockColumns'] + ['numbers'], sort=False, dropna=False).indices.values():
+            for i, first in enumerate(block):
+                for second in block[i + 1:]:
+                    if (signatures[first] == signatures[second]).mean() >= MODELIDS['threshold']:
+                        pairs.append((first, second))
+        labels = components(len(distinct), np.array(pairs, dtype=np.int64).reshape(-1, 2))
+        ids = np.full(len(df), -1, dtype=np.int64)
+        ids[df.index.get_indexer(keys.index)] = pd.factorize(labels[entry])[0]
+        return ids
+
+    synthetic = syntheticListings(rows)
+    kept = (np.arange(rows) % 2 == 0) | synthetic['model'].isna()
+    synthetic['model'] = synthetic['model'].where(kept, perturbedTitles(synthetic['model'].astype(str), 0))
+    for name, raw in [('bundled', loadSlice(rows)), ('perturbed synthetic', synthetic)]:
+        df = cleanModelAndBrand(cleanRows(prepareRaw(raw))).reset_index(drop=True)
+        expected = reference(df)
+        assert np.array_equal(modelIds(df, {'blockSize': len(df)}), expected), f'modelIds does not match the pairs compared one by one on the {name} rows'
+        lsh = modelIds(df, {'blockSize': 1})
+        assert (pd.Series(expected).groupby(lsh).nunique() == 1).all(), f'modelIds with LSH joins models the pairs do not on the {name} rows'
+        print(f'modelids: {len(np.unique(expected))} ids of {df["model"].nunique()} model texts on {len(df)} {name} rows, '
+              f'{len(np.unique(lsh))} with LSH')
+
+    raw = loadSlice(rows)
+    result = clean(raw.copy(), {'modelIds': {}})
+    assert list(result.columns[:3]) == ['brand', 'model', 'model_id'], 'model_id is not after model'
+    assert result.equals(clean(raw.copy(), {'modelIds': {}, 'workers': 2})), 'clean() with modelIds on two processes does not match'
+    print(f'modelids: clean() keeps {len(result)} rows with {result["model_id"].nunique()} model ids')
+
+CHECKS = {
+    'stream': checkStream,
+    'parallel': checkParallel,
+    'gpucpu': checkGpuCpu,
+    'lazy': checkLazy,
+    'checkpoints': checkCheckpoints,
+    'catalog': checkCatalog,
+    'modelids': checkModelIds,
+}
+
+# Usage: python checks.py [check] [rows], runs every check without a name
+# An AssertionError means the mode no longer gives the same output as clean()
+if __name__ == '__main__':
+    names = sys.argv[1:2] or list(CHECKS)
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    for name in names:
+        CHECKS[name](rows)
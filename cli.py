@@ -0,0 +1,53 @@
+import argparse
+
+import jssb25
+
+# Command line entry point, argv defaults to the arguments of the process
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Clean the scraped Amazon laptop listings.')
+    parser.add_argument('input', nargs='?', default='amazon_laptop_2023.xlsx',
+                        help='raw listings (.xlsx, .csv, .parquet or .arrow)')
+    parser.add_argument('output', nargs='?', default='amazon_laptop_2023_cleaned.xlsx',
+                        help='cleaned listings, the format is picked from the extension')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes for the row stages')
+    parser.add_argument('--chunk-size', type=int, help='clean the input this many rows at a time')
+    parser.add_argument('--cache-file', help='load and save the normalization caches in this file')
+    parser.add_argument('--store-file', help='only clean rows not found in this store of earlier runs')
+    parser.add_argument('--plots', choices=['off', 'inline', 'background'],
+                        help='draw the graphs in this process, in a background process or not at all '
+                             '(default inline, off with the polars engine)')
+    parser.add_argument('--colors', choices=['rows', 'sets'], default='rows',
+                        help='a row for every color of a listing, or a row per listing with its colors')
+    parser.add_argument('--near-duplicates', type=float, metavar='THRESHOLD',
+                        help='also drop rows equal apart from model texts this similar (0 to 1, e.g. 0.8)')
+    parser.add_argument('--model-ids', type=float, metavar='THRESHOLD',
+                        help='add a model_id column, the same for titles of one laptop this similar (0 to 1, e.g. 0.6), '
+                             'and drop rows equal apart from the model text')
+    parser.add_argument('--outlier-quantile', type=float, metavar='Q',
+                        help='remove the values above this quantile of ram, screen size and hard disk (e.g. 0.999) '
+                             'instead of the fixed limits')
+    parser.add_argument('--engine', choices=['pandas', 'polars'], default='pandas',
+                        help='clean with the pandas stages or with one lazy Polars plan')
+    parser.add_argument('--checkpoint-dir', metavar='DIR',
+                        help='save the output of every stage here and start after the last unchanged stage '
+                             '(python checkpoints.py list or clear inspects or empties it)')
+    parser.add_argument('--checkpoint-size', type=float, metavar='MB',
+                        help='remove the checkpoints used longest ago above this size (default 1024)')
+    parser.add_argument('--profile', help='write a JSON report of every stage to this file')
+    parser.add_argument('--flame-graph', help='write sampled folded stacks to this file')
+    args = parser.parse_args(argv)
+
+    jssb25.cleanData(cacheFile=args.cache_file, chunkSize=args.chunk_size, workers=args.workers,
+                     fileName=args.input, outputName=args.output, storeFile=args.store_file,
+                     profile=args.profile, flameGraph=args.flame_graph,
+                     plots=args.plots or ('inline' if args.engine == 'pandas' else 'off'),
+                     colors=args.colors,
+                     nearDuplicates=None if args.near_duplicates is None else {'threshold': args.near_duplicates},
+                     outlierQuantile=args.outlier_quantile, engine=args.engine, checkpointDir=args.checkpoint_dir,
+                     checkpointSize=None if args.checkpoint_size is None else int(args.checkpoint_size * 2**20),
+                     modelIds=None if args.model_ids is None else {'threshold': args.model_ids})
+    for name, stats in jssb25.cacheStats().items():
+        print(f"{name} cache: {stats['hits']} hits, {stats['misses']} misses, {stats['size']} entries")
+
+if __name__ == '__main__':
+    main()
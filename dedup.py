@@ -0,0 +1,216 @@
+import numpy as np
+import pandas as pd
+
+# Rows hashed at a time, so hashing a frame only needs the fingerprint array and one block's hashes
+BLOCKROWS = 2**20
+
+# Options of nearDuplicateClusters, keys missing from the given options keep these values
+# Two model texts are near duplicates when the share of their character shingles they have in common
+# (Jaccard similarity, estimated from the MinHash signatures) is at least threshold. Candidates are
+# texts whose signatures agree on every row of at least one of the bands: texts with similarity s
+# become candidates with probability 1 - (1 - s**rows)**bands, rows being permutations / bands
+NEARDUPLICATES = {
+    'threshold': 0.8,
+    'permutations': 64,
+    'bands': 16,
+    'shingle': 4, # Characters per shingle, at most 8
+    'seed': 0,
+}
+
+# Fingerprint of every row: a 64-bit hash of its values, the same for equal rows whatever the column
+# types (a category hashes like its value, a tuple like its text). Hashed BLOCKROWS rows at a time
+def rowFingerprints(df):
+    hashes = np.empty(len(df), dtype=np.uint64)
+    for start in range(0, len(df), BLOCKROWS):
+        block = df.iloc[start:start + BLOCKROWS]
+        hashes[start:start + len(block)] = pd.util.hash_pandas_object(block, index=False).to_numpy()
+    return hashes
+
+# Same rows as drop_duplicates(keep='first'), found from the fingerprints alone
+# (two different rows get the same fingerprint with a chance of about rows**2 / 2**65)
+# With near, the model texts are grouped by nearDuplicateClusters first, so rows equal apart from
+# near duplicate models are duplicates too. near holds options of NEARDUPLICATES, {} for the defaults
+# A model_id column (see modelIds) stands for the model text, rows with the same model_id are compared
+# without it and the first one keeps its text
+def dropDuplicateRows(df, near=None, ignore_index=True):
+    if near is not None:
+        keys = df.drop(columns=['model'])
+        keys['model'] = nearDuplicateClusters(df['model'], near)
+    elif 'model_id' in df:
+        keys = df.drop(columns=['model'])
+    else:
+        keys = df
+    keep = ~pd.Series(rowFingerprints(keys)).duplicated().to_numpy()
+    df = df[keep]
+    return df.reset_index(drop=True) if ignore_index else df
+
+# 64-bit mixing function (splitmix64 finalizer), applied to every element
+def mix64(values):
+    values = values.copy()
+    values ^= values >> np.uint64(30)
+    values *= np.uint64(0xBF58476D1CE4E5B9)
+    values ^= values >> np.uint64(27)
+    values *= np.uint64(0x94D049BB133111EB)
+    values ^= values >> np.uint64(31)
+    return values
+
+# Character shingles of every text, as the shingle's bytes packed into one integer
+# Returns the shingles and the position of the first shingle of every text (each text has at least one)
+# The texts are lowercased and their whitespace collapsed, then joined into one byte buffer with
+# zero padding, so the shingles are read off the buffer without a Python loop over them
+def textShingles(texts, size):
+    texts = pd.Series(texts, dtype=object).astype(str).str.lower().str.split().str.join(' ')
+    encoded = [text.encode() + bytes(size) for text in texts]
+    lengths = np.array([len(text) - size for text in encoded], dtype=np.int64)
+    buffer = np.frombuffer(b''.join(encoded), dtype=np.uint8).astype(np.uint64)
+    counts = np.maximum(lengths - size + 1, 1)
+    textStarts = np.concatenate([[0], np.cumsum(lengths + size)[:-1]])
+    firsts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    positions = np.repeat(textStarts - firsts, counts) + np.arange(counts.sum())
+    shingles = np.zeros(len(positions), dtype=np.uint64)
+    for j in range(size):
+        shingles |= buffer[positions + j] << np.uint64(8 * j)
+    return shingles, firsts
+
+# MinHash signature of every text: for each permutation, the smallest hash of its shingles
+def minHashSignatures(texts, permutations, size, seed):
+    shingles, firsts = textShingles(texts, size)
+    seeds = mix64(np.arange(permutations, dtype=np.uint64) + np.uint64(seed * permutations + 1))
+    signatures = np.empty((len(firsts), permutations), dtype=np.uint64)
+    for i, permutationSeed in enumerate(seeds):
+        signatures[:, i] = np.minimum.reduceat(mix64(shingles ^ permutationSeed), firsts)
+    return signatures
+
+# Label of the connected component of every node, the smallest node in it
+def components(nodes, pairs):
+    labels = np.arange(nodes)
+    if not len(pairs):
+        return labels
+    first, second = pairs[:, 0], pairs[:, 1]
+    while True:
+        low = np.minimum(labels[first], labels[second])
+        before = labels.copy()
+        np.minimum.at(labels, first, low)
+        np.minimum.at(labels, second, low)
+        labels = labels[labels]
+        if np.array_equal(labels, before):
+            return labels
+
+# Candidate pairs of LSH: the signatures are bucketed by band (and by group, if given, so only signatures of the
+# same group meet), every signature of a bucket is paired with the first one
+def bandPairs(signatures, bands, groups=None):
+    rows = signatures.shape[1] // bands
+    pairs = []
+    for band in range(bands):
+        keys = pd.DataFrame(signatures[:, band * rows:(band + 1) * rows])
+        if groups is not None:
+            keys['group'] = groups
+        bucket = pd.factorize(pd.util.hash_pandas_object(keys, index=False))[0]
+        firstOfBucket = np.unique(bucket, return_index=True)[1][bucket]
+        candidates = np.flatnonzero(firstOfBucket != np.arange(len(bucket)))
+        pairs.append(np.column_stack([firstOfBucket[candidates], candidates]))
+    return np.concatenate(pairs)
+
+# Pairs whose estimated similarity (the share of equal signature values) reaches threshold,
+# scored PAIRBATCH pairs at a time
+def similarPairs(signatures, pairs, threshold):
+    linked = []
+    for start in range(0, len(pairs), PAIRBATCH):
+        batch = pairs[start:start + PAIRBATCH]
+        similarity = (signatures[batch[:, 0]] == signatures[batch[:, 1]]).mean(axis=1)
+        linked.append(batch[similarity >= threshold])
+    return np.concatenate(linked) if linked else np.empty((0, 2), dtype=np.int64)
+
+# Pairs compared at a time, each reads two signatures
+PAIRBATCH = 2**16
+
+def checkOptions(options):
+    if options['permutations'] % options['bands']:
+        raise ValueError(f"{options['permutations']} permutations cannot be split into {options['bands']} bands")
+    if not 1 <= options['shingle'] <= 8:
+        raise ValueError(f"Shingles of {options['shingle']} characters do not fit in 64 bits")
+
+# Cluster id of the model text of every row: rows with near duplicate texts get the same id
+# Only the distinct texts are hashed. LSH buckets the signatures by band, every text of a bucket is
+# compared with the first one and linked to it if their estimated similarity reaches the threshold.
+# Missing models get -1
+def nearDuplicateClusters(series, options=None):
+    options = {**NEARDUPLICATES, **(options or {})}
+    checkOptions(options)
+    codes, uniques = pd.factorize(series.astype(object))
+    if not len(uniques):
+        return np.full(len(series), -1, dtype=np.int64)
+    signatures = minHashSignatures(uniques, options['permutations'], options['shingle'], options['seed'])
+    pairs = similarPairs(signatures, bandPairs(signatures, options['bands']), options['threshold'])
+    labels = components(len(uniques), pairs)
+    return np.where(codes >= 0, labels[codes], -1)
+
+# Options of modelIds, keys missing from the given options keep these values
+# Listings are only compared within a block: the listings with the same values of blockColumns
+# (a missing value is a value too) and, with numbers, the same words with a digit in their model text
+# (15, m16, 7330: a different number is a different laptop, however close the rest of the text is).
+# Blocks of at most blockSize distinct model texts compare every pair, larger ones only the LSH
+# candidates, so the pairs compared grow with the rows, not their square. The other options are those
+# of NEARDUPLICATES. Titles of one laptop differ by more than spaces and case (a typo, a word more),
+# so the threshold is lower and the shingles shorter
+MODELIDS = {
+    'blockColumns': ['brand', 'cpuModel', 'gpuModel'],
+    'numbers': True,
+    'blockSize': 32,
+    'threshold': 0.6,
+    'permutations': 128,
+    'bands': 32,
+    'shingle': 2,
+    'seed': 0,
+}
+
+# Model texts as they are compared: lower case, punctuation as spaces and the whitespace collapsed
+def modelKeys(values):
+    return pd.Series(values, dtype=object).astype(str).str.lower().str.replace(r'[^0-9a-z]+', ' ', regex=True).str.strip()
+
+# Canonical model id of every row: listings of one block whose model texts are near duplicates (directly
+# or through other texts) get the same id. Ids are numbered from 0 in the order of their first row,
+# missing models get -1. The texts are normalized once per distinct text and only the distinct
+# (block, model text) entries are compared
+def modelIds(df, options=None):
+    options = {**MODELIDS, **(options or {})}
+    checkOptions(options)
+    models, uniques = pd.factorize(df['model'].astype(object))
+    rows = np.flatnonzero(models >= 0)
+    ids = np.full(len(df), -1, dtype=np.int64)
+    if not len(rows):
+        return ids
+    keys = modelKeys(uniques)
+    textOfModel, texts = pd.factorize(keys)
+    blockKeys = df[options['blockColumns']].iloc[rows].reset_index(drop=True)
+    if options['numbers']:
+        numbers = keys.str.findall(r'[a-z]*[0-9][0-9a-z]*').map(sorted).str.join(' ')
+        blockKeys['numbers'] = pd.factorize(numbers)[0][models[rows]]
+    blocks = pd.factorize(pd.util.hash_pandas_object(blockKeys, index=False))[0].astype(np.int64)
+    entryOfRow, entries = pd.factorize(blocks * len(texts) + textOfModel[models[rows]])
+    entryBlocks = entries // len(texts)
+    signatures = minHashSignatures(texts, options['permutations'], options['shingle'], options['seed'])[entries % len(texts)]
+    pairs, large = blockPairs(entryBlocks, options['blockSize'])
+    inLarge = np.flatnonzero(large[entryBlocks])
+    if len(inLarge):
+        pairs = np.concatenate([pairs, inLarge[bandPairs(signatures[inLarge], options['bands'], entryBlocks[inLarge])]])
+    labels = components(len(entries), similarPairs(signatures, pairs, options['threshold']))
+    ids[rows] = pd.factorize(labels[entryOfRow])[0]
+    return ids
+
+# Every pair of entries in the blocks of at most size entries, and whether each block is larger
+def blockPairs(blocks, size):
+    order = np.argsort(blocks, kind='stable')
+    counts = np.bincount(blocks)
+    sortedCounts = counts[blocks[order]]
+    position = np.arange(len(order)) - (np.cumsum(counts) - counts)[blocks[order]]
+    later = np.where(sortedCounts <= size, sortedCounts - 1 - position, 0) # Entries of its block after each one
+    first = np.repeat(np.arange(len(order)), later)
+    second = first + 1 + np.arange(len(first)) - np.repeat(np.cumsum(later) - later, later)
+    return np.column_stack([order[first], order[second]]), counts > size
+
+# The listings with a model_id column after model (see modelIds)
+def addModelIds(df, options=None):
+    df = df.copy()
+    df.insert(df.columns.get_loc('model') + 1, 'model_id', modelIds(df, options))
+    return df
@@ -0,0 +1,99 @@
+import hashlib
+import inspect
+import os
+import pickle
+import sys
+
+import pandas as pd
+
+import cache
+import dedup
+import jssb25
+import rules
+import storage
+from jssb25 import (readRaw, cleanRows, cleanBrandColumn, cleanModelAndBrand, explodeColors, finishClean,
+                    cleanPostVisualize, cacheVersion, OUTPUTORDER)
+from cache import rulesVersion
+from storage import writeTable
+from dedup import rowFingerprints, dropDuplicateRows
+
+# Fingerprint of a whole file, read in blocks
+def fileDigest(fileName):
+    digest = hashlib.sha256()
+    with open(fileName, 'rb') as file:
+        for block in iter(lambda: file.read(2**20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Fingerprint of the cleaning code and rules: the stages, the rule matching, the caches,
+# the readers and writers, the deduplication and this file
+def codeVersion():
+    sources = [inspect.getsource(module) for module in [jssb25, rules, cache, storage, dedup, sys.modules[__name__]]]
+    return rulesVersion(*sources, cacheVersion())
+
+# Stored rows are only reused with the same cleaning code, rules and raw column types
+# (cleanNum treats a value differently depending on the type of its column)
+def storeVersion(df):
+    return rulesVersion(codeVersion(), list(df.dtypes.astype(str).items()))
+
+# The store file holds two pickles: a small header with the versions and digests, then the frames.
+# Checking whether anything changed only unpickles the header
+def loadStore(path, frames=True):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'rb') as file:
+        store = pickle.load(file)
+        if frames:
+            store.update(pickle.load(file))
+    return store
+
+def saveStore(header, frames, path):
+    with open(path, 'wb') as file:
+        pickle.dump(header, file)
+        pickle.dump(frames, file)
+
+# Clean the file, running the row stages only on rows which are not in the store yet
+# The store keeps the rows after cleanRows and cleanBrandColumn, indexed by the hash of their raw row
+# (one row per listing, the colors are exploded afterwards). Everything depending on all the rows
+# (the brand list, drop_duplicates, outliers, grouping and binning) runs again on the merged rows.
+# If the input file did not change since the last run, the stored output is reused as it is. It is only
+# loaded if the output file has to be written again, otherwise None is returned
+def cleanIncremental(fileName, outputName, storeFile):
+    header = loadStore(storeFile, frames=False)
+    digest = fileDigest(fileName)
+    if header.get('fileDigest') == digest and header.get('codeVersion') == codeVersion():
+        if os.path.exists(outputName) and fileDigest(outputName) == header.get('outputDigest'):
+            return None
+        df = loadStore(storeFile)['output']
+        writeTable(df, outputName)
+        return df
+
+    df = readRaw(fileName)
+    df.index = rowFingerprints(df) # The key of a raw row's cleaned rows in the store
+    version = storeVersion(df)
+    rows = loadStore(storeFile)['rows'] if header.get('version') == version else None
+
+    new = df if rows is None else df[~df.index.isin(rows.index)]
+    if len(new):
+        new = cleanBrandColumn(cleanRows(new.copy()))
+        rows = new if rows is None else pd.concat([rows[rows.index.isin(df.index)], new])
+    rows = rows.loc[df.index]
+
+    df = cleanModelAndBrand(rows.copy(), rows['brand'].unique())
+    df = explodeColors(df)
+    df = dropDuplicateRows(df)
+    df = finishClean(df)
+    df = cleanPostVisualize(df)
+    df = df[OUTPUTORDER]
+    writeTable(df, outputName)
+
+    saveStore({
+        'version': version,
+        'codeVersion': codeVersion(),
+        'fileDigest': digest,
+        'outputDigest': fileDigest(outputName),
+    }, {
+        'rows': rows,
+        'output': df,
+    }, storeFile)
+    return df
@@ -1,12 +1,50 @@
 import pandas as pd
 import numpy as np
-import seaborn as sns
-import matplotlib.pyplot as plt
-from matplotlib.ticker import MultipleLocator
 import re
+from collections import Counter
+from contextlib import nullcontext
+from functools import partial
 
+from rules import compileRules, applyRules, extractRules, rewriteValue, RuleFile
+from cache import LRUCache, mapUnique, rulesVersion, loadCaches, saveCaches
+from storage import readTable, writeTable
+from dedup import addModelIds, dropDuplicateRows
+from sketches import TDigest
+from profiling import Profiler, profiled
+
+# Graphs are saved here. seaborn and matplotlib are only imported by the plot functions,
+# so importing this module to clean does not load them
 FILEPATH = 'images/'
 
+# Normalization caches from raw string to mapped value, one per mapper
+# They live as long as the process, and can be saved between runs with cleanData(cacheFile=...)
+CACHESIZE = 65536
+CACHES = {name: LRUCache(CACHESIZE) for name in ['color', 'os', 'gpu', 'cpu', 'brand', 'modelBrand']}
+
+# Text columns with few distinct values are turned into pd.Categorical as soon as their stage has
+# normalized them: every distinct value is kept once and the rows only hold small integer codes.
+# special_features is a category of the sorted feature tuples (see featureMatrix for a multi-hot view)
+CATEGORYCOLUMNS = ['brand', 'color', 'os', 'special_features', 'graphics', 'gpuBrand', 'gpuModel', 'cpuBrand', 'cpuModel']
+
+# Categories of values no longer in df are dropped, so the same rows give the same categories
+# whichever way they were cleaned
+def toCategory(df, columns):
+    for column in columns:
+        df[column] = df[column].astype('category').cat.remove_unused_categories()
+    return df
+
+# Category column of tuples, row i holding tuples[codes[i]]
+# (built from the codes, as astype('category') would hash every row's tuple)
+def tupleColumn(tuples, codes, index):
+    tupleCodes, uniqueTuples = pd.factorize(tuples)
+    categories = pd.Index(uniqueTuples, dtype=object, tupleize_cols=False)
+    return pd.Series(pd.Categorical.from_codes(tupleCodes[codes], categories=categories), index=index)
+
+# Whether a column holds tuples (special_features, and color with colors='sets')
+def isTupleColumn(series):
+    values = series.cat.categories if isinstance(series.dtype, pd.CategoricalDtype) else series.dropna()
+    return len(values) > 0 and isinstance(values.array[0], tuple)
+
 # Replaces missing data with the string 'NA and 
 # extract only alphanumeric and 'normal' characters
 def cleanCategorical(df, categoricalData):
@@ -26,53 +64,94 @@ def cleanNum(df, columnName):
     df[columnName] = df[columnName].fillna(0) # 0 instead of NaN as it is easier to process
     return df[columnName]
 
-# Apply function to list of numerical data
+# Same as cleanNum on every column, in one pass: the text columns are stacked, each distinct
+# value is parsed once and the numbers are split back into the columns
 def cleanAllNum(df, numericalData):
+    text = [column for column in numericalData if df[column].dtypes != 'float64']
+    if text:
+        codes, uniques = pd.factorize(pd.concat([df[column] for column in text], ignore_index=True), use_na_sentinel=False)
+        uniques = pd.Series(uniques, dtype=object).replace(',','', regex=True)
+        numbers = uniques.str.extract(r'([-+]?\d*\.?\d+)')[0].astype(float).to_numpy()[codes]
+        for column, values in zip(text, np.split(numbers, len(text))):
+            df[column] = values
     for column in numericalData:
-        df[column] = cleanNum(df, column)
+        df[column] = df[column].fillna(0) # 0 instead of NaN as it is easier to process
     return df
 
+# round(value, digits) of every value, exactly like Python's round. np.round scales by 10**digits
+# and rounds that, which gives a different last digit for some values
+def roundLikePython(values, digits):
+    uniques, inverse = np.unique(values, return_inverse=True)
+    return np.array([round(float(value), digits) for value in uniques])[inverse.reshape(-1)]
+
 # If number is below 8, it must be in TB https://techfident.co.uk/how-much-storage-do-i-need-on-my-laptop/
 def tbToGBHDD(row):
     return row * 1024 if row <= 8 else row
 
+# Same as tbToGBHDD on every row
 def cleanHDD(df):
-    df['harddisk'] = df["harddisk"].apply(tbToGBHDD)
+    harddisk = df['harddisk'].to_numpy()
+    df['harddisk'] = np.where(harddisk <= 8, harddisk * 1024, harddisk)
     return df
 
 # If number is greater than 10 GHz, it must be in MHz https://www.lenovo.com/gb/en/glossary/what-is-processor-speed/
 def mhzToGhzCPU(row):
     return round(row / 1000, 1) if row > 10 else round(row, 1)
 
+# Same as mhzToGhzCPU on every row
 def cleanCPUSpeed(df):
-    df['cpu_speed'] = df['cpu_speed'].apply(mhzToGhzCPU)
+    speed = df['cpu_speed'].to_numpy()
+    df['cpu_speed'] = roundLikePython(np.where(speed > 10, speed / 1000, speed), 1)
     return df
 
 # Standardize the colors to remove things such as 'Darkside of the moon'
+COLORMAP = {
+    r'black|dark (?:metallic|side)|carbon|balck': 'black',
+    r'silver|platinum|aluminum|sliver|midnight|mercury': 'silver',
+    r'gr[ae]y|gary|lunar|graphite|ash': 'grey',
+    r'blue|cobalt|sky|teal': 'blue',
+    r'red': 'red',
+    r'white|light': 'white',
+    r'almond|dune|beige': 'brown',
+    r'yellow|gold|apollo': 'yellow',
+    r'green|mint|sage|moss': 'green',
+    r'pink|electro': 'pink',
+}
+COLORRULES = compileRules(COLORMAP)
+
 def standardizeColor(row):
-    colorMap = {
-        r'black|dark (?:metallic|side)|carbon|balck': 'black',
-        r'silver|platinum|aluminum|sliver|midnight|mercury': 'silver',
-        r'gr[ae]y|gary|lunar|graphite|ash': 'grey',
-        r'blue|cobalt|sky|teal': 'blue',
-        r'red': 'red',
-        r'white|light': 'white',
-        r'almond|dune|beige': 'brown',
-        r'yellow|gold|apollo': 'yellow',
-        r'green|mint|sage|moss': 'green',
-        r'pink|electro': 'pink',
-    }
-    for regex, color in colorMap.items():
+    for regex, color in COLORMAP.items():
         if re.search(regex, row):
             return color
     return 'NA'
 
-# Split colors by [,] and [/] (which means multiple choice of colors), and explode it into multiple rows
+# Split colors by [,] and [/] (which means multiple choice of colors) and standardize each of them
+# Every listing keeps the tuple of its colors, so the later stages run once per listing and not
+# once per color. explodeColors turns it into a row per color, just before the duplicates are dropped
 def cleanColor(df):
-    df['color'] = df['color'].str.split(r'[,/]')
+    codes, uniques = pd.factorize(df['color'], use_na_sentinel=False)
+    df['color'] = tupleColumn(colorTuples(uniques), codes, df.index)
+    return df
+
+# Tuple of the standardized colors of every distinct color text
+def colorTuples(values):
+    colors = pd.Series(values, dtype=object).str.split(r'[,/]').explode().str.strip()
+    colors = mapUnique(colors, lambda s: applyRules(s, COLORRULES, 'NA'), CACHES['color'])
+    tuples = np.empty(len(values), dtype=object)
+    tuples[:] = list(colors.groupby(level=0).agg(tuple))
+    return tuples
+
+# One row for every color of a listing, next to each other (what DataFrame.explode gives)
+def explodeColors(df):
+    df['color'] = df['color'].astype(object)
     df = df.explode('color')
-    df['color'] = df['color'].str.strip()
-    df['color'] = df['color'].apply(standardizeColor)
+    return toCategory(df, ['color'])
+
+# One row for every listing, with the distinct colors of the listing in the order they are listed
+def colorSets(df):
+    tuples = np.empty(len(df['color'].cat.categories), dtype=object)
+    tuples[:] = [tuple(dict.fromkeys(colors)) for colors in df['color'].cat.categories]
+    df['color'] = tupleColumn(tuples, df['color'].cat.codes.to_numpy(), df.index)
     return df
 
 # Round the ram (as they cannot be a decimal number)
@@ -81,57 +160,61 @@ def cleanRam(df):
     return df
 
 # Remove unnecessary information and only extract OS
+OSMAPPING = {
+    r'windows 10|win 10': 'windows10',
+    r'windows 11|win 11': 'windows11',
+    r'windows 8|win 8': 'windows8',
+    r'windows 7|win 7': 'windows7',
+    r'windows': 'windows',
+    r'chrome os': 'chromeos',
+    r'linux': 'linux',
+    r'mac os|macos': 'macos',
+}
+OSRULES = compileRules(OSMAPPING)
+
 def standardizeOS(row):
-    osMapping = {
-        r'windows 10|win 10': 'windows10',
-        r'windows 11|win 11': 'windows11',
-        r'windows 8|win 8': 'windows8',
-        r'windows 7|win 7': 'windows7',
-        r'windows': 'windows',
-        r'chrome os': 'chromeos',
-        r'linux': 'linux',
-        r'mac os|macos': 'macos',
-    }
-    for regex, os in osMapping.items():
+    for regex, os in OSMAPPING.items():
         if re.search(regex, row):
             return os
     return 'NA'
 
 def cleanOS(df):
-    df['os'] = df['os'].apply(standardizeOS)
-    return df
+    df['os'] = mapUnique(df['os'], lambda s: applyRules(s, OSRULES, 'NA'), CACHES['os'])
+    return toCategory(df, ['os'])
 
 # Standardize spelling and meaning for standard features
+SFMAPPING = {
+    r'anti-? ?glare|anti[ -]?(?:gla|reflection)' : 'anti-glare',
+    r'backlit|backlight': 'backlit keyboard',
+    r'edge|thin|narrow|bezel': 'thin bezel', #https://www.tomshardware.com/news/dell-infinityedge-oled-monitors,30854.html https://linustechtips.com/topic/1242078-what-the-hell-is-nanoedge-by-asus/
+    r'stylus|pen|stylus': 'stylus',
+    r'audio': 'hd audio',
+    r'fingerprint': 'fingerprint reader',
+    r'speakers|stereo': 'stereo speakers',
+    r'wifi & bluetooth': 'wifi and bluetooth',
+    r'resistant|water|dishwasher': 'water resistant',
+    r'gorilla': 'corning gorilla glass',
+    r'keypad': 'numeric keypad',
+    r'chiclet': 'chiclet keyboard',
+    r'touch[ -]?screen': 'touch-screen',
+    r'multi[ -]?touch': 'multi-touch',
+    r'alexa': 'alexa',
+    r'light and compact|narrow|space saving|portable': 'lightweight',
+    r'ruggedized': 'rugged',
+    r'2[ -]in[ -]1': '2-in-1',
+    r'information not available|and play on a fast|work|create|high quality|built for entertainment|premium business-class notebook': 'NA',
+}
+SFRULES = compileRules(SFMAPPING)
+
 # Then sort them alphabetically and convert it into a tuple of features
 def standardizeFeatures(row):
-    sfMapping = {
-        r'anti-? ?glare|anti[ -]?(?:gla|reflection)' : 'anti-glare',
-        r'backlit|backlight': 'backlit keyboard',
-        r'edge|thin|narrow|bezel': 'thin bezel', #https://www.tomshardware.com/news/dell-infinityedge-oled-monitors,30854.html https://linustechtips.com/topic/1242078-what-the-hell-is-nanoedge-by-asus/
-        r'stylus|pen|stylus': 'stylus',
-        r'audio': 'hd audio',
-        r'fingerprint': 'fingerprint reader',
-        r'speakers|stereo': 'stereo speakers',
-        r'wifi & bluetooth': 'wifi and bluetooth',
-        r'resistant|water|dishwasher': 'water resistant',
-        r'gorilla': 'corning gorilla glass',
-        r'keypad': 'numeric keypad',
-        r'chiclet': 'chiclet keyboard',
-        r'touch[ -]?screen': 'touch-screen',
-        r'multi[ -]?touch': 'multi-touch',
-        r'alexa': 'alexa',
-        r'light and compact|narrow|space saving|portable': 'lightweight',
-        r'ruggedized': 'rugged',
-        r'2[ -]in[ -]1': '2-in-1',
-        r'information not available|and play on a fast|work|create|high quality|built for entertainment|premium business-class notebook': 'NA',
-    }
     updated = set()
     for item in row:
         if item == '':
             continue
         item = item.strip()
         notFound = True
-        for regex, feature in sfMapping.items():
+        for regex, feature in SFMAPPING.items():
             if re.search(regex, item):
                 updated.add(feature)
                 notFound = False
@@ -143,23 +226,90 @@ def standardizeFeatures(row):
         updated.remove('NA')
         
     return tuple(sorted(updated))
+
+# Same as standardizeFeatures on every row, as a category of the feature tuples
+# Each distinct list of items is exploded once and each distinct item is normalized once with the
+# compiled rules. Features are numbered in sorted order, so sorting the (list, feature) numbers
+# gives every list its features sorted and without repeats, ready to be cut into tuples
+def standardizeFeaturesColumn(series):
+    codes, lists = pd.factorize(series.map(tuple).to_numpy())
+    items = pd.Series(lists, dtype=object).explode()
+    itemCodes, itemUniques = pd.factorize(items.to_numpy()) # Empty lists explode to NaN, code -1
+    features = applyRules(pd.Series(itemUniques, dtype=object).str.strip(), SFRULES).to_numpy()
+
+    vocabulary = sorted(set(features) - {'NA'})
+    rank = {feature: i for i, feature in enumerate(vocabulary)}
+    ranks = [-1 if item == '' else rank.get(feature, -1) for item, feature in zip(itemUniques, features)]
+    featureRanks = np.array(ranks + [-1], dtype=np.int64)[itemCodes]
+    keep = featureRanks != -1
+    pairs = np.sort(items.index.to_numpy()[keep] * len(vocabulary) + featureRanks[keep])
+    pairs = pairs[np.diff(pairs, prepend=-1) != 0]
+    listIds, featureRanks = np.divmod(pairs, max(len(vocabulary), 1))
+
+    tuples = np.empty(len(lists), dtype=object)
+    tuples[:] = [()] * len(lists)
+    names = np.array(vocabulary, dtype=object)[featureRanks].tolist()
+    starts = np.flatnonzero(np.diff(listIds, prepend=-1)).tolist()
+    for start, end in zip(starts, starts[1:] + [len(names)]):
+        tuples[listIds[start]] = tuple(names[start:end])
+
+    return tupleColumn(tuples, codes, series.index)
     
 # Get special features located in model name
+SPECIALFEATURESPATTERN = re.compile(r'detachable 2[ -]in[ -]1|2[ -]in[ -]1|rugged|multi-touch')
+
 def getSpecialFeature(row):
-    specialFeaturesPattern = r'detachable 2[ -]in[ -]1|2[ -]in[ -]1|rugged|multi-touch'
-    specialFeatures = re.findall(specialFeaturesPattern, row['model'])
+    specialFeatures = re.findall(SPECIALFEATURESPATTERN, row['model'])
     if specialFeatures:
         for feature in specialFeatures:
             row['model'] = row['model'].replace(feature, '').strip()
         row['special_features'] += specialFeatures
     return row
+
+# Same as getSpecialFeature on every row, but each distinct model is only searched once
+def getSpecialFeatureColumns(df):
+    codes, models = pd.factorize(df['model'], use_na_sentinel=False)
+    newModels, features = modelFeatures(models)
+    found = np.array([len(feature) > 0 for feature in features])[codes]
+    df['model'] = newModels[codes]
+    extended = df['special_features'].to_numpy(copy=True)
+    for i in np.flatnonzero(found):
+        extended[i] = extended[i] + features[codes[i]]
+    df['special_features'] = extended
+    return df
                 
+# Every distinct model without its special features, and the list of features found in it
+def modelFeatures(models):
+    newModels = np.empty(len(models), dtype=object)
+    features = np.empty(len(models), dtype=object)
+    for i, model in enumerate(models):
+        features[i] = SPECIALFEATURESPATTERN.findall(model)
+        for feature in features[i]:
+            model = model.replace(feature, '').strip()
+        newModels[i] = model
+    return newModels, features
+
 def cleanSpecialFeatures(df):
     df['special_features'] = df['special_features'].str.split(',')
-    df = df.apply(getSpecialFeature, axis=1)
-    df['special_features'] = df['special_features'].apply(standardizeFeatures)
+    df = getSpecialFeatureColumns(df)
+    df['special_features'] = standardizeFeaturesColumn(df['special_features'])
     return df
 
+# special_features as a multi-hot matrix: a sparse boolean column for every feature in the data,
+# True for the laptops which have it. The features of each distinct tuple are looked up once
+# and spread to the rows through the category codes
+def featureMatrix(series):
+    series = series.astype('category')
+    tuples = series.cat.categories
+    vocabulary = sorted(set().union(*tuples))
+    position = {feature: i for i, feature in enumerate(vocabulary)}
+    hot = np.zeros((len(tuples) + 1, len(vocabulary)), dtype=bool) # Last row is for missing values (code -1)
+    for i, features in enumerate(tuples):
+        hot[i, [position[feature] for feature in features]] = True
+    codes = series.cat.codes.to_numpy()
+    return pd.DataFrame({feature: pd.arrays.SparseArray(hot[codes, i], fill_value=False)
+                         for i, feature in enumerate(vocabulary)}, index=series.index)
+
 # Get the GPU in graphics column and move to graphics_coprocessor if its empty
 # Uses masks to make it much easier
 def extractGPU(df):
@@ -170,121 +320,125 @@ def extractGPU(df):
     df.loc[mask, 'graphics'] = 'NA'
     return df
     
-# Extract GPU into gpuBrand and gpuModel using regex
+# The GPU and CPU rules are kept in versioned rule files (rulesets/gpu.json and cpu.json, see rules.py).
+# gpu.json: rewrite (spellings tidied before extracting), extract (gpuBrand and gpuModel, the first
+# matching pattern wins), useless, integrated and dedicated (graphics kinds) and tidy
+# cpu.json: rewrite, extract (cpuBrand and cpuModel) and brands (cpuBrand from the model)
+GPURULES = RuleFile('gpu.json')
+CPURULES = RuleFile('cpu.json')
+RULEFILES = {'gpu': GPURULES, 'cpu': CPURULES}
+
+# Reload the rule files edited since they were loaded, and empty the caches of the values
+# normalized with their old rules. Checked by clean() and the GPU and CPU stages, so a long-running
+# process picks up new rules without a restart
+def refreshRules():
+    for name, ruleFile in RULEFILES.items():
+        if ruleFile.refresh():
+            CACHES[name].clear()
+
 def standardizeGPU(row):
-    gpuExtract = {
-        r'(?P<gpuBrand>nvidia[ _]?(?:quadro rtx|quadro|rtx|gtx)?)[ _]?(?:intel)?[ _]?(?P<gpuModel>\d{4}[ _]?(ti)?\s?(?:ada)?|[kpat]\d{4}[m]?|([ktpa]|mx)?\d{3}m?)?', # Nvidia
-        r'(?P<gpuBrand>intel[ _]?(?:iris|u?hd))[ _]?(?P<gpuModel>\d{3,4})?', # Intel iris, hd and uhd
-        r'^(integrated)?\s?(?P<gpuBrand>intel[ ]?(celeron|arc)?)\s?(integrated|dedicated|(?:processor|integrated)?)?\s?(?P<gpuModel>a\d{3}m)?$', # Intel, ICeleron and IArc
-        r'(?P<gpuBrand>amd)\s?(?P<gpuModel>(?:(?:mobility|\s?radeon)+)?\s?(?:(?:\s|wx|rx|vega|pro|r[457]|hd|athlon|silver|integrated|m|gl)+)?\s?(?:\d{1,4}m?)?)', # AMD this also works r'(amd)\s?((?:(?!rtx).)*)'
-        r'(?P<gpuBrand>apple)\s?(?P<gpuModel>m1\s?(?:pro)?)?', # Apple
-        r'(?P<gpuBrand>mediatek)', # Mediatek
-        r'(?P<gpuBrand>arm)\s?(?P<gpuModel>mali-g\d{2}\s?(?:mp3|2ee mc2))', # Arm
-    }
-    
-    useless = r'xps9300-7909slv-pus|inter core i7-8650u'
-    
-    for regex in gpuExtract:
-        if match := re.search(regex, row):
+    for pattern in GPURULES['extract']['patterns']:
+        if match := pattern.search(row):
             if match.groupdict().get('gpuModel'):
                 return match.group('gpuBrand').strip()+ ' ' + match.group('gpuModel').strip()
             else:
                 return match.group('gpuBrand').strip()
     
-    if re.search(useless, row):
+    if GPURULES['useless']['patterns'][0].search(row):
         return 'NA'
     
     return row
 
+# Same as standardizeGPU, but matches the whole column in one pass
+def standardizeGPUColumn(series):
+    extracted = extractRules(series, GPURULES['extract'], ['gpuBrand', 'gpuModel'])
+    brand = extracted['gpuBrand'].str.strip()
+    hasModel = extracted['gpuModel'].fillna('') != ''
+    result = brand.where(~hasModel, brand + ' ' + extracted['gpuModel'].str.strip())
+    
+    unmatched = extracted['rule'] == -1
+    useless = series.str.contains(GPURULES['useless']['patterns'][0])
+    result[unmatched] = series[unmatched].where(~useless[unmatched], 'NA').to_numpy()
+    return result
+
 # Set graphics column value based on graphics_coprocessor column
 def fillInGraphics(df):
     df['graphics'] = 'NA'
-    integrated = r'integrated|intel|mediatek|powervr|arm|adreno|athlon|mobility|6[18]0m|vega|r4|r5|r7' # https://www.notebookcheck.net/AMD-Radeon-610M-GPU-Benchmarks-and-Specs.654293.0.html
-    dedicated = r'dedicated|nvidia|560|rx'
-    mask = df['graphics_coprocessor'].str.contains(integrated)
+    mask = df['graphics_coprocessor'].str.contains(GPURULES['integrated']['patterns'][0])
     df.loc[mask, 'graphics'] = 'integrated'
-    mask = df['graphics_coprocessor'].str.contains(dedicated)
+    mask = df['graphics_coprocessor'].str.contains(GPURULES['dedicated']['patterns'][0])
     df.loc[mask, 'graphics'] = 'dedicated'
     return df
 
+# First word of every value and the rest of it ('NA' if there is none), like str.split(n=1)
+def splitFirstWord(values):
+    parts = [value.split(None, 1) if isinstance(value, str) else [] for value in values]
+    first = np.array([part[0] if part else np.nan for part in parts], dtype=object)
+    rest = np.array([part[1] if len(part) > 1 else 'NA' for part in parts], dtype=object)
+    return first, rest
+
+# graphics, gpuBrand and gpuModel of every distinct graphics_coprocessor, in one pass over them:
+# the rewrite rules in order, the extraction (cached), the graphics kind, the tidy rules and the split
+def gpuColumns(values):
+    rewritten = pd.Series([rewriteValue(GPURULES['rewrite'], value) for value in values], dtype=object)
+    gpus = mapUnique(rewritten, standardizeGPUColumn, CACHES['gpu']).to_numpy()
+    integrated = GPURULES['integrated']['patterns'][0].search
+    dedicated = GPURULES['dedicated']['patterns'][0].search
+    kinds = np.array(['dedicated' if dedicated(gpu) else 'integrated' if integrated(gpu) else 'NA' for gpu in gpus],
+                     dtype=object)
+    brands, models = splitFirstWord([rewriteValue(GPURULES['tidy'], gpu) for gpu in gpus])
+    return kinds, brands, models
+
 # Standardize GPU names for easier extraction
 # Remove all 'dedicated' and 'integrated' after Graphics column filled in 
 # Split the GPU brand and model into two column
+# Every distinct graphics_coprocessor is cleaned once and spread to the rows through its code
 def cleanGPU(df):
-    gpuMapping = {
-        r'iris x[e]?|intel xe': 'intel iris',
-        r'nvidia geforce[r]?|geforce': 'nvidia',
-        r'nvidia (?:trx|rtx)|nvidia intel rtx': 'nvidia rtx',
-        r'(?<!nvidia)quadro|qn20-m1-r': 'nvidia quadro', # https://forums.lenovo.com/t5/ThinkPad-P-and-W-Series-Mobile-Workstations/NVIDIA-QN20-M1-R/m-p/5165568 and https://www.reddit.com/r/laptops/comments/wxlz4p/anyone_heard_of_a_nvidia_qn20m1r_graphics_card/
-        r'\bgt\b': 'gtx',
-        r'ati': 'amd', # https://www.networkworld.com/article/735534/data-center-amd-says-goodbye-to-the-ati-brand.html
-        r'620u': 'uhd 620',
-        r'^t550$': 'nvidia quadro t550',
-        r'^t1200$': 'nvidia quadro t1200',
-        r'(?<!\w )nvidia t': 'nvidia quadro t',
-        r'(?<!\w )rtx': 'nvidia rtx',
-        r'(?<!\w )radeon': 'amd radeon',
-        r'^nvidia 3050$': 'nvidia rtx 3050',
-        r'(?<!\w )uhd': 'intel uhd',
-        r'(?<!\w )(?<!u)hd|gt2': 'intel hd', # https://www.techpowerup.com/gpu-specs/intel-haswell-gt2.g591
-        r'(?<!rtx\s)a3000': 'rtx a3000',
-        r'(?<!apple\s)m1': 'apple m1',
-        r'(?<!arm\s)mali': 'arm mali',
-        r'(?<!powervr\s)gx6250': 'powervr gx6250',
-        r'integrated[ _]?graphics|embedded|intergrated|integreted': 'integrated',
-        r'dedicated|integrated[ ,]+dedicated': 'dedicated',
-        r' graphic[s]?': '',
-        r'^amd radeon 5$': 'amd radeon r5',
-        r'^amd radeon 7$': 'amd radeon r7',
-    }
+    refreshRules()
+    df = extractGPU(df)
+    codes, uniques = pd.factorize(df['graphics_coprocessor'], use_na_sentinel=False)
+    kinds, brands, models = gpuColumns(uniques)
+    df['graphics'] = kinds[codes]
+    df['gpuBrand'] = brands[codes]
+    df['gpuModel'] = models[codes]
+    df = df.drop(columns=['graphics_coprocessor'], axis = 1)
     
+    return toCategory(df, ['graphics', 'gpuBrand', 'gpuModel'])
+
+# cleanGPU as a chain of passes over the whole column, one per rule
+# Kept as the reference cleanGPU is checked against (checks.py gpucpu)
+def cleanGPUPasses(df):
+    refreshRules()
     df = extractGPU(df)
     
-    for regex, gpu in gpuMapping.items():
-        df['graphics_coprocessor'] = df['graphics_coprocessor'].str.replace(regex, gpu, regex=True)
+    rewrite = GPURULES['rewrite']
+    for pattern, gpu in zip(rewrite['patterns'], rewrite['values']):
+        df['graphics_coprocessor'] = df['graphics_coprocessor'].str.replace(pattern, gpu, regex=True)
     
-    df['graphics_coprocessor'] = df['graphics_coprocessor'].apply(standardizeGPU)
+    df['graphics_coprocessor'] = mapUnique(df['graphics_coprocessor'], standardizeGPUColumn, CACHES['gpu'])
     
     df = fillInGraphics(df)
     
-    dedicatedIntegratedMapping = {
-        r'^dedicated$|^integrated$': 'NA',
-        r' integrated| dedicated': '',
-    }
+    tidy = GPURULES['tidy']
+    for pattern, replacement in zip(tidy['patterns'], tidy['values']):
+        df['graphics_coprocessor'] = df['graphics_coprocessor'].str.replace(pattern, replacement, regex=True)
     
-    for regex, replacement in dedicatedIntegratedMapping.items():
-        df['graphics_coprocessor'] = df['graphics_coprocessor'].str.replace(regex, replacement, regex=True)
-    
-    df[['gpuBrand', 'gpuModel']] = df['graphics_coprocessor'].str.split(n=1, expand=True)
+    df[['gpuBrand', 'gpuModel']] = df['graphics_coprocessor'].str.split(n=1, expand=True).reindex(columns=[0, 1])
     df['gpuModel'] = df['gpuModel'].fillna('NA')
     df = df.drop(columns=['graphics_coprocessor'], axis = 1)
     
-    return df
+    return toCategory(df, ['graphics', 'gpuBrand', 'gpuModel'])
 
 # Standardize CPU into brand and column
 # If no brand was found, infer it based on cpu model 
 def standardizeCPU(row):
     cpuBrand = None
     
-    cpuExtract = {
-        r'(?P<cpuBrand>amd)?\s?(?P<cpuModel>(?:ryzen|(?:[ra]\s|a-)series|athlon|silver|kabini|a4|a10)+(?:(?:\s|[a]?\d{1}|\d{4}|[umxhk]|-)+)?)', # AMD
-        r'(?P<cpuBrand>intel)?[ ]?(?P<cpuModel>(?:celeron|core|pentium|atom|xeon|mobile)+[ ]?(?:[imd](?:\d{1})?-?)?[ ]?(?:\d{3,5}[ugxmhktyq]+(?:\d{1})?e?|[nzp](?:\d{4})?|5y10|extreme|2 quad)?)', # Intel
-        r'(?P<cpuModel>(?:cortex) (?:a\d{1,2}))', # Arm
-        r'(?P<cpuModel>snapdragon)' # Qualcomm
-    }
-    
-    cpuBrandMap = {
-        r'ryzen|a[- ]series|athlon|a10|kabini|a4': 'amd', # https://www.amd.com/en/products/specifications/processors
-        r'celeron|core|pentium|atom|xeon|mobile': 'intel', # https://ark.intel.com/content/www/us/en/ark.html
-        r'cortex': 'arm', # https://www.arm.com/products/silicon-ip-cpu
-        r'snapdragon': 'qualcomm', # https://www.qualcomm.com/snapdragon/overview
-    }
-    
-    for regex in cpuExtract:
-        if match := re.search(regex, row):
+    for pattern in CPURULES['extract']['patterns']:
+        if match := pattern.search(row):
             if not match.groupdict().get('cpuBrand'):
-                for regex, brand in cpuBrandMap.items():
-                    if re.search(regex, row):
+                for brandPattern, brand in zip(CPURULES['brands']['patterns'], CPURULES['brands']['values']):
+                    if brandPattern.search(row):
                         cpuBrand = brand 
                         break
             else:
@@ -296,44 +450,89 @@ def standardizeCPU(row):
                 return cpuBrand
     
     return row
+
+# Same as standardizeCPU, but matches the whole column in one pass
+def standardizeCPUColumn(series):
+    extracted = extractRules(series, CPURULES['extract'], ['cpuBrand', 'cpuModel'])
+    hasBrand = extracted['cpuBrand'].fillna('') != ''
+    brand = extracted['cpuBrand'].str.strip()
+    brand[~hasBrand] = applyRules(series[~hasBrand], CPURULES['brands'], np.nan).to_numpy()
+    hasModel = extracted['cpuModel'].fillna('') != ''
+    model = extracted['cpuModel'].str.strip().str.replace('-', ' ', regex=False)
+    result = brand.where(~hasModel, brand + ' ' + model)
+    
+    # Rows with no brand at all go through the row function so they behave exactly the same
+    unmatched = extracted['rule'] == -1
+    noBrand = ~unmatched & brand.isna()
+    result[unmatched] = series[unmatched].to_numpy()
+    result[noBrand] = series[noBrand].apply(standardizeCPU).to_numpy()
+    return result
     
 # Tidy up CPU for easier extraction
 # Then split cpu into cpu brand and model
+# Every distinct cpu is cleaned once and spread to the rows through its code
 def cleanCPU(df):
-    cpuMapping = {
-        r'corei7-10750h': 'core i7-10750h',
-        r'unknown|others':'NA',
-        r' dual-core| cpu| family| other| processor': '',
-    }
-    
-    for regex, replacement in cpuMapping.items():
-        df['cpu'] = df['cpu'].str.replace(regex, replacement, regex=True)
+    refreshRules()
+    codes, uniques = pd.factorize(df['cpu'], use_na_sentinel=False)
+    brands, models = cpuColumns(uniques)
+    df['cpuBrand'] = brands[codes]
+    df['cpuModel'] = models[codes]
+    df = df.drop(columns=['cpu'], axis = 1)
+
+    return toCategory(df, ['cpuBrand', 'cpuModel'])
+
+# cpuBrand and cpuModel of every distinct cpu, in one pass over them:
+# the rewrite rules in order, the extraction (cached) and the split
+def cpuColumns(values):
+    rewritten = pd.Series([rewriteValue(CPURULES['rewrite'], value) for value in values], dtype=object)
+    return splitFirstWord(mapUnique(rewritten, standardizeCPUColumn, CACHES['cpu']).to_numpy())
+
+# cleanCPU as a chain of passes over the whole column, one per rule
+# Kept as the reference cleanCPU is checked against (checks.py gpucpu)
+def cleanCPUPasses(df):
+    refreshRules()
+    rewrite = CPURULES['rewrite']
+    for pattern, replacement in zip(rewrite['patterns'], rewrite['values']):
+        df['cpu'] = df['cpu'].str.replace(pattern, replacement, regex=True)
         
-    df['cpu'] = df['cpu'].apply(standardizeCPU)
+    df['cpu'] = mapUnique(df['cpu'], standardizeCPUColumn, CACHES['cpu'])
     
-    df[['cpuBrand', 'cpuModel']] = df['cpu'].str.split(n=1, expand=True)
+    df[['cpuBrand', 'cpuModel']] = df['cpu'].str.split(n=1, expand=True).reindex(columns=[0, 1])
     df['cpuModel'] = df['cpuModel'].fillna('NA')
     df = df.drop(columns=['cpu'], axis = 1)
 
-    return df
+    return toCategory(df, ['cpuBrand', 'cpuModel'])
 
 # Move the brand which are actually models to the model column
+MODELINBRAND = ['alienware', 'latitude', 'toughbook', 'jtd']
+
 def moveBrand(row):
-    modelInBrand = ['alienware', 'latitude', 'toughbook', 'jtd']
-    for model in modelInBrand:
+    for model in MODELINBRAND:
         if model in row['brand'] and model not in row['model']:
             row['model'] = model + ' ' + row['model']
             break
     return row
 
+# Same as moveBrand on every row, with one substring test per model name instead of per row
+def moveBrandColumns(df):
+    pending = np.ones(len(df), dtype=bool)
+    for model in MODELINBRAND:
+        move = pending & df['brand'].str.contains(model, regex=False).to_numpy(dtype=bool) \
+            & ~df['model'].str.contains(model, regex=False).to_numpy(dtype=bool)
+        df.loc[move, 'model'] = (model + ' ' + df.loc[move, 'model']).to_numpy()
+        pending &= ~move
+    return df
+
 # Standardize brands which are the same
+BRANDMAPPING = {
+    r'mac': 'apple',
+    r'toughbook': 'panasonic',
+    r'alienware|latitude': 'dell',
+}
+BRANDRULES = compileRules(BRANDMAPPING)
+
 def cleanBrand(row):
-    brandMapping = {
-        r'mac': 'apple',
-        r'toughbook': 'panasonic',
-        r'alienware|latitude': 'dell',
-    }
-    for regex, brand in brandMapping.items():
+    for regex, brand in BRANDMAPPING.items():
         if re.search(regex, row):
             return brand
     return row
@@ -347,20 +546,64 @@ def removeBrandInModel(row, brands):
             break
     return row
 
+# One regex over all brands, in the order they are tried
+# The lookahead reports a match at every position a brand starts. At each position the
+# alternation gives the earliest brand in the list, so the earliest brand found anywhere
+# in the model is the one removeBrandInModel would pick
+# The indexes of the last brand lists are kept, as chunks and service batches mostly see the same brands
+BRANDINDEXES = LRUCache(8)
+
+def brandIndex(brands):
+    key = tuple(brands)
+    if key not in BRANDINDEXES:
+        BRANDINDEXES.put(key, {
+            'regex': re.compile('(?=(' + '|'.join(re.escape(brand) for brand in brands) + '))'),
+            'rank': {brand: i for i, brand in enumerate(brands)},
+        })
+    return BRANDINDEXES.get(key)
+
+# Same as removeBrandInModel on every row. Each distinct model is scanned once for all brands
+def removeBrandInModelColumns(df, brands):
+    codes, models = pd.factorize(df['model'], use_na_sentinel=False)
+    found, newModels = brandsInModels(models, brands)
+    hasBrand = np.array([brand is not None for brand in found], dtype=bool)[codes]
+    df.loc[hasBrand, 'brand'] = found[codes[hasBrand]]
+    df['model'] = newModels[codes]
+    return df
+
+# The brand removeBrandInModel finds in every distinct model (None if none), and the model without it
+def brandsInModels(models, brands):
+    index = brandIndex(brands)
+    found = np.empty(len(models), dtype=object)
+    newModels = np.empty(len(models), dtype=object)
+    for i, model in enumerate(models):
+        matches = [match.group(1) for match in index['regex'].finditer(model)] if len(brands) else []
+        found[i] = min(matches, key=index['rank'].get) if matches else None
+        newModels[i] = model.replace(found[i], '').strip() if matches else model
+    return found, newModels
+
 # From the model name, infer the brand
+MODELBRANDMAPPING = {
+    r'mac': 'apple',
+    r'toughbook': 'panasonic',
+    r'alienware|latitude|precision|e6520': 'dell',
+    r'zephyrus|fire': 'asus',
+}
+MODELBRANDRULES = compileRules(MODELBRANDMAPPING)
+
 def fillBrandFromModel(row):
-    brandMapping = {
-        r'mac': 'apple',
-        r'toughbook': 'panasonic',
-        r'alienware|latitude|precision|e6520': 'dell',
-        r'zephyrus|fire': 'asus',
-    }
-    for regex, brand in brandMapping.items():
+    for regex, brand in MODELBRANDMAPPING.items():
         if re.search(regex, row['model']):
             row['brand'] = brand
             break
     return row
 
+# Same as fillBrandFromModel on every row
+def fillBrandFromModelColumns(df):
+    inferred = mapUnique(df['model'], lambda s: applyRules(s, MODELBRANDRULES, np.nan), CACHES['modelBrand'])
+    df['brand'] = inferred.where(inferred.notna(), df['brand'].to_numpy())
+    return df
+
 # Fix typo and remove unnecessary text from model name
 def removeUnnecessaryFromModel(df):
     replaceMap = {
@@ -378,54 +621,77 @@ def cleanup(row):
     row = re.sub('  +', ' ', row)
     return row
 
+# Move models out of the brand column and standardize the brand names
+# Only looks at each row on its own, so it can run on any slice of the data
+def cleanBrandColumn(df):
+    df = moveBrandColumns(df)
+    df['brand'] = mapUnique(df['brand'], lambda s: applyRules(s, BRANDRULES), CACHES['brand'])
+    return df
+
 # Apply all previously mentioned function to the brand nad model column
-def cleanModelAndBrand(df):
-    df = df.apply(moveBrand, axis=1)
-    df['brand'] = df['brand'].apply(cleanBrand)
-    brands = df['brand'].unique()
-    df = df.apply(removeBrandInModel, axis=1, brands=brands)
-    df = df.apply(fillBrandFromModel, axis=1)
+# brands is every brand in the data (after cleanBrandColumn), taken from df if not given.
+# When it is given, cleanBrandColumn must already have been run on df
+def cleanModelAndBrand(df, brands=None):
+    if brands is None:
+        df = cleanBrandColumn(df)
+        brands = df['brand'].unique()
+    df = removeBrandInModelColumns(df, brands)
+    df = fillBrandFromModelColumns(df)
     df = removeUnnecessaryFromModel(df)
-    df['model'] = df['model'].apply(cleanup)
+    df['model'] = df['model'].str.strip().str.replace('  +', ' ', regex=True) # cleanup on every row
     return df
 
-# Apply all column cleaning, and do some preprocessing/postprocessing
-def cleanData():
-    fileName = 'amazon_laptop_2023.xlsx'
+# Hash of every rule table the caches depend on
+def cacheVersion():
+    return rulesVersion(COLORMAP, OSMAPPING, GPURULES.digest, CPURULES.digest, BRANDMAPPING, MODELBRANDMAPPING)
 
-    df = pd.read_excel(fileName)
-    df = df.dropna(axis=1, how='all') # Drop any column with all missing data
+# Hit and miss counts of each normalization cache
+def cacheStats():
+    return {name: cache.stats() for name, cache in CACHES.items()}
 
-    # We dont know a computer's model, so cant recommend it
-    # IF this was a task analysing computers available on the market then
-    # maybe we wont need the model name
-    df = df.dropna(axis=0, subset=['model'])
-    
-    df = df.drop_duplicates(ignore_index=True, keep='first') # Drop rows which are exact duplicates
+CATEGORICALDATA = ['brand', 'model', 'color', 'cpu', 'os', 'special_features', 'graphics', 'graphics_coprocessor']
+# Columns which has units that needs to be standardized 
+# and to put those into numerical feature list instead of categorical
+NUMERICALDATA = ['harddisk', 'ram', 'screen_size', 'cpu_speed', 'rating', 'price']
 
-    # Standardize column names (Like making OS lower case)
-    df.columns = df.columns.str.lower().str.strip()
-    categoricalData = ['brand', 'model', 'color', 'cpu', 'os', 'special_features', 'graphics', 'graphics_coprocessor']
-    df = cleanCategorical(df, categoricalData)
+# Stages which only need the row itself, in the order cleanRows runs them
+# reads/writes are the columns each stage uses and produces (columns read but not written are dropped).
+# rowwise stages do Python work for every row and are worth splitting into row partitions.
+# Every stage keeps one row per listing (colors are exploded later, see explodeColors)
+ROWSTAGES = [
+    {'name': 'cleanCategorical', 'func': partial(cleanCategorical, categoricalData=CATEGORICALDATA),
+     'reads': CATEGORICALDATA, 'writes': CATEGORICALDATA},
+    {'name': 'cleanAllNum', 'func': partial(cleanAllNum, numericalData=NUMERICALDATA),
+     'reads': NUMERICALDATA, 'writes': NUMERICALDATA},
+    # Multiply TB values (less than 8) by 1024 to make it GB
+    {'name': 'cleanHDD', 'func': cleanHDD, 'reads': ['harddisk'], 'writes': ['harddisk']},
+    # Divide MHz values (more than 10) by 1000 to make it GHz
+    {'name': 'cleanCPUSpeed', 'func': cleanCPUSpeed, 'reads': ['cpu_speed'], 'writes': ['cpu_speed']},
+    # Ram is only integer amount. Round in case value is not integer
+    {'name': 'cleanRam', 'func': cleanRam, 'reads': ['ram'], 'writes': ['ram']},
+    # Clean color to remove non-standard values
+    {'name': 'cleanColor', 'func': cleanColor, 'reads': ['color'], 'writes': ['color']},
+    # Clean OS by simplifying it to OS type, and version
+    {'name': 'cleanOS', 'func': cleanOS, 'reads': ['os'], 'writes': ['os']},
+    # Clean special features by standardising features which are the same
+    {'name': 'cleanSpecialFeatures', 'func': cleanSpecialFeatures, 'reads': ['model', 'special_features'],
+     'writes': ['model', 'special_features'], 'rowwise': True},
+    # Clean GPU by standardizing all values and splitting them into gpu brand and gpu model. Also fill graphics column based on co_processor column
+    {'name': 'cleanGPU', 'func': cleanGPU, 'reads': ['graphics', 'graphics_coprocessor'],
+     'writes': ['graphics', 'gpuBrand', 'gpuModel']},
+    # Clean CPU by standardizing all values and splitting them into cpu brand and cpu model
+    {'name': 'cleanCPU', 'func': cleanCPU, 'reads': ['cpu'], 'writes': ['cpuBrand', 'cpuModel']},
+]
 
-    # Rename columns which has units that needs to be standardized 
-    # and to put those into numerical feature list instead of categorical
-    numericalData = ['harddisk', 'ram', 'screen_size', 'cpu_speed', 'rating', 'price']
-    df = cleanAllNum(df, numericalData)
-    
-    # Clean all columns
-    df = cleanHDD(df) # Multiply TB values (less than 8) by 1024 to make it GB
-    df = cleanCPUSpeed(df) # Divide MHz values (more than 10) by 1000 to make it GHz
-    df = cleanRam(df) # Ram is only integer amount. Round in case value is not integer
-    df = cleanColor(df) # Clean color to remove non-standard values
-    df = cleanOS(df) # Clean OS by simplifying it to OS type, and version
-    df = cleanSpecialFeatures(df) # Clean special features by standardising features which are the same
-    df = cleanGPU(df) # Clean GPU by standardizing all values and splitting them into gpu brand and gpu model. Also fill graphics column based on co_processor column
-    df = cleanCPU(df) # Clean CPU by standardizing all values and splitting them into cpu brand and cpu model
-    df = cleanModelAndBrand(df) # Remove data which doesnt belong in the column. Move then to correct place
-    
-    # Drop rows which are exact duplicates
-    df = df.drop_duplicates(ignore_index=True, keep='first') 
+# Clean every column which only needs the row itself, so it can run on any slice of the data
+def cleanRows(df, profiler=None):
+    for stage in ROWSTAGES:
+        df = profiled(profiler, stage['name'], stage['func'], df)
+    return df
+
+# Drop rows without a model, then rename, reorder and retype the columns
+# Expects duplicates to already be dropped
+def finishClean(df):
     # Dropping NA and pd.nan in model
     df = df[df['model'] != 'NA']
     df = df.dropna(axis=0, subset=['model'])
@@ -443,7 +709,7 @@ def cleanData():
     newOrder = ['brand', 'model', 'screen_size_in', 'color', 'harddisk_gb',
              'cpuBrand', 'cpuModel', 'ram_gb', 'os', 'special_features',
              'graphics', 'gpuBrand', 'gpuModel', 'cpu_speed_ghz', 'rating', 'price_dollar']
-    df = df[newOrder]
+    df = df[withModelId(df, newOrder)]
     
     new_data_types = {
         'harddisk_gb': 'int64',
@@ -451,155 +717,494 @@ def cleanData():
     }
     df = df.astype(new_data_types)
     
-    name = ['ram_screen_hdd_outlier', 'brand_color_os_pregrouping', 'hdd_prebin']
-    plotGraphsClean(df, name)
-    
-    df = cleanPostVisualize(df)
-    
-    newOrder = ['brand', 'model', 'screen_size_in', 'color', 'harddisk_gb', 'harddisk_range_gb',
-             'cpuBrand', 'cpuModel', 'ram_gb', 'os', 'special_features',
-             'graphics', 'gpuBrand', 'gpuModel', 'rating', 'price_dollar']
-    df = df[newOrder]
+    # brand is final now. The other columns are categories already, unless merging
+    # chunks or partitions with different categories turned them back into objects
+    df = toCategory(df, CATEGORYCOLUMNS)
+    return zeroToNaN(df)
+
+# 0 is used for missing numerical data while cleaning. Turn it back into NaN
+# so it is not plotted, and so cleanPostVisualize drops laptops with no ram, screen size or hard disk
+def zeroToNaN(df):
+    numericalData = ['screen_size_in', 'harddisk_gb', 'ram_gb', 'rating', 'price_dollar']
+    df[numericalData] = df[numericalData].replace(0, np.nan)
+    return df
+
+# Columns of the cleaned file, in order
+OUTPUTORDER = ['brand', 'model', 'screen_size_in', 'color', 'harddisk_gb', 'harddisk_range_gb',
+               'cpuBrand', 'cpuModel', 'ram_gb', 'os', 'special_features',
+               'graphics', 'gpuBrand', 'gpuModel', 'rating', 'price_dollar']
+
+# The columns of order, with model_id after model when the listings have one (see dedup.modelIds)
+def withModelId(df, order):
+    return [name for column in order for name in ([column, 'model_id'] if column == 'model' and 'model_id' in df else [column])]
+
+# Drop what cannot be cleaned from the raw data
+def prepareRaw(df):
+    df = df.dropna(axis=1, how='all') # Drop any column with all missing data
+
+    # We dont know a computer's model, so cant recommend it
+    # IF this was a task analysing computers available on the market then
+    # maybe we wont need the model name
+    df = df.dropna(axis=0, subset=['model'])
     
-    name = ['ram_screen_hdd_nooutlier', 'brand_color_os_postgrouping', 'hdd_postbin']
-    plotGraphsClean(df, name)
+    df = dropDuplicateRows(df) # Drop rows which are exact duplicates (see dedup.py)
+
+    # Standardize column names (Like making OS lower case)
+    df.columns = df.columns.str.lower().str.strip()
+    return df
+
+def readRaw(fileName):
+    return prepareRaw(readTable(fileName))
+
+# Options of clean(), keys missing from the given config keep these values
+CLEANCONFIG = {
+    'workers': 1, # Worker processes for the row stages (see parallel.py)
+    # Save the graphs of plotGraphsClean to FILEPATH: 'off', 'inline' (in this process, True works too)
+    # or 'background' (in a plot worker process, while the cleaning goes on)
+    'plots': 'off',
+    'profiler': None, # Profiler recording every stage (see profiling.py)
+    # 'rows': a row for every color of a listing, 'sets': a row for every listing, color holding the tuple of its colors
+    'colors': 'rows',
+    # None: drop exact duplicate rows. A dict of options of dedup.NEARDUPLICATES ({} for the defaults):
+    # rows equal apart from near duplicate model texts are dropped too
+    'nearDuplicates': None,
+    # None: no model ids. A dict of options of dedup.MODELIDS ({} for the defaults): a model_id column after model,
+    # the same for the listings of one laptop whose titles differ a little, and rows equal apart from their
+    # model text (with the same model_id) are dropped as duplicates
+    'modelIds': None,
+    # None: remove the outliers above OUTLIERLIMITS. A quantile (e.g. 0.999): remove the values above that
+    # quantile of each outlier column, estimated with a t-digest (see sketches.py)
+    'outlierQuantile': None,
+    # 'pandas': the stages of this file. 'polars': the same cleaning as one lazy Polars plan (see lazy.py),
+    # only with the default workers, colors, nearDuplicates, modelIds and outlierQuantile and without plots
+    'engine': 'pandas',
+    # None, or a checkpoint cache (see checkpoints.py): the output of every stage is saved, and a run with the
+    # same input starts after the last stage which did not change since (pandas engine only)
+    'checkpoints': None,
+}
+
+# cleanPostVisualize with the outlier limits of clean(): OUTLIERLIMITS, or the value at outlierQuantile of
+# every outlier column. The columns are put in the order of the cleaned file
+def cleanOutput(df, outlierQuantile=None):
+    limits = None
+    if outlierQuantile is not None:
+        limits = outlierLimits(outlierDigests(df), outlierQuantile)
+    df = cleanPostVisualize(df, limits)
+    return df[withModelId(df, OUTPUTORDER)]
+
+# Stages of clean() before the graphs of the cleaned columns and after them, as (name, function of the frame)
+# pairs. With a checkpoint cache every row stage is a stage of its own, so that a change in one of them
+# only runs it and the stages after it again
+def cleanStages(config, profiler=None):
+    stages = [('prepareRaw', prepareRaw)]
+    if config['workers'] > 1:
+        from parallel import cleanParallel
+        stages.append(('cleanParallel', partial(cleanParallel, workers=config['workers'])))
+    elif config['checkpoints'] is not None:
+        stages += [(stage['name'], stage['func']) for stage in ROWSTAGES]
+    else:
+        stages.append(('cleanRows', partial(cleanRows, profiler=profiler)))
+    if config['workers'] <= 1:
+        # Remove data which doesnt belong in the column. Move then to correct place
+        stages.append(('cleanModelAndBrand', cleanModelAndBrand))
+    if config['colors'] == 'rows':
+        stages.append(('explodeColors', explodeColors))
+    else:
+        stages.append(('colorSets', colorSets))
+    if config['modelIds'] is not None:
+        stages.append(('addModelIds', partial(addModelIds, options=config['modelIds'])))
+    # Drop rows which are exact duplicates, by their fingerprints (see dedup.py)
+    stages.append(('dropDuplicates', partial(dropDuplicateRows, near=config['nearDuplicates'])))
+    stages.append(('finishClean', finishClean))
+    return stages, [('cleanPostVisualize', partial(cleanOutput, outlierQuantile=config['outlierQuantile']))]
+
+# Run the stages one after the other, returns the output and its key. With a checkpoint cache the run starts
+# after the last stage whose output is saved (key is the key of df, see checkpoints.py)
+def runStages(df, stages, profiler=None, checkpoints=None, key=None):
+    if checkpoints is not None:
+        return checkpoints.run(df, stages, key, profiler)
+    for name, func in stages:
+        df = profiled(profiler, name, func, df)
+    return df, key
+
+# Clean a frame of raw listings (as read from the scraped file) and return the cleaned frame
+# Nothing is read or written, apart from the graphs if config['plots'] is set
+# Graphs drawn in the background are finished when clean() returns
+def clean(df, config=None):
+    config = {**CLEANCONFIG, **(config or {})}
+    unknown = set(config) - set(CLEANCONFIG)
+    if unknown:
+        raise ValueError(f'Unknown clean() options: {sorted(unknown)}')
+    plots = {False: 'off', True: 'inline'}.get(config['plots'], config['plots'])
+    if plots not in ['off', 'inline', 'background']:
+        raise ValueError(f"Unknown plots mode: {config['plots']!r}")
+    if config['colors'] not in ['rows', 'sets']:
+        raise ValueError(f"Unknown colors mode: {config['colors']!r}")
+    if config['outlierQuantile'] is not None and not 0 < config['outlierQuantile'] <= 1:
+        raise ValueError(f"Outlier quantile {config['outlierQuantile']!r} is not between 0 and 1")
+    if config['engine'] not in ['pandas', 'polars']:
+        raise ValueError(f"Unknown engine: {config['engine']!r}")
+    profiler = config['profiler']
+    refreshRules() # Before any worker process starts, so they all see the same rules
+
+    if config['engine'] == 'polars':
+        changed = [name for name in ['workers', 'colors', 'nearDuplicates', 'modelIds', 'outlierQuantile', 'checkpoints']
+                   if config[name] != CLEANCONFIG[name]] + (['plots'] if plots != 'off' else [])
+        if changed:
+            raise ValueError(f'The polars engine does not take the options {changed}')
+        from lazy import cleanLazy
+        return profiled(profiler, 'cleanLazy', cleanLazy, df)
+
+    checkpoints = config['checkpoints']
+    key = None
+    if checkpoints is not None:
+        from checkpoints import frameKey
+        key = profiled(profiler, 'frameKey', frameKey, df)
+
+    # Without graphs all the stages run as one, so a run whose output is saved only loads that
+    before, after = cleanStages(config, profiler)
+    segments = [before + after] if plots == 'off' else [before, after]
+    names = [['ram_screen_hdd_outlier', 'brand_color_os_pregrouping', 'hdd_prebin'],
+             ['ram_screen_hdd_nooutlier', 'brand_color_os_postgrouping', 'hdd_postbin']]
+    # The plot pool is shut down (waiting for its graphs) even if a stage raises
+    with plotPool() if plots == 'background' else nullcontext() as pool:
+        futures = []
+        for stages, name in zip(segments, names):
+            df, key = runStages(df, stages, profiler, checkpoints, key)
+            if plots != 'off':
+                future = profiled(profiler, 'plotGraphsClean', plotGraphsClean, df, name, profiler, pool)
+                if pool is not None:
+                    futures.append(future)
+
+        if pool is not None:
+            profiled(profiler, 'waitGraphs', lambda futures: [future.result() for future in futures], futures)
+    return df
+
+# Apply all column cleaning, and do some preprocessing/postprocessing
+# If cacheFile is given, the normalization caches are loaded from it and saved back after the run
+# If chunkSize is given, the file is cleaned chunkSize rows at a time (see streaming.py) and no graphs are drawn
+# If workers is more than 1, independent stages run at the same time in that many processes (see parallel.py)
+# If storeFile is given, only rows not cleaned in an earlier run go through the row stages (see incremental.py)
+# and no graphs are drawn
+# If profile is given, a JSON report of the time, memory and rows of every stage is written to it,
+# and flameGraph gets sampled folded stacks of the run (see profiling.py). With chunkSize or storeFile
+# the whole run is one stage of the report, the flame graph still shows the functions inside it
+# plots is 'off', 'inline' or 'background', colors is 'rows' or 'sets', nearDuplicates and modelIds None or
+# a dict of options, outlierQuantile None or a quantile and engine 'pandas' or 'polars' (see CLEANCONFIG).
+# colors='sets', nearDuplicates, modelIds and the polars engine only work on the whole file, without chunkSize
+# or storeFile, outlierQuantile does not work with storeFile
+# If checkpointDir is given, the output of every stage (reading the file too) is saved there, up to
+# checkpointSize bytes, and a run starts after the last stage which did not change (see checkpoints.py).
+# It only works on the whole file with the pandas engine
+# The input and output formats (Excel, CSV, Parquet or Arrow) are picked from the file extensions (see storage.py)
+def cleanData(cacheFile=None, chunkSize=None, workers=1,
+              fileName='amazon_laptop_2023.xlsx', outputName='amazon_laptop_2023_cleaned.xlsx', storeFile=None,
+              profile=None, flameGraph=None, plots='inline', colors='rows', nearDuplicates=None,
+              outlierQuantile=None, engine='pandas', checkpointDir=None, checkpointSize=None, modelIds=None):
+    if colors != 'rows' and (chunkSize or storeFile):
+        raise ValueError(f'colors={colors!r} cannot be used with chunkSize or storeFile')
+    if nearDuplicates is not None and (chunkSize or storeFile):
+        raise ValueError('nearDuplicates cannot be used with chunkSize or storeFile')
+    if modelIds is not None and (chunkSize or storeFile):
+        raise ValueError('modelIds cannot be used with chunkSize or storeFile')
+    if engine != 'pandas' and (chunkSize or storeFile):
+        raise ValueError(f'engine={engine!r} cannot be used with chunkSize or storeFile')
+    if outlierQuantile is not None and storeFile:
+        raise ValueError('outlierQuantile cannot be used with storeFile')
+    if checkpointDir and (chunkSize or storeFile):
+        raise ValueError('checkpointDir cannot be used with chunkSize or storeFile')
+    loadCaches(CACHES, cacheFile, cacheVersion())
+
+    # The profiler is stopped (tracemalloc and the sampler thread too) even if a stage raises
+    with Profiler(sampleInterval=0.005 if flameGraph else None) if profile or flameGraph else nullcontext() as profiler:
+        if chunkSize:
+            from streaming import cleanStream
+            profiled(profiler, 'cleanStream', cleanStream, fileName, outputName, chunkSize, outlierQuantile=outlierQuantile)
+        elif storeFile:
+            from incremental import cleanIncremental
+            profiled(profiler, 'cleanIncremental', cleanIncremental, fileName, outputName, storeFile)
+        else:
+            checkpoints = None
+            if checkpointDir:
+                from checkpoints import CheckpointCache, fileKey
+                checkpoints = CheckpointCache(checkpointDir, checkpointSize)
+                df, _ = checkpoints.run(fileName, [('readTable', readTable)], fileKey(fileName), profiler)
+            else:
+                df = profiled(profiler, 'readTable', readTable, fileName)
+            df = clean(df, {'workers': workers, 'plots': plots, 'profiler': profiler, 'colors': colors,
+                           'nearDuplicates': nearDuplicates, 'modelIds': modelIds, 'outlierQuantile': outlierQuantile,
+                           'engine': engine, 'checkpoints': checkpoints})
+            profiled(profiler, 'writeTable', writeTable, df, outputName)
+
+    if profile:
+        profiler.saveReport(profile)
+    if flameGraph:
+        profiler.saveFolded(flameGraph)
     
-    df.to_excel('amazon_laptop_2023_cleaned.xlsx', index=False)
+    if cacheFile:
+        saveCaches(CACHES, cacheFile, cacheVersion())
+
+# Quartiles, whiskers (1.5 IQR) and outliers of a column, what a box plot draws
+# Outliers with the same value are drawn on top of each other, so only distinct ones are kept
+def boxStats(values):
+    q1, median, q3 = np.percentile(values, [25, 50, 75])
+    low, high = q1 - 1.5 * (q3 - q1), q3 + 1.5 * (q3 - q1)
+    inside = values[(values >= low) & (values <= high)]
+    return {'med': median, 'q1': q1, 'q3': q3, 'whislo': inside.min(), 'whishi': inside.max(),
+            'fliers': np.unique(values[(values < low) | (values > high)])}
+
+# Everything the graphs are drawn from, taken from the data once: box plot statistics, histogram
+# counts and value counts. Much smaller than the frame, so it is cheap to send to another process
+def plotData(laptops):
+    data = {'box': {}, 'hist': {}, 'counts': {}}
+    for column in ['ram_gb', 'screen_size_in', 'harddisk_gb']:
+        values = laptops[column].dropna().to_numpy()
+        data['box'][column] = boxStats(values)
+        data['hist'][column] = np.histogram(values, bins='auto')
+    for column in ['brand', 'color', 'os']:
+        # Only the values in the data, every color of a listing with colors='sets'
+        data['counts'][column] = laptops[column].astype(object).explode().value_counts()
+    if 'cpu_speed_ghz' in laptops:
+        data['counts']['cpu_speed_ghz'] = laptops['cpu_speed_ghz'].fillna(0).value_counts()
+    if 'harddisk_range_gb' in laptops:
+        data['counts']['harddisk'] = laptops['harddisk_range_gb'].astype('category').value_counts(sort=False)
+    else:
+        harddisk = laptops['harddisk_gb']
+        data['counts']['harddisk'] = harddisk[(harddisk >= 0) & (harddisk <= 2048)].value_counts().sort_index()
+    return data
+
+# Horizontal box plot of boxStats() in the seaborn style
+def boxPlot(stats, ax):
+    import seaborn as sns
+    ax.bxp([stats], orientation='horizontal', widths=0.8, patch_artist=True, flierprops={"marker": "x"},
+           boxprops={'facecolor': sns.color_palette()[0], 'edgecolor': '.25'}, medianprops={'color': '.25'},
+           whiskerprops={'color': '.25'}, capprops={'color': '.25'})
+
+# Bar for every counted value, in the order of counts
+def countBars(counts, ax):
+    import seaborn as sns
+    sns.barplot(x=counts.index.astype(str), y=counts.to_numpy(), color=sns.color_palette()[0], ax=ax)
 
 # Plot data to show and remove outliers
-def plotOutlier(laptops, name):
+def plotOutlier(data, name):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     # Create a figure and subplots
     fig, axes = plt.subplots(nrows=2, ncols=3, figsize=(15, 8))
 
     # Plot the boxplot for RAM, Screen Size, HDD
-    sns.boxplot(data=laptops, x='ram_gb', flierprops={"marker": "x"}, ax=axes[0, 0])
-    axes[0, 0].set(xlabel='GB', ylabel='RAM', title='Distribution of RAM')
+    boxPlot(data['box']['ram_gb'], axes[0, 0])
+    axes[0, 0].set(xlabel='GB', ylabel='RAM', title='Distribution of RAM', yticks=[])
     axes[0, 0].set_ylabel(axes[0, 0].get_ylabel(), rotation=0, labelpad=10)
 
-    sns.boxplot(data=laptops, x='screen_size_in', flierprops={"marker": "x"}, ax=axes[0, 1])
-    axes[0, 1].set(xlabel='In', ylabel='Size', title='Distribution of Screen Size')
+    boxPlot(data['box']['screen_size_in'], axes[0, 1])
+    axes[0, 1].set(xlabel='In', ylabel='Size', title='Distribution of Screen Size', yticks=[])
     axes[0, 1].set_ylabel(axes[0, 1].get_ylabel(), rotation=0, labelpad=15)
 
-    sns.boxplot(data=laptops, x='harddisk_gb', flierprops={"marker": "x"}, ax=axes[0, 2])
-    axes[0, 2].set(xlabel='GB', ylabel='HD', title='Distribution of Hard Disk')
+    boxPlot(data['box']['harddisk_gb'], axes[0, 2])
+    axes[0, 2].set(xlabel='GB', ylabel='HD', title='Distribution of Hard Disk', yticks=[])
     axes[0, 2].set_ylabel(axes[0, 2].get_ylabel(), rotation=0, labelpad=10)
-    
-    # Plot histograms for RAM, Screen Size, and HDD in the second row
-    sns.histplot(data=laptops, x='ram_gb', ax=axes[1, 0])
-    axes[1, 0].set(xlabel='GB', ylabel='Freq')
 
-    sns.histplot(data=laptops, x='screen_size_in', ax=axes[1, 1])
-    axes[1, 1].set(xlabel='In', ylabel='Freq')
+    # Plot histograms for RAM, Screen Size, and HDD in the second row
+    for ax, column, xlabel in zip(axes[1], ['ram_gb', 'screen_size_in', 'harddisk_gb'], ['GB', 'In', 'GB']):
+        counts, edges = data['hist'][column]
+        ax.hist(edges[:-1], bins=edges, weights=counts, color=sns.color_palette()[0], alpha=0.75)
+        ax.set(xlabel=xlabel, ylabel='Freq')
 
-    sns.histplot(data=laptops, x='harddisk_gb', ax=axes[1, 2])
-    axes[1, 2].set(xlabel='GB', ylabel='Freq')
-    
     plt.tight_layout()
     plt.savefig(FILEPATH + name + '.png')
+    plt.close(fig)
 
 # Plot data to group into less parts
-def plotGroupCount(laptops, name):
+def plotGroupCount(data, name):
+    import matplotlib.pyplot as plt
+
     fig, axes = plt.subplots(nrows=1, ncols=3, figsize=(18, 8))
-    
+
     # Plot countplots for brand, color, OS
     rotation = 45
     label = ['Brand', 'Color', 'Operating System']
-    if laptops['brand'].nunique() > 15:
+    if len(data['counts']['brand']) > 15:
         rotation = 77
         for i in range(len(label)):
             label[i] += ' (More than 10)'
-    sns.countplot(data=laptops, x='brand', order=laptops['brand'].value_counts().index, ax=axes[0])
+    countBars(data['counts']['brand'], axes[0])
     axes[0].set(xlabel=label[0], ylabel='Count', title='Distribution of Brand')
     axes[0].set_ylabel(axes[0].get_ylabel(), rotation=0, labelpad=20)
     axes[0].set_xlabel(axes[0].get_xlabel(), rotation=0, labelpad=10)
-    axes[0].set_xticklabels(axes[0].get_xticklabels(), rotation=rotation)
-    
-    sns.countplot(data=laptops, x='color', order=laptops['color'].value_counts().index, ax=axes[1])
+    axes[0].tick_params(axis='x', labelrotation=rotation)
+
+    countBars(data['counts']['color'], axes[1])
     axes[1].set(xlabel=label[1], ylabel='Count', title='Distribution of Color')
     axes[1].set_ylabel(axes[1].get_ylabel(), rotation=0, labelpad=20)
     axes[1].set_xlabel(axes[1].get_xlabel(), rotation=0, labelpad=20)
-    axes[1].set_xticklabels(axes[1].get_xticklabels(), rotation=45)
-    
-    sns.countplot(data=laptops, x='os', order=laptops['os'].value_counts().index, ax=axes[2])
+    axes[1].tick_params(axis='x', labelrotation=45)
+
+    countBars(data['counts']['os'], axes[2])
     axes[2].set(xlabel=label[2], ylabel='Count', title='Distribution of Operating System')
     axes[2].set_ylabel(axes[2].get_ylabel(), rotation=0, labelpad=20)
     axes[2].set_xlabel(axes[2].get_xlabel(), rotation=0, labelpad=10)
-    axes[2].set_xticklabels(axes[2].get_xticklabels(), rotation=45)
-    
+    axes[2].tick_params(axis='x', labelrotation=45)
+
     plt.tight_layout()
     plt.savefig(FILEPATH + name + '.png')
+    plt.close(fig)
 
 # Plot cpu speed to show why to drop it
-def plotDropCount(laptops):
+def plotDropCount(data):
+    import matplotlib.pyplot as plt
+
     fig, axes = plt.subplots(nrows=1, ncols=1, figsize=(15, 8))
-    
-    laptops['cpu_speed_ghz'] = laptops['cpu_speed_ghz'].fillna(0)
-    sns.countplot(data=laptops, x='cpu_speed_ghz', order=laptops['cpu_speed_ghz'].value_counts().index, ax=axes)
+
+    countBars(data['counts']['cpu_speed_ghz'], axes)
     axes.set(xlabel='CPU Speed (GHz)', ylabel='Count', title='Distribution of CPU speed')
     axes.set_ylabel(axes.get_ylabel(), rotation=0, labelpad=20)
     axes.set_xlabel(axes.get_xlabel(), rotation=0, labelpad=20)
 
     plt.tight_layout()
     plt.savefig(FILEPATH + 'cpu_speed_sparce.png')
+    plt.close(fig)
 
 # Plot hard disk to show why to bin values
-def plotBins(laptops, name):
+def plotBins(data, name):
+    import matplotlib.pyplot as plt
+
     fig, axes = plt.subplots(nrows=1, ncols=1, figsize=(15, 8))
-        
-    col = 'harddisk_gb'
-    data = laptops[(laptops['harddisk_gb'] >= 0) & (laptops['harddisk_gb'] <= 2048)]
-    if 'harddisk_range_gb' in laptops:
-        col = 'harddisk_range_gb'
-        laptops[col] = laptops[col].astype('category')
-        data = laptops
-        
-    sns.countplot(data=data, x=col, ax=axes)
+
+    countBars(data['counts']['harddisk'], axes)
     axes.set(xlabel='Hard Disk (GB)', ylabel='Count', title='Distribution of Hard Disk')
     axes.set_ylabel(axes.get_ylabel(), rotation=0, labelpad=20)
     axes.set_xlabel(axes.get_xlabel(), rotation=0, labelpad=20)
-    axes.set_xticklabels(axes.get_xticklabels(), rotation=45)
+    axes.tick_params(axis='x', labelrotation=45)
 
     plt.tight_layout()
     plt.savefig(FILEPATH + name + '.png')
+    plt.close(fig)
 
-def plotGraphsClean(df, name = ['a', 'b', 'c']):
+# Draw every graph from plotData(), in this process or in a plot worker
+def drawGraphs(data, name, profiler=None):
+    import seaborn as sns
     sns.set_theme()
-    laptops = df
-    numericalData = ['screen_size_in', 'harddisk_gb', 'ram_gb', 'rating', 'price_dollar'] #, 'cpu_speed_ghz']
-    laptops[numericalData] = laptops[numericalData].replace(0, np.nan)
-    
-    plotOutlier(laptops, name[0])
-    plotGroupCount(laptops, name[1])
-    if 'cpu_speed_ghz' in laptops:
-        plotDropCount(laptops)
-    plotBins(laptops, name[2])
+
+    profiled(profiler, 'plotOutlier', plotOutlier, data, name[0])
+    profiled(profiler, 'plotGroupCount', plotGroupCount, data, name[1])
+    if 'cpu_speed_ghz' in data['counts']:
+        profiled(profiler, 'plotDropCount', plotDropCount, data)
+    profiled(profiler, 'plotBins', plotBins, data, name[2])
+
+# Plot workers draw without a display
+def useAgg():
+    import matplotlib
+    matplotlib.use('Agg')
+
+# Pool of processes drawing graphs while the cleaning goes on
+def plotPool(workers=1):
+    from concurrent.futures import ProcessPoolExecutor
+    return ProcessPoolExecutor(max_workers=workers, initializer=useAgg)
+
+# Draw the graphs of the data, or send them to pool and return the future
+def plotGraphsClean(df, name = ['a', 'b', 'c'], profiler=None, pool=None):
+    data = profiled(profiler, 'plotData', plotData, df)
+    if pool is not None:
+        return pool.submit(drawGraphs, data, name)
+    drawGraphs(data, name, profiler)
+
+# Largest ram, screen size and hard disk removeOutliers keeps
+OUTLIERLIMITS = {'ram_gb': 70, 'screen_size_in': 20, 'harddisk_gb': 2048}
+
+# Remove outliers in ram, screen size and hard disk
+# limits maps each column to its largest value kept, OUTLIERLIMITS if not given
+def removeOutliers(df, limits=None):
+    limits = limits or OUTLIERLIMITS
+    keep = np.ones(len(df), dtype=bool)
+    for column, limit in limits.items():
+        keep &= (df[column] <= limit).to_numpy()
+    return df.take(np.flatnonzero(keep))
+
+# Quantile digests of the outlier columns, which merge across partitions (see sketches.py)
+def outlierDigests(df):
+    return {column: TDigest().update(df[column].to_numpy()) for column in OUTLIERLIMITS}
+
+# Limits of removeOutliers taken from the data: the value at quantile of every outlier column
+def outlierLimits(digests, quantile):
+    return {column: digests[column].quantile(quantile) for column in OUTLIERLIMITS}
+
+# Columns whose values with less than RARECOUNT laptops groupRare puts into 'others'
+GROUPEDCOLUMNS = ['brand', 'color', 'os']
+RARECOUNT = 11
+
+# Exact counts of the values of the grouped columns, which merge across partitions (see sketches.py)
+# Every value of the tuples is counted for a column of tuples
+def categoryCounts(df):
+    counts = {}
+    for column in GROUPEDCOLUMNS:
+        values = df[column].astype(object).explode() if isTupleColumn(df[column]) else df[column]
+        counts[column] = Counter({value: count for value, count in values.value_counts().items() if count})
+    return counts
+
+# Group brands, colors and OS with less than 11 laptops into 'others'
+# counts maps each column to its value counts (see categoryCounts), if not given they are counted from df
+# The columns stay categories, with 'others' in place of the rare values
+def groupRare(df, counts=None):
+    if counts is None:
+        counts = categoryCounts(df)
+    for column in GROUPEDCOLUMNS:
+        if isTupleColumn(df[column]):
+            df = groupRareInTuples(df, column, counts[column])
+            continue
+        count = df[column].map(dict(counts[column])).astype(float)
+        rare = count.lt(RARECOUNT).to_numpy()
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            if 'others' not in df[column].cat.categories:
+                df[column] = df[column].cat.add_categories(['others'])
+            df.loc[rare, column] = 'others'
+            df[column] = df[column].cat.remove_unused_categories()
+        else:
+            df.loc[rare, column] = 'others'
+    return df
+
+# Hard disk sizes sold as powers of 10, and the power of 2 they are snapped to
+HDDSNAP = {65: 64, 120: 128, 250: 256, 500: 512, 1000: 1024, 2000: 2048}
+
+# groupRare for a column of tuples (color with colors='sets'): every value of the tuples is counted,
+# the rare ones become 'others' inside the tuples. counts holds the counts of this column's values
+def groupRareInTuples(df, column, counts):
+    tuples = np.empty(len(df[column].cat.categories), dtype=object)
+    tuples[:] = [tuple(dict.fromkeys('others' if counts.get(value, 0) < RARECOUNT else value for value in values))
+                 for values in df[column].cat.categories]
+    df[column] = tupleColumn(tuples, df[column].cat.codes.to_numpy(), df.index)
+    return df
+
+# Snap hard disk sizes to the nearest power of 2 and bin them
+# One sorted lookup of every size in HDDSNAP
+def binHDD(df):
+    sizes, snapped = np.array(list(HDDSNAP), dtype=float), np.array(list(HDDSNAP.values()), dtype=float)
+    harddisk = df['harddisk_gb'].to_numpy()
+    position = np.minimum(np.searchsorted(sizes, harddisk), len(sizes) - 1)
+    df['harddisk_gb'] = np.where(sizes[position] == harddisk, snapped[position], harddisk)
     
+    bins = [16, 32, 64, 128, 256, 512, 1024, 2048, np.inf]
+    df['harddisk_range_gb'] = pd.cut(df['harddisk_gb'], bins=bins, right=False)
+    return df
+
 # Further clean data from visualization
-def cleanPostVisualize(df):
-    # Remove outliers
-    df = df[df['ram_gb'] <= 70]
-    df = df[df['screen_size_in'] <= 20]
-    df = df[df['harddisk_gb'] <= 2048]
+# limits are the outlier limits of removeOutliers, OUTLIERLIMITS if not given
+def cleanPostVisualize(df, limits=None):
+    df = removeOutliers(df, limits)
     
     # Reduce brand and color category
-    df.loc[df.groupby('brand').brand.transform('count').lt(11), 'brand'] = 'others'
-    df.loc[df.groupby('color').color.transform('count').lt(11), 'color'] = 'others'
-    df.loc[df.groupby('os').os.transform('count').lt(11), 'os'] = 'others'
+    df = groupRare(df)
     
     # Drop CPU speed column
     df = df.drop(columns=['cpu_speed_ghz'], axis = 1)
     
-    # Bin HDD
-    df.loc[df['harddisk_gb'] == 65, 'harddisk_gb'] = 64
-    df.loc[df['harddisk_gb'] == 120, 'harddisk_gb'] = 128
-    df.loc[df['harddisk_gb'] == 250, 'harddisk_gb'] = 256
-    df.loc[df['harddisk_gb'] == 500, 'harddisk_gb'] = 512
-    df.loc[df['harddisk_gb'] == 1000, 'harddisk_gb'] = 1024
-    df.loc[df['harddisk_gb'] == 2000, 'harddisk_gb'] = 2048
-    
-    bins = [16, 32, 64, 128, 256, 512, 1024, 2048, np.inf]
-    df['harddisk_range_gb'] = pd.cut(df['harddisk_gb'], bins=bins, right=False)
-
-    return df
+    df = binHDD(df)
+    return toCategory(df, CATEGORYCOLUMNS)
     
-cleanData()
\ No newline at end of file
+# python jssb25.py runs this file as __main__, a second copy of the module next to the jssb25 that
+# streaming.py, incremental.py and parallel.py import (with its own caches). The command line lives
+# in cli.py, which uses the imported jssb25 only
+if __name__ == '__main__':
+    from cli import main
+    main()
@@ -0,0 +1,194 @@
+import numpy as np
+import pandas as pd
+import polars as pl
+
+from cache import mapUnique
+from rules import applyRules
+from jssb25 import (brandsInModels, colorTuples, cpuColumns, gpuColumns, modelFeatures, roundLikePython,
+                    standardizeFeaturesColumn, tupleColumn, BRANDRULES, CACHES, CATEGORICALDATA, CATEGORYCOLUMNS,
+                    GROUPEDCOLUMNS, HDDSNAP, MODELBRANDRULES, MODELINBRAND, NUMERICALDATA, OSRULES, OUTLIERLIMITS,
+                    OUTPUTORDER, RARECOUNT)
+
+# Polars runs the regexes with Rust's engine and knows less whitespace than Python. So that every text
+# comes out as the pandas stages make it:
+# - SPACES are the characters str.strip and the \s of re treat as whitespace (all of them in the BMP)
+# - CASEFOLDS maps the characters whose casefold() is not their lower() (ß to ss...) to their casefold,
+#   replaced before lowercasing, which gives str.casefold
+SPACES = ''.join(char for char in map(chr, range(0x10000)) if char.isspace())
+CASEFOLDS = {char: char.casefold() for char in map(chr, range(0x10000)) if char.casefold() != char.lower()}
+CATEGORICALPATTERN = '([a-zA-Z0-9' + ''.join('\\x{%x}' % ord(char) for char in SPACES) + r'\-/,&.]+)'
+NUMBERPATTERN = r'([-+]?\d*\.?\d+)'
+HDDBINS = [16, 32, 64, 128, 256, 512, 1024, 2048, np.inf]
+
+# Values of a mapper as Polars takes them: tuples as lists and missing values (NaN, None) as null
+def polarsValues(values):
+    return [list(value) if isinstance(value, tuple) else value if isinstance(value, (str, list)) else None
+            for value in values]
+
+# Struct series of the outputs of func on every distinct value of series, spread to the rows with a join
+# func gets the distinct values as a pandas Series and returns the columns of schema, a value per distinct value
+def mapDistinct(series, func, schema):
+    uniques = series.unique(maintain_order=True)
+    outputs = func(pd.Series(uniques.to_list(), dtype=object))
+    mapped = pl.DataFrame([uniques.rename('key')] + [pl.Series(name, polarsValues(outputs[name]), dtype)
+                                                     for name, dtype in schema.items()])
+    return (series.rename('key').to_frame().join(mapped, on='key', how='left', nulls_equal=True, maintain_order='left')
+            .drop('key').to_struct(series.name))
+
+# Expression mapping every distinct value of column with func (see mapDistinct), one column per name of schema
+def distinctExpr(column, func, schema):
+    return pl.col(column).map_batches(lambda series: mapDistinct(series, func, schema),
+                                      return_dtype=pl.Struct(schema)).struct.unnest()
+
+# Raw frame to Polars: the columns pandas would drop as empty are dropped, and text columns only keep
+# strings (the .str methods of the pandas stages turn anything else into NaN). The other values of a
+# text column (numbers in the model column...) still tell raw rows apart and count as a model, so
+# they are kept as their text in a RAWKEY column, for the first stages of cleanPlan only
+RAWKEY = '{} (raw)'
+
+def polarsFrame(df):
+    df = df.dropna(axis=1, how='all').copy()
+    for column in list(df.columns):
+        if df[column].dtype == object:
+            isText = df[column].map(lambda value: isinstance(value, str))
+            if not (isText | df[column].isna()).all():
+                df[RAWKEY.format(column)] = df[column].where(~isText & df[column].notna()).map(str, na_action='ignore')
+            df[column] = df[column].where(isText, None)
+    return pl.from_pandas(df)
+
+# cleanCategorical
+def categoricalExpr(column):
+    text = pl.col(column).str.replace_many(list(CASEFOLDS), list(CASEFOLDS.values())).str.to_lowercase()
+    return text.str.strip_chars(SPACES).str.extract(CATEGORICALPATTERN).fill_null('NA').alias(column)
+
+# cleanNum, with the text columns parsed by Polars and the float columns kept
+def numberExpr(column, dtype):
+    if dtype == pl.String:
+        number = pl.col(column).str.replace_all(',', '', literal=True).str.extract(NUMBERPATTERN).cast(pl.Float64)
+    else:
+        number = pl.col(column).cast(pl.Float64)
+    return number.fill_null(0).alias(column)
+
+# The row stages (cleanRows), then cleanBrandColumn
+def rowStages(plan):
+    schema = plan.collect_schema()
+    plan = plan.with_columns([categoricalExpr(column) for column in CATEGORICALDATA]
+                             + [numberExpr(column, schema[column]) for column in NUMERICALDATA])
+    speed = pl.col('cpu_speed')
+    plan = plan.with_columns(
+        pl.when(pl.col('harddisk') <= 8).then(pl.col('harddisk') * 1024).otherwise(pl.col('harddisk')).alias('harddisk'),
+        pl.when(speed > 10).then(speed / 1000).otherwise(speed)
+        .map_batches(lambda values: pl.Series(roundLikePython(values.to_numpy(), 1)), return_dtype=pl.Float64)
+        .alias('cpu_speed'),
+        pl.col('ram').round(0),
+        distinctExpr('color', lambda colors: {'color': colorTuples(colors)}, {'color': pl.List(pl.String)}),
+        distinctExpr('os', lambda os: {'os': mapUnique(os, lambda s: applyRules(s, OSRULES, 'NA'), CACHES['os'])},
+                     {'os': pl.String}),
+        distinctExpr('model', lambda models: dict(zip(['model', 'found'], modelFeatures(models))),
+                     {'model': pl.String, 'found': pl.List(pl.String)}),
+    )
+
+    # cleanSpecialFeatures, cleanGPU (with extractGPU) and cleanCPU
+    moveGPU = ~pl.col('graphics').is_in(['integrated', 'dedicated', 'NA'])
+    coprocessor = pl.when(moveGPU & pl.col('graphics_coprocessor').str.contains('NA', literal=True)) \
+        .then(pl.col('graphics')).otherwise(pl.col('graphics_coprocessor'))
+    plan = plan.with_columns(
+        pl.concat_list(pl.col('special_features').str.split(','), 'found').alias('special_features'),
+        coprocessor.alias('graphics_coprocessor'),
+    ).drop('found')
+    plan = plan.with_columns(
+        distinctExpr('special_features', lambda lists: {'special_features': standardizeFeaturesColumn(lists).astype(object)},
+                     {'special_features': pl.List(pl.String)}),
+        distinctExpr('graphics_coprocessor', lambda gpus: dict(zip(['graphics', 'gpuBrand', 'gpuModel'], gpuColumns(gpus))),
+                     {'graphics': pl.String, 'gpuBrand': pl.String, 'gpuModel': pl.String}),
+        distinctExpr('cpu', lambda cpus: dict(zip(['cpuBrand', 'cpuModel'], cpuColumns(cpus))),
+                     {'cpuBrand': pl.String, 'cpuModel': pl.String}),
+    ).drop(['graphics_coprocessor', 'cpu'])
+
+    # cleanBrandColumn: moveBrandColumns (the first model of MODELINBRAND found in the brand) and the brand rules
+    brand, model = pl.col('brand'), pl.col('model')
+    moved = pl
+    for name in MODELINBRAND:
+        moved = moved.when(brand.str.contains(name, literal=True) & ~model.str.contains(name, literal=True)) \
+            .then(pl.lit(name + ' ') + model)
+    plan = plan.with_columns(moved.otherwise(model).alias('model'))
+    return plan.with_columns(distinctExpr('brand', lambda brands: {
+        'brand': mapUnique(brands, lambda s: applyRules(s, BRANDRULES), CACHES['brand'])}, {'brand': pl.String}))
+
+# removeBrandInModelColumns on a struct of brand and model: needs the whole column, for the brand list
+def removeBrandInModel(pair):
+    brand, model = pair.struct.field('brand'), pair.struct.field('model')
+    brands = brand.unique(maintain_order=True).to_list()
+    found = mapDistinct(model, lambda models: dict(zip(['found', 'model'], brandsInModels(models, brands))),
+                        {'found': pl.String, 'model': pl.String}).struct.unnest()
+    return pl.DataFrame([found['found'].fill_null(brand).alias('brand'), found['model']]).to_struct(pair.name)
+
+# cleanModelAndBrand (after cleanBrandColumn), explodeColors and dropDuplicateRows
+def modelStages(plan):
+    plan = plan.with_columns(pl.struct('brand', 'model').map_batches(
+        removeBrandInModel, return_dtype=pl.Struct({'brand': pl.String, 'model': pl.String})).struct.unnest())
+    inferred = distinctExpr('model', lambda models: {'inferred': mapUnique(
+        models, lambda s: applyRules(s, MODELBRANDRULES, np.nan), CACHES['modelBrand'])}, {'inferred': pl.String})
+    plan = plan.with_columns(inferred).with_columns(pl.coalesce('inferred', 'brand').alias('brand')).drop('inferred')
+    model = pl.col('model').str.replace_all('lititude', 'latitude') \
+        .str.replace_all('laptop|newest|flagship|commercial| pc|mobile workstation', '')
+    plan = plan.with_columns(model.str.strip_chars(SPACES).str.replace_all('  +', ' ').alias('model'))
+    plan = plan.explode('color')
+    return plan.unique(keep='first', maintain_order=True).with_row_index('index')
+
+# finishClean and cleanPostVisualize. hasZeroRam is whether a ram of 0 was turned into NaN, which makes
+# the pandas column float even after those rows are dropped
+def finishStages(plan):
+    plan = plan.filter((pl.col('model') != 'NA') & pl.col('model').is_not_null()).rename({
+        'harddisk': 'harddisk_gb', 'ram': 'ram_gb', 'screen_size': 'screen_size_in', 'cpu_speed': 'cpu_speed_ghz',
+        'price': 'price_dollar'})
+    plan = plan.with_columns(pl.col('harddisk_gb').cast(pl.Int64), pl.col('ram_gb').cast(pl.Int64))
+    plan = plan.with_columns((pl.col('ram_gb') == 0).any().alias('hasZeroRam'))
+    plan = plan.with_columns([pl.when(pl.col(column) == 0).then(None).otherwise(pl.col(column)).alias(column)
+                              for column in ['screen_size_in', 'harddisk_gb', 'ram_gb', 'rating', 'price_dollar']])
+
+    plan = plan.filter(pl.all_horizontal([pl.col(column) <= limit for column, limit in OUTLIERLIMITS.items()]))
+    plan = plan.with_columns([pl.when(pl.col(column).is_not_null() & (pl.len().over(column) < RARECOUNT))
+                              .then(pl.lit('others')).otherwise(pl.col(column)).alias(column) for column in GROUPEDCOLUMNS])
+    harddisk = pl.col('harddisk_gb').cast(pl.Float64).replace({float(size): float(snapped) for size, snapped in HDDSNAP.items()})
+    plan = plan.with_columns(harddisk.alias('harddisk_gb')).with_columns(
+        (pl.sum_horizontal([pl.col('harddisk_gb') >= limit for limit in HDDBINS[:-1]]) - 1).alias('harddisk_range_gb'))
+    return plan.select(['index'] + OUTPUTORDER + ['hasZeroRam'])
+
+# The whole cleaning as one lazy plan over a Polars frame of raw listings (see polarsFrame)
+# The row filters, renames and projections are Polars expressions, the Python rule tables of the
+# mappers run once per distinct value inside the plan, so the optimizer still sees the rest of it
+def cleanPlan(raw):
+    keys = [RAWKEY.format(column) for column in raw.columns if RAWKEY.format(column) in raw.columns]
+    model = pl.coalesce('model', RAWKEY.format('model')) if RAWKEY.format('model') in keys else pl.col('model')
+    plan = raw.lazy().filter(model.is_not_null()).unique(keep='first', maintain_order=True).drop(keys)
+    plan = plan.rename({column: column.lower().strip() for column in raw.columns if column not in keys})
+    return finishStages(modelStages(rowStages(plan)))
+
+# Collected plan to the pandas frame clean() returns: the index of the rows after dropping duplicates,
+# categories for the text columns, tuples for the features and hard disk bins like pd.cut
+def pandasFrame(result):
+    df = result.drop(['index', 'hasZeroRam', 'special_features', 'harddisk_range_gb']).to_pandas()
+    df.index = result['index'].cast(pl.Int64).to_numpy()
+    if len(result) and result['hasZeroRam'][0]:
+        df['ram_gb'] = df['ram_gb'].astype(float)
+
+    codes, keys = np.empty(len(result), dtype=np.int64), {}
+    for i, features in enumerate(result['special_features'].to_list()):
+        codes[i] = keys.setdefault(tuple(features), len(keys))
+    tuples = np.empty(len(keys), dtype=object)
+    for features, code in keys.items():
+        tuples[code] = features
+    df['special_features'] = tupleColumn(tuples, codes, df.index)
+
+    bins = result['harddisk_range_gb'].fill_null(-1).to_numpy()
+    df['harddisk_range_gb'] = pd.Categorical.from_codes(bins, pd.IntervalIndex.from_breaks(HDDBINS, closed='left'),
+                                                        ordered=True)
+    for column in CATEGORYCOLUMNS:
+        if column != 'special_features':
+            df[column] = df[column].astype('category')
+    return df[OUTPUTORDER]
+
+# clean() with the lazy plan: a frame of raw listings in, the same cleaned frame clean() gives out
+def cleanLazy(df):
+    return pandasFrame(cleanPlan(polarsFrame(df)).collect())
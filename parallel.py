@@ -0,0 +1,115 @@
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from cache import cacheMarks, cacheChanges, mergeCaches, seedCaches
+from jssb25 import ROWSTAGES, CACHES, cleanBrandColumn, cleanModelAndBrand
+
+# Workers start with the cache entries of the parent
+def initWorker(entries):
+    seedCaches(CACHES, entries)
+
+# Run one stage on the columns it needs (in a worker process)
+# The entries the stage added to the caches go back with the result, the worker's caches are lost with it
+def runStage(func, df):
+    marks = cacheMarks(CACHES)
+    return func(df), cacheChanges(CACHES, marks)
+
+# Partitions of a stage put back together. Category columns get the union of the partitions'
+# categories (pd.concat turns categories which differ into objects)
+def concatParts(parts):
+    df = pd.concat(parts)
+    for column in parts[0].columns:
+        if isinstance(parts[0][column].dtype, pd.CategoricalDtype) and len(parts) > 1:
+            df[column] = union_categoricals([part[column] for part in parts], ignore_order=True)
+    return df
+
+# Result of the tasks of a stage, merging what they added to the caches into the parent's ones
+def stageResult(futures):
+    results = []
+    for future in futures:
+        result, changes = future.result()
+        mergeCaches(CACHES, changes)
+        results.append(result)
+    return concatParts(results)
+
+# For every stage, the earlier stages it has to wait for: the ones writing a column it
+# reads or writes, and the ones reading a column it overwrites
+def stageDependencies(stages):
+    dependencies = []
+    for i, stage in enumerate(stages):
+        uses = set(stage['reads']) | set(stage['writes'])
+        dependencies.append({j for j, earlier in enumerate(stages[:i])
+                             if set(earlier['writes']) & uses or set(earlier['reads']) & set(stage['writes'])})
+    return dependencies
+
+# Split a row-wise stage into one task per row partition, other stages are a single task
+def submitStage(pool, stage, df, workers):
+    if stage.get('rowwise') and workers > 1 and len(df) >= 2 * workers:
+        parts = np.array_split(np.arange(len(df)), workers)
+        return [pool.submit(runStage, stage['func'], df.iloc[part]) for part in parts]
+    return [pool.submit(runStage, stage['func'], df)]
+
+# Run stages as soon as the stages they depend on are done, up to workers at a time
+# Every stage gets only its own columns, and its output columns replace them in columns
+def runGraph(pool, stages, columns, workers):
+    dependencies = stageDependencies(stages)
+    done = set()
+    running = {}
+    results = {}
+    while len(done) < len(stages):
+        for i, stage in enumerate(stages):
+            if i not in done and i not in running and dependencies[i] <= done:
+                df = pd.DataFrame({column: columns[column] for column in stage['reads']})
+                running[i] = submitStage(pool, stage, df, workers)
+
+        wait([future for futures in running.values() for future in futures], return_when=FIRST_COMPLETED)
+        for i, futures in list(running.items()):
+            if all(future.done() for future in futures):
+                stage = stages[i]
+                result = stageResult(futures)
+                del running[i]
+                done.add(i)
+                results[i] = result
+                for column in stage['reads']:
+                    columns.pop(column, None)
+                for column in result.columns:
+                    columns[column] = result[column]
+    return results
+
+# Column order the serial run ends up with: dropped columns removed, new ones added at the end
+def stageOrder(stages, results, start):
+    order = list(start)
+    for i, stage in enumerate(stages):
+        order = [column for column in order if column in stage['writes'] or column not in stage['reads']]
+        order += [column for column in results[i].columns if column not in order]
+    return order
+
+# Run a row-wise stage split in row partitions over the pool
+def runPartitioned(pool, func, df, workers):
+    futures = submitStage(pool, {'func': func, 'rowwise': True}, df, workers)
+    return stageResult(futures)
+
+# Same result as cleanRows followed by cleanModelAndBrand, with independent stages run at
+# the same time in a pool of worker processes. The caches are shared through the parent: workers
+# start with its entries and send back the ones they add
+def cleanParallel(df, workers=4):
+    assert df.index.is_unique, 'cleanParallel needs a unique index'
+    start = list(df.columns)
+    columns = {column: df[column] for column in start}
+
+    entries = {name: list(cache.data.items()) for name, cache in CACHES.items()}
+    with ProcessPoolExecutor(max_workers=workers, initializer=initWorker, initargs=(entries,)) as pool:
+        results = runGraph(pool, ROWSTAGES, columns, workers)
+        order = stageOrder(ROWSTAGES, results, start)
+        df = pd.DataFrame(columns, index=df.index)
+
+        # Brand and model: the brand list has to be taken from every row, between the two parts
+        brandModel = runPartitioned(pool, cleanBrandColumn, df[['brand', 'model']], workers)
+        brands = brandModel['brand'].unique()
+        brandModel = runPartitioned(pool, partial(cleanModelAndBrand, brands=brands), brandModel, workers)
+        df[['brand', 'model']] = brandModel
+    return df[order]
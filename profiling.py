@@ -0,0 +1,199 @@
+import json
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+import pandas as pd
+
+MB = 2**20
+
+# Peak resident set size of the process so far (ru_maxrss is in KB on Linux, bytes on macOS)
+# None where there is no resource module (Windows)
+def maxRss():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / MB if sys.platform == 'darwin' else rss / 1024
+
+def frameMemory(df):
+    return df.memory_usage(deep=True).sum() / MB if isinstance(df, pd.DataFrame) else None
+
+def frameRows(df):
+    return len(df) if isinstance(df, pd.DataFrame) else None
+
+# Records wall time, CPU time, memory and row counts of every stage run through it
+# Stages can be nested (the row stages run inside cleanRows), each record has the path of stage names.
+# With traceMemory, tracemalloc gives the peak Python allocation of each stage (it slows the run down).
+# With sampleInterval, a thread samples the Python stack that often, for a flame graph of the functions.
+class Profiler:
+    def __init__(self, traceMemory=True, sampleInterval=None):
+        self.traceMemory = traceMemory
+        self.sampleInterval = sampleInterval
+        self.records = []
+        self.path = []
+        self.peaks = []
+        self.overheads = []
+        self.samples = Counter()
+        self.sampler = None
+
+    def start(self):
+        if self.traceMemory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self.sampleInterval:
+            self.sampling = True
+            self.sampler = threading.Thread(target=self.sample, args=(threading.main_thread().ident,), daemon=True)
+            self.sampler.start()
+        self.startTime = time.perf_counter()
+
+    def stop(self):
+        self.totalSeconds = time.perf_counter() - self.startTime
+        if self.sampler is not None:
+            self.sampling = False
+            self.sampler.join()
+            self.sampler = None
+        if self.traceMemory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # Fold the stack of the profiled thread under the current stage path, every sampleInterval seconds
+    def sample(self, threadId):
+        while self.sampling:
+            frame = sys._current_frames().get(threadId)
+            stack = []
+            while frame is not None:
+                module = frame.f_globals.get('__name__')
+                if module != __name__:
+                    stack.append(f'{frame.f_code.co_name} ({module})')
+                frame = frame.f_back
+            self.samples[';'.join(list(self.path) + stack[::-1])] += 1
+            time.sleep(self.sampleInterval)
+
+    # Run func(df, ...) as stage name and record it
+    # The time spent measuring the frames of nested stages is taken out of the times of this stage
+    def run(self, name, func, df, *args, **kwargs):
+        measureStart = time.perf_counter(), time.process_time()
+        self.path.append(name)
+        self.peaks.append(0)
+        self.overheads.append([0, 0])
+        try:
+            rowsIn, memoryIn = frameRows(df), frameMemory(df)
+            if self.traceMemory:
+                tracedBefore = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+            rssBefore = maxRss()
+            wallStart, cpuStart = time.perf_counter(), time.process_time()
+
+            result = func(df, *args, **kwargs)
+
+            wallEnd, cpuEnd = time.perf_counter(), time.process_time()
+            wallOverhead, cpuOverhead = self.overheads[-1]
+            rssAfter = maxRss()
+            record = {
+                'stage': name,
+                'path': ';'.join(self.path),
+                'wallSeconds': wallEnd - wallStart - wallOverhead,
+                'cpuSeconds': cpuEnd - cpuStart - cpuOverhead,
+                'rowsIn': rowsIn,
+                'rowsOut': frameRows(result),
+                'frameMemoryInMB': memoryIn,
+                'frameMemoryOutMB': frameMemory(result),
+                'maxRssMB': rssAfter,
+                'maxRssGrowthMB': None if rssAfter is None else rssAfter - rssBefore,
+            }
+            if self.traceMemory:
+                # A nested stage resets the tracemalloc peak, so its peak is passed up to this stage
+                current, peak = tracemalloc.get_traced_memory()
+                peak = max(peak, self.peaks[-1])
+                record['tracedPeakMB'] = (peak - tracedBefore) / MB
+                record['tracedDeltaMB'] = (current - tracedBefore) / MB
+                if len(self.peaks) > 1:
+                    self.peaks[-2] = max(self.peaks[-2], peak)
+            self.records.append(record)
+        finally:
+            # A stage which raised leaves no record, but the stage stack is unwound all the same
+            self.path.pop()
+            self.peaks.pop()
+            self.overheads.pop()
+        if self.overheads:
+            self.overheads[-1][0] += time.perf_counter() - measureStart[0] - record['wallSeconds']
+            self.overheads[-1][1] += time.process_time() - measureStart[1] - record['cpuSeconds']
+        return result
+
+    def report(self):
+        return {
+            'python': sys.version.split()[0],
+            'pandas': pd.__version__,
+            'totalSeconds': getattr(self, 'totalSeconds', None),
+            'stages': self.records,
+        }
+
+    def saveReport(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.report(), file, indent=2)
+
+    # Folded stacks ('a;b;c count' lines) for flamegraph.pl, speedscope and similar tools
+    # With sampling the counts are samples, otherwise the self time of each stage in microseconds
+    def folded(self):
+        if self.samples:
+            return dict(self.samples)
+        selfTime = Counter()
+        for record in self.records:
+            selfTime[record['path']] += record['wallSeconds']
+            parent = record['path'].rpartition(';')[0]
+            if parent:
+                selfTime[parent] -= record['wallSeconds']
+        return {path: round(seconds * 1e6) for path, seconds in selfTime.items() if seconds > 0}
+
+    def saveFolded(self, path):
+        with open(path, 'w') as file:
+            for stack, count in self.folded().items():
+                file.write(f'{stack} {count}\n')
+
+# Run func(df, ...) as a stage of profiler, or just run it when there is no profiler
+def profiled(profiler, name, func, df, *args, **kwargs):
+    if profiler is None:
+        return func(df, *args, **kwargs)
+    return profiler.run(name, func, df, *args, **kwargs)
+
+# Total wall time of every stage path in a report
+def stageTimes(report):
+    times = Counter()
+    for record in report['stages']:
+        times[record['path']] += record['wallSeconds']
+    return times
+
+# Stages of a report which got slower than in a base report by more than tolerance (0.2 is 20%)
+# Stages faster than minSeconds in both are ignored, their timings are mostly noise
+def compareReports(base, report, tolerance=0.2, minSeconds=0.01):
+    baseTimes, times = stageTimes(base), stageTimes(report)
+    slower = {}
+    for path, seconds in times.items():
+        before = baseTimes.get(path)
+        if before is None or max(before, seconds) < minSeconds:
+            continue
+        if seconds > before * (1 + tolerance):
+            slower[path] = {'baseSeconds': before, 'seconds': seconds, 'ratio': seconds / before}
+    return slower
+
+# Usage: python profiling.py <base report> <report> [tolerance]
+# Exits with 1 if a stage got slower than the tolerance allows
+if __name__ == '__main__':
+    with open(sys.argv[1]) as file:
+        base = json.load(file)
+    with open(sys.argv[2]) as file:
+        report = json.load(file)
+    tolerance = float(sys.argv[3]) if len(sys.argv) > 3 else 0.2
+    slower = compareReports(base, report, tolerance)
+    for path, change in slower.items():
+        print(f"{path}: {change['baseSeconds']:.3f}s -> {change['seconds']:.3f}s ({change['ratio']:.2f}x)")
+    sys.exit(1 if slower else 0)
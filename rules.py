@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import pickle
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Compile an ordered mapping (or list) of regexes once
+# The patterns stay separate and are tried in dict order, so the first rule that
+# matches anywhere in the string wins, exactly like looping over the dict with re.search
+def compileRules(rules):
+    if isinstance(rules, dict):
+        regexes, values = list(rules.keys()), list(rules.values())
+    else:
+        regexes, values = list(rules), [None] * len(rules)
+    return {
+        'patterns': [re.compile(regex) for regex in regexes],
+        'values': values,
+    }
+
+# Search one string with the rules, returning the index of the first match and the match
+def firstMatch(table, value):
+    if isinstance(value, str):
+        for i, pattern in enumerate(table['patterns']):
+            if match := pattern.search(value):
+                return i, match
+    return -1, None
+
+# Index of the first rule matching each value (-1 if none matched) and the matches
+# Runs as one tight loop over the column values instead of Series.apply with a Python function
+def matchRules(series, table):
+    searches = [(i, pattern.search) for i, pattern in enumerate(table['patterns'])]
+    index = np.full(len(series), -1, dtype=np.int64)
+    matches = [None] * len(series)
+    for row, value in enumerate(series.to_numpy()):
+        if not isinstance(value, str):
+            continue
+        for i, search in searches:
+            if match := search(value):
+                index[row] = i
+                matches[row] = match
+                break
+    return index, matches
+
+# Map every value to the value of its first matching rule
+# Values no rule matches get default, or are kept unchanged if default is None
+def applyRules(series, table, default=None):
+    index, _ = matchRules(series, table)
+    values = np.array(table['values'] + [default], dtype=object)
+    result = pd.Series(values[index], index=series.index, dtype=object)
+    if default is None:
+        result = result.where(index != -1, series.to_numpy())
+    return result
+
+# Run every rule of the table over one string in order, each replacing all its matches with its value
+# The same as one str.replace(pattern, value, regex=True) pass over the column per rule
+def rewriteValue(table, value):
+    if not isinstance(value, str):
+        return np.nan
+    for pattern, replacement in zip(table['patterns'], table['values']):
+        value = pattern.sub(replacement, value)
+    return value
+
+# Pull the named groups of the first matching rule into columns
+# Column 'rule' holds the index of that rule (-1 if none), group columns are NaN when
+# the rule did not take part in the match
+def extractRules(series, table, names):
+    index, matches = matchRules(series, table)
+    result = pd.DataFrame({'rule': index}, index=series.index)
+    for name in names:
+        result[name] = pd.Series([match.group(name) if match and name in match.re.groupindex else None for match in matches],
+                                 index=series.index, dtype=object)
+    return result
+
+# Rule files live in rulesets/, their compiled tables are kept in rulesets/.compiled/
+RULEDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rulesets')
+RULECACHEDIR = os.path.join(RULEDIR, '.compiled')
+# Layout of the rule files this code reads. The 'version' of a file is the version of its rules
+RULEFORMAT = 1
+
+# What _sre needs to build the compiled pattern of a regex: its flags, program and groups.
+# re.Pattern pickles as its source and is parsed again when loaded, this is what the parsing produces
+# Before Python 3.11 the parser is sre_parse and the regex itself is kept, to be compiled as usual
+def patternCode(regex):
+    try:
+        from re import _compiler, _parser
+    except ImportError:
+        return regex
+    parsed = _parser.parse(regex, 0)
+    groupindex = dict(parsed.state.groupdict)
+    indexgroup = [None] * parsed.state.groups
+    for name, i in groupindex.items():
+        indexgroup[i] = name
+    code = [int(op) for op in _compiler._code(parsed, 0)]
+    return (regex, parsed.state.flags, code, parsed.state.groups - 1, groupindex, tuple(indexgroup))
+
+def patternFromCode(code):
+    import _sre
+    if isinstance(code, str):
+        return re.compile(code)
+    return _sre.compile(*code)
+
+# The saved programs are only valid for the regex engine which produced them
+def engineVersion():
+    import _sre
+    return (sys.version, _sre.MAGIC)
+
+# Rules of every table of a rule file: a list of {'pattern', 'value', 'note'} in the order they are tried
+def ruleTables(content):
+    rules = json.loads(content)
+    if rules.get('format') != RULEFORMAT:
+        raise ValueError(f"Rule file format {rules.get('format')!r} is not {RULEFORMAT}")
+    return rules.get('version'), {name: table for name, table in rules.items() if name not in ['format', 'version']}
+
+# Compiled tables (as compileRules gives) of a rule file, loaded from the compiled cache when it has
+# this file's digest. Otherwise the rules are compiled and the cache is written (if it can be)
+def compileRuleFile(content, digest, cacheDir):
+    version, tables = ruleTables(content)
+    cachePath = os.path.join(cacheDir, digest + '.pkl') if cacheDir else None
+    codes = None
+    if cachePath and os.path.exists(cachePath):
+        with open(cachePath, 'rb') as file:
+            saved = pickle.load(file)
+        if saved['engine'] == engineVersion():
+            codes = saved['codes']
+    if codes is None:
+        codes = {name: [patternCode(rule['pattern']) for rule in table] for name, table in tables.items()}
+        if cachePath:
+            try:
+                os.makedirs(cacheDir, exist_ok=True)
+                with open(cachePath, 'wb') as file:
+                    pickle.dump({'engine': engineVersion(), 'codes': codes}, file)
+            except OSError:
+                pass # A read-only install compiles at every start
+    return version, {name: {
+        'patterns': [patternFromCode(code) for code in codes[name]],
+        'values': [rule.get('value') for rule in table],
+    } for name, table in tables.items()}
+
+# A rule file and its compiled tables. refresh() reloads them if the file changed on disk,
+# so a long-running process picks up edited rules without a restart
+class RuleFile:
+    def __init__(self, name, cacheDir=RULECACHEDIR):
+        self.path = os.path.join(RULEDIR, name)
+        self.cacheDir = cacheDir
+        self.stat = None
+        self.digest = None
+        self.reload()
+
+    def reload(self):
+        stat = os.stat(self.path)
+        with open(self.path, 'rb') as file:
+            content = file.read()
+        self.stat = (stat.st_mtime_ns, stat.st_size)
+        digest = hashlib.sha256(content).hexdigest()
+        if digest == self.digest:
+            return False
+        self.version, self.tables = compileRuleFile(content, digest, self.cacheDir)
+        self.digest = digest
+        return True
+
+    # Whether the tables were reloaded (a file touched without changing its rules is not reloaded)
+    def refresh(self):
+        stat = os.stat(self.path)
+        if (stat.st_mtime_ns, stat.st_size) == self.stat:
+            return False
+        return self.reload()
+
+    def __getitem__(self, name):
+        return self.tables[name]
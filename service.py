@@ -0,0 +1,251 @@
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from jssb25 import (cleanRows, cleanBrandColumn, cleanModelAndBrand, explodeColors, finishClean, removeOutliers,
+                    binHDD, refreshRules, readRaw, cacheStats, cacheVersion, CACHES, OUTPUTORDER)
+from cache import loadCaches
+from dedup import dropDuplicateRows
+from storage import arrowTable, typedColumns
+from streaming import RAWCOLUMNS, NUMCOLUMNS, alignTypes
+
+# Options of the service, keys missing from the given config keep these values
+SERVICECONFIG = {
+    'maxBatchRows': 5000, # A batch is cleaned as soon as it has this many raw rows
+    'maxDelay': 0.005, # or when its first request waited this many seconds
+    'latencyWindow': 10000, # Latencies of the last requests kept for the percentiles
+}
+
+ARROWTYPE = 'application/vnd.apache.arrow.stream'
+
+# Raw rows of a request, with the columns and types cleanRows expects
+# A numerical column which is numbers in one request and text in another would lose its numbers in the
+# batch (the text parsing turns numbers into NaN), so numbers are written out as text (never in
+# scientific notation, which the parsing would read wrong)
+def requestFrame(df):
+    df.columns = df.columns.str.lower().str.strip()
+    df = alignTypes(df.reindex(columns=RAWCOLUMNS).dropna(axis=0, subset=['model']))
+    for column in NUMCOLUMNS:
+        if pd.api.types.is_numeric_dtype(df[column]):
+            values = df[column].to_numpy()
+            df[column] = pd.Series([np.format_float_positional(value, trim='-') if not np.isnan(value) else np.nan
+                                    for value in values], index=df.index, dtype=object)
+    return df.reset_index(drop=True)
+
+# The cleaning every request gets, on all the requests of a batch in one pass
+# Duplicates are only dropped within a request (the request number is part of the row fingerprint).
+# Grouping rare brands, colors and OS needs the counts of a whole data set, so it is left out.
+# brands holds every brand seen since the service started, the brand lookup uses all of them
+def cleanRequests(frames, brands):
+    df = pd.concat(frames, ignore_index=True)
+    requestOf = np.repeat(np.arange(len(frames)), [len(frame) for frame in frames])
+    df = cleanBrandColumn(cleanRows(df))
+    brands.update(dict.fromkeys(df['brand'].unique()))
+    df = explodeColors(cleanModelAndBrand(df, list(brands)))
+    df['request'] = requestOf[df.index.to_numpy()]
+    df = dropDuplicateRows(df)
+    request = df.pop('request').to_numpy()
+    df = finishClean(df.set_index(request))
+    df = binHDD(removeOutliers(df).drop(columns=['cpu_speed_ghz']))[OUTPUTORDER]
+
+    bounds = np.searchsorted(df.index.to_numpy(), np.arange(len(frames) + 1))
+    return [df.iloc[bounds[i]:bounds[i + 1]].reset_index(drop=True) for i in range(len(frames))]
+
+# Percentiles of the latencies in milliseconds
+def latencyPercentiles(latencies):
+    if not latencies:
+        return {'p50': None, 'p99': None}
+    p50, p99 = np.percentile(np.fromiter(latencies, dtype=float), [50, 99]) * 1000
+    return {'p50': p50, 'p99': p99}
+
+# Collects the requests arriving at the same time and cleans them together: a batch is cleaned when it
+# has maxBatchRows raw rows, or maxDelay seconds after its first request arrived. The cleaning runs in a
+# thread, so the event loop keeps accepting requests meanwhile
+class MicroBatcher:
+    def __init__(self, config=None):
+        self.config = {**SERVICECONFIG, **(config or {})}
+        self.queue = asyncio.Queue()
+        self.brands = {}
+        self.latencies = deque(maxlen=self.config['latencyWindow'])
+        self.counts = {'requests': 0, 'rows': 0, 'batches': 0, 'errors': 0}
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+    # Cleaned rows of a frame of raw listings, once its batch is done
+    async def submit(self, df):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((requestFrame(df), future))
+        return await future
+
+    async def nextBatch(self):
+        batch = [await self.queue.get()]
+        rows = len(batch[0][0])
+        deadline = time.perf_counter() + self.config['maxDelay']
+        while rows < self.config['maxBatchRows']:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+            rows += len(batch[-1][0])
+        return batch
+
+    # If the batch fails, every request is cleaned on its own, so a bad request only fails itself
+    def cleanBatch(self, frames):
+        refreshRules()
+        try:
+            return cleanRequests(frames, self.brands)
+        except Exception:
+            results = []
+            for frame in frames:
+                try:
+                    results.append(cleanRequests([frame], self.brands)[0])
+                except Exception as error:
+                    results.append(error)
+            return results
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self.nextBatch()
+            results = await loop.run_in_executor(None, self.cleanBatch, [frame for frame, _ in batch])
+            self.counts['batches'] += 1
+            for (frame, future), result in zip(batch, results):
+                self.counts['requests'] += 1
+                self.counts['rows'] += len(frame)
+                if isinstance(result, Exception):
+                    self.counts['errors'] += 1
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def metrics(self):
+        return {
+            **self.counts,
+            'rowsPerBatch': self.counts['rows'] / self.counts['batches'] if self.counts['batches'] else None,
+            'latencyMs': latencyPercentiles(self.latencies),
+            'caches': cacheStats(),
+            'brands': len(self.brands),
+            'config': self.config,
+        }
+
+# Request body to a frame: a JSON list of listings (or {"rows": [...]}), or an Arrow IPC stream
+def readBody(body, contentType):
+    if contentType.startswith(ARROWTYPE):
+        import pyarrow as pa
+        return pa.ipc.open_stream(body).read_all().to_pandas()
+    rows = json.loads(body)
+    return pd.DataFrame.from_records(rows['rows'] if isinstance(rows, dict) else rows)
+
+# Cleaned frame to a response body in the format of the request
+def writeBody(df, contentType):
+    if contentType.startswith(ARROWTYPE):
+        import pyarrow as pa
+        table = arrowTable(df)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes(), ARROWTYPE
+    return typedColumns(df).to_json(orient='records').encode(), 'application/json'
+
+async def writeResponse(writer, status, body, contentType='application/json'):
+    reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}
+    writer.write((f'HTTP/1.1 {status} {reasons[status]}\r\nContent-Type: {contentType}\r\n'
+                  f'Content-Length: {len(body)}\r\n\r\n').encode() + body)
+    await writer.drain()
+
+# Status, body and content type of the response to a request
+async def respond(batcher, method, path, body, contentType):
+    if method == 'GET' and path == '/metrics':
+        return 200, json.dumps(batcher.metrics()).encode()
+    if method == 'GET' and path == '/health':
+        return 200, b'{"status": "ok"}'
+    if method != 'POST' or path != '/clean':
+        return 404, b'{"error": "not found"}'
+    start = time.perf_counter()
+    try:
+        df = readBody(body, contentType)
+    except Exception as error:
+        return 400, json.dumps({'error': str(error)}).encode()
+    try:
+        result = await batcher.submit(df)
+    except Exception as error:
+        return 500, json.dumps({'error': str(error)}).encode()
+    responseBody, responseType = writeBody(result, contentType)
+    batcher.latencies.append(time.perf_counter() - start)
+    return 200, responseBody, responseType
+
+# HTTP/1.1 with keep-alive: POST /clean takes raw listings and returns the cleaned rows,
+# GET /metrics returns the counters, latency percentiles and cache statistics, GET /health returns ok
+async def handleConnection(batcher, reader, writer):
+    try:
+        while True:
+            requestLine = await reader.readline()
+            if not requestLine:
+                break
+            method, path, _ = requestLine.decode().split(' ', 2)
+            headers = {}
+            while (line := await reader.readline()) not in [b'\r\n', b'\n', b'']:
+                name, _, value = line.decode().partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            contentType = headers.get('content-type', 'application/json')
+
+            await writeResponse(writer, *await respond(batcher, method, path, body, contentType))
+            if headers.get('connection', '').lower() == 'close':
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+# Clean a file once before serving, so the caches and the brand list start warm
+def warmUp(batcher, fileName):
+    raw = readRaw(fileName)
+    batcher.cleanBatch([requestFrame(raw)])
+
+async def serve(host='127.0.0.1', port=8080, config=None, warmFile=None, cacheFile=None, ready=None):
+    loadCaches(CACHES, cacheFile, cacheVersion())
+    batcher = MicroBatcher(config)
+    if warmFile:
+        warmUp(batcher, warmFile)
+    batcher.start()
+    server = await asyncio.start_server(lambda reader, writer: handleConnection(batcher, reader, writer), host, port)
+    if ready is not None:
+        ready(server, batcher)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await batcher.stop()
+
+# Usage: python service.py [--host HOST] [--port PORT] [--max-batch-rows N] [--max-delay-ms MS] [--warm FILE]
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Clean batches of raw listings sent over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max-batch-rows', type=int, default=SERVICECONFIG['maxBatchRows'],
+                        help='clean a batch once it has this many raw rows')
+    parser.add_argument('--max-delay-ms', type=float, default=SERVICECONFIG['maxDelay'] * 1000,
+                        help='clean a batch this long after its first request arrived')
+    parser.add_argument('--warm', help='clean this file before serving, to fill the caches and the brand list')
+    parser.add_argument('--cache-file', help='load the normalization caches from this file')
+    args = parser.parse_args()
+    config = {'maxBatchRows': args.max_batch_rows, 'maxDelay': args.max_delay_ms / 1000}
+    asyncio.run(serve(args.host, args.port, config, args.warm, args.cache_file))
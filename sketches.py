@@ -0,0 +1,63 @@
+from collections import Counter
+
+import numpy as np
+
+# Centroids a digest keeps about (compression / 2 at most): more is more accurate and larger
+DIGESTCOMPRESSION = 1000
+
+# Quantile sketch (t-digest) of a stream of numbers, which merges with the digests of other partitions
+# The values are kept as centroids (a mean and a weight), small at both tails and large in the middle,
+# so extreme quantiles (the outlier limits) stay close to exact with a few hundred centroids
+class TDigest:
+    def __init__(self, compression=DIGESTCOMPRESSION):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.low, self.high = np.inf, -np.inf
+
+    # Add values (missing ones are skipped), or merge another digest
+    def update(self, values):
+        if isinstance(values, TDigest):
+            means, weights, low, high = values.means, values.weights, values.low, values.high
+        else:
+            means = np.asarray(values, dtype=float)
+            means = means[~np.isnan(means)]
+            weights = np.ones(len(means))
+            low, high = (means.min(), means.max()) if len(means) else (np.inf, -np.inf)
+        if len(means):
+            self.low, self.high = min(self.low, low), max(self.high, high)
+            self.compress(np.concatenate([self.means, means]), np.concatenate([self.weights, weights]))
+        return self
+
+    # Sorted centroids are merged while they fit in one unit of the scale function
+    # k(q) = compression / (2 pi) * asin(2q - 1), steep near q = 0 and 1, which keeps the tail centroids small
+    def compress(self, means, weights):
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        middle = (np.cumsum(weights) - weights / 2) / weights.sum()
+        k = self.compression / (2 * np.pi) * np.arcsin(2 * middle - 1)
+        cluster = np.unique(np.floor(k - k[0]).astype(np.int64), return_inverse=True)[1]
+        self.weights = np.bincount(cluster, weights=weights)
+        self.means = np.bincount(cluster, weights=means * weights) / self.weights
+
+    def count(self):
+        return self.weights.sum()
+
+    # Value at quantile q (0 to 1), interpolated between the centroids, NaN for an empty digest
+    def quantile(self, q):
+        if not len(self.weights):
+            return np.nan
+        total = self.weights.sum()
+        positions = np.concatenate([[0], np.cumsum(self.weights) - self.weights / 2, [total]])
+        values = np.concatenate([[self.low], self.means, [self.high]])
+        return float(np.interp(q * total, positions, values))
+
+# Merge the sketches of every partition, each a dict of column to Counter (exact value counts) or TDigest
+def mergeSketches(partitions):
+    merged = {}
+    for sketches in partitions:
+        for column, sketch in sketches.items():
+            if column not in merged:
+                merged[column] = Counter() if isinstance(sketch, Counter) else TDigest(sketch.compression)
+            merged[column].update(sketch)
+    return merged
@@ -0,0 +1,258 @@
+import os
+
+import numpy as np
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+# File formats by extension, anything else is read and written as Excel
+FORMATS = {
+    '.xlsx': 'excel',
+    '.xls': 'excel',
+    '.csv': 'csv',
+    '.parquet': 'parquet',
+    '.pq': 'parquet',
+    '.arrow': 'arrow',
+    '.feather': 'arrow',
+    '.ipc': 'arrow',
+}
+
+# Output columns stored dictionary encoded and as list<string> in Parquet and Arrow
+# (pd.Categorical columns are dictionary encoded too)
+CATEGORYCOLUMNS = ['brand', 'color', 'os', 'cpuBrand', 'gpuBrand']
+LISTCOLUMNS = ['special_features']
+
+# Columns of tuples are stored as lists: special_features, and color when a listing keeps all its colors
+def isListColumn(df, column):
+    if column in LISTCOLUMNS:
+        return True
+    values = df[column].cat.categories if isinstance(df[column].dtype, pd.CategoricalDtype) else df[column].dropna()
+    return len(values) > 0 and isinstance(values.array[0], tuple)
+
+def fileFormat(fileName):
+    return FORMATS.get(os.path.splitext(fileName)[1].lower(), 'excel')
+
+# Arrow table of a memory-mapped IPC file, the column buffers point into the map (zero-copy)
+def readArrowTable(fileName):
+    import pyarrow as pa
+    return pa.ipc.open_file(pa.memory_map(fileName)).read_all()
+
+def readExcel(fileName):
+    return pd.read_excel(fileName)
+
+def readCsv(fileName):
+    return pd.read_csv(fileName)
+
+def readParquet(fileName):
+    import pyarrow.parquet as pq
+    return pq.read_table(fileName, memory_map=True).to_pandas()
+
+def readArrow(fileName):
+    return readArrowTable(fileName).to_pandas()
+
+READERS = {
+    'excel': readExcel,
+    'csv': readCsv,
+    'parquet': readParquet,
+    'arrow': readArrow,
+}
+
+# Read a whole file, picking the reader from the extension
+def readTable(fileName):
+    return READERS[fileFormat(fileName)](fileName)
+
+# Convert an openpyxl cell the same way pd.read_excel does
+def convertCell(cell):
+    if cell.value is None:
+        return ''
+    if cell.data_type == 'e':
+        return np.nan
+    if cell.data_type == 'n':
+        value = int(cell.value)
+        return value if value == cell.value else float(cell.value)
+    return cell.value
+
+# Turn raw rows into a frame with the same parsing (missing values, numbers) as pd.read_excel
+def parseRows(header, rows):
+    return TextParser([header] + rows, header=0).read()
+
+# Read an Excel sheet chunkSize rows at a time without loading the whole workbook
+def readExcelChunks(fileName, chunkSize):
+    import openpyxl
+    book = openpyxl.load_workbook(fileName, read_only=True, data_only=True)
+    sheet = book.worksheets[0]
+    sheet.reset_dimensions()
+    header = None
+    rows = []
+    for row in sheet.rows:
+        values = [convertCell(cell) for cell in row]
+        if header is None:
+            header = values
+            continue
+        rows.append((values + [''] * len(header))[:len(header)])
+        if len(rows) == chunkSize:
+            yield parseRows(header, rows)
+            rows = []
+    if rows:
+        yield parseRows(header, rows)
+    book.close()
+
+def readCsvChunks(fileName, chunkSize):
+    yield from pd.read_csv(fileName, chunksize=chunkSize)
+
+def readParquetChunks(fileName, chunkSize):
+    import pyarrow.parquet as pq
+    for batch in pq.ParquetFile(fileName, memory_map=True).iter_batches(batch_size=chunkSize):
+        yield batch.to_pandas()
+
+# The memory map is only paged in for the slice being converted
+def readArrowChunks(fileName, chunkSize):
+    table = readArrowTable(fileName)
+    for start in range(0, table.num_rows, chunkSize):
+        yield table.slice(start, chunkSize).to_pandas()
+
+CHUNKREADERS = {
+    'excel': readExcelChunks,
+    'csv': readCsvChunks,
+    'parquet': readParquetChunks,
+    'arrow': readArrowChunks,
+}
+
+# Read a file chunkSize rows at a time, picking the reader from the extension
+def readChunks(fileName, chunkSize):
+    yield from CHUNKREADERS[fileFormat(fileName)](fileName, chunkSize)
+
+# Arrow types of the cleaned columns: dictionary encoding for categories, list<string> for
+# the feature tuples and plain strings for other text. Fixed index and value types so that
+# every chunk of a streamed output gets the same schema
+def arrowSchema(df):
+    import pyarrow as pa
+    fields = []
+    for column in df.columns:
+        if isListColumn(df, column):
+            fieldType = pa.list_(pa.string())
+        elif column in CATEGORYCOLUMNS or isinstance(df[column].dtype, pd.CategoricalDtype):
+            fieldType = pa.dictionary(pa.int32(), pa.string(), ordered=bool(getattr(df[column].dtype, 'ordered', False)))
+        elif df[column].dtype == object:
+            fieldType = pa.string()
+        else:
+            fieldType = pa.from_numpy_dtype(df[column].dtype)
+        fields.append(pa.field(column, fieldType))
+    return pa.schema(fields)
+
+# Give the columns the pandas types matching arrowSchema
+# Categories which are not strings (the hard disk bins) are stored with their text labels,
+# the same text the Excel output has
+def typedColumns(df):
+    df = df.copy()
+    for column in df.columns:
+        if isListColumn(df, column):
+            df[column] = df[column].astype(object).map(list, na_action='ignore')
+        elif column in CATEGORYCOLUMNS:
+            df[column] = df[column].astype('category')
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].cat.rename_categories([str(category) for category in df[column].cat.categories])
+    return df
+
+# categories maps a column to the categories of the earlier chunks, new values are appended
+# so every chunk's dictionary starts with the previous one (needed by the Arrow IPC file format)
+def arrowTable(df, schema=None, categories=None):
+    import pyarrow as pa
+    schema = schema or arrowSchema(df)
+    df = typedColumns(df)
+    if categories is not None:
+        for column in df.columns:
+            if isinstance(df[column].dtype, pd.CategoricalDtype):
+                known = categories.setdefault(column, {})
+                known.update(dict.fromkeys(df[column].cat.categories))
+                df[column] = df[column].cat.set_categories(list(known))
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+def writeExcel(df, fileName):
+    df.to_excel(fileName, index=False)
+
+def writeCsv(df, fileName):
+    df.to_csv(fileName, index=False)
+
+def writeParquet(df, fileName):
+    import pyarrow.parquet as pq
+    pq.write_table(arrowTable(df), fileName)
+
+def writeArrow(df, fileName):
+    import pyarrow as pa
+    table = arrowTable(df)
+    with pa.OSFile(fileName, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+WRITERS = {
+    'excel': writeExcel,
+    'csv': writeCsv,
+    'parquet': writeParquet,
+    'arrow': writeArrow,
+}
+
+# Write a whole frame, picking the writer from the extension
+def writeTable(df, fileName):
+    WRITERS[fileFormat(fileName)](df, fileName)
+
+# Write a cleaned value to a cell the same way DataFrame.to_excel does
+def excelValue(value):
+    if pd.api.types.is_scalar(value) and pd.isna(value):
+        return None
+    if isinstance(value, (np.integer, np.floating, np.bool_)):
+        return value.item()
+    if isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+# Appends chunks to an Excel, CSV, Parquet or Arrow file, writing the header (or schema) once
+class ChunkWriter:
+    def __init__(self, fileName, columns):
+        self.fileName = fileName
+        self.columns = columns
+        self.format = fileFormat(fileName)
+        self.writer = None
+        if self.format == 'csv':
+            pd.DataFrame(columns=columns).to_csv(fileName, index=False)
+        elif self.format == 'excel':
+            import openpyxl
+            self.book = openpyxl.Workbook(write_only=True)
+            self.sheet = self.book.create_sheet()
+            self.sheet.append(columns)
+
+    def write(self, df):
+        df = df[self.columns]
+        if self.format == 'csv':
+            df.to_csv(self.fileName, mode='a', header=False, index=False)
+        elif self.format == 'excel':
+            for row in df.itertuples(index=False):
+                self.sheet.append([excelValue(value) for value in row])
+        else:
+            self.writeArrow(df)
+
+    # The first chunk opens the writer and fixes the schema, later chunks are cast to it
+    # Arrow dictionaries only grow, the new values of a chunk are written as a dictionary delta
+    def writeArrow(self, df):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if self.writer is None:
+            self.schema = arrowSchema(df)
+            if self.format == 'parquet':
+                self.writer = pq.ParquetWriter(self.fileName, self.schema)
+            else:
+                self.sink = pa.OSFile(self.fileName, 'wb')
+                options = pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+                self.writer = pa.ipc.new_file(self.sink, self.schema, options=options)
+            self.categories = {}
+        self.writer.write_table(arrowTable(df, self.schema, self.categories))
+
+    # Without any chunk, Parquet and Arrow still get a file with the columns and no rows
+    # (the types of the columns are not known then, the plain ones are stored as strings)
+    def close(self):
+        if self.format in ['parquet', 'arrow'] and self.writer is None:
+            self.writeArrow(pd.DataFrame(columns=self.columns))
+        if self.format == 'excel':
+            self.book.save(self.fileName)
+        elif self.writer is not None:
+            self.writer.close()
+            if self.format == 'arrow':
+                self.sink.close()
@@ -0,0 +1,122 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from jssb25 import (cleanRows, cleanBrandColumn, cleanModelAndBrand, explodeColors, finishClean, removeOutliers,
+                    groupRare, binHDD, categoryCounts, outlierDigests, outlierLimits, OUTPUTORDER)
+from storage import readChunks, ChunkWriter
+from dedup import rowFingerprints
+from sketches import mergeSketches
+
+# Raw columns the cleaning needs, anything else in the file is ignored
+RAWCOLUMNS = ['brand', 'model', 'screen_size', 'color', 'harddisk', 'cpu', 'ram', 'os',
+              'special_features', 'graphics', 'graphics_coprocessor', 'cpu_speed', 'rating', 'price']
+TEXTCOLUMNS = ['brand', 'model', 'color', 'cpu', 'os', 'special_features', 'graphics', 'graphics_coprocessor']
+NUMCOLUMNS = ['harddisk', 'ram', 'screen_size', 'cpu_speed', 'rating', 'price']
+
+# Read the input chunkSize rows at a time, keeping the raw columns the cleaning needs
+def readRawChunks(fileName, chunkSize):
+    for df in readChunks(fileName, chunkSize):
+        df.columns = df.columns.str.lower().str.strip()
+        yield df.reindex(columns=RAWCOLUMNS)
+
+# Give a chunk the column types cleanRows expects
+# Numerical columns are inferred from the rows of the chunk, like pd.read_excel does for the whole file,
+# and kept as floats even if this chunk only has whole numbers.
+# Text columns only keep strings, as the .str methods would turn anything else into NaN anyway
+def alignTypes(df):
+    df = df.infer_objects()
+    for column in NUMCOLUMNS:
+        if pd.api.types.is_numeric_dtype(df[column]):
+            df[column] = df[column].astype(float)
+    for column in TEXTCOLUMNS:
+        df[column] = df[column].where(df[column].map(lambda value: isinstance(value, str))).astype(object)
+    return df
+
+# Keep the rows whose fingerprint was not seen in this or an earlier chunk (keep='first')
+# Only the fingerprints are kept across chunks, not the rows.
+# seen['hashes'] stays sorted, so a lookup is a binary search and adding a chunk is a merge
+def dropSeen(df, seen):
+    hashes = rowFingerprints(df)
+    keep = ~pd.Series(hashes).duplicated().to_numpy()
+    if len(seen['hashes']):
+        position = np.minimum(np.searchsorted(seen['hashes'], hashes), len(seen['hashes']) - 1)
+        keep &= seen['hashes'][position] != hashes
+    seen['hashes'] = np.sort(np.concatenate([seen['hashes'], np.sort(hashes[keep])]), kind='stable')
+    return df[keep]
+
+def spill(df, directory, name, i):
+    path = os.path.join(directory, f'{name}_{i}.pkl')
+    df.to_pickle(path)
+    return path
+
+# The final stage (cleanPostVisualize) over partitions of finished rows which need not fit in memory
+# together, read with read (spilled pickles by default). Pass 1 removes the outliers above limits
+# (OUTLIERLIMITS if not given) and merges the value counts of every partition. It is skipped if
+# counts are given, counted on the same rows. Pass 2 removes the outliers again, groups the rare
+# values with the merged counts, bins the hard disks and hands every partition to writer
+def finishPartitions(paths, writer, limits=None, counts=None, read=pd.read_pickle):
+    if counts is None:
+        counts = mergeSketches(categoryCounts(removeOutliers(read(path), limits)) for path in paths)
+    for path in paths:
+        df = removeOutliers(read(path), limits)
+        if df.empty:
+            continue
+        df = groupRare(df, counts)
+        df = df.drop(columns=['cpu_speed_ghz'], axis = 1)
+        df = binHDD(df)
+        writer.write(df)
+    writer.close()
+
+# Clean a file which does not fit in memory, chunkSize rows at a time
+# Row-local stages run chunk by chunk and their results are spilled to disk. The global stages
+# (drop_duplicates, the brand list in cleanModelAndBrand and the count threshold in
+# cleanPostVisualize) run in later passes over the spilled chunks, using only the
+# row fingerprints, the brand list and the value counts collected on the way
+# With outlierQuantile, the outlier limits are that quantile of the merged digests of the finished
+# chunks, so the value counts take one more pass over them (see finishPartitions)
+def cleanStream(fileName, outputName, chunkSize, spillDir=None, outlierQuantile=None):
+    with tempfile.TemporaryDirectory(dir=spillDir) as directory:
+        # Pass 1: drop raw duplicates, clean each row and collect the brands
+        rawSeen = {'hashes': np.empty(0, dtype=np.uint64)}
+        brands = {}
+        cleaned = []
+        for i, df in enumerate(readRawChunks(fileName, chunkSize)):
+            df = df.dropna(axis=0, subset=['model'])
+            df = dropSeen(df, rawSeen)
+            if df.empty:
+                continue
+            df = cleanRows(alignTypes(df.reset_index(drop=True)))
+            df = cleanBrandColumn(df)
+            brands.update(dict.fromkeys(df['brand'].unique()))
+            cleaned.append(spill(df, directory, 'cleaned', i))
+        del rawSeen
+
+        # Pass 2: brand lookup, a row per color and drop cleaned duplicates. With the fixed limits the
+        # outliers are removed and the categories counted, otherwise the outlier columns are sketched
+        seen = {'hashes': np.empty(0, dtype=np.uint64)}
+        sketches = []
+        finished = []
+        for i, path in enumerate(cleaned):
+            df = cleanModelAndBrand(pd.read_pickle(path), list(brands))
+            df = explodeColors(df)
+            df = dropSeen(df, seen)
+            df = finishClean(df)
+            if outlierQuantile is None:
+                df = removeOutliers(df)
+                sketches.append(categoryCounts(df))
+            else:
+                sketches.append(outlierDigests(df))
+            finished.append(spill(df, directory, 'finished', i))
+            os.remove(path)
+        del seen
+
+        # Pass 3 (only with outlierQuantile): count the categories without the outliers
+        # Pass 4: group rare categories with the global counts, bin the hard disk and write out
+        if outlierQuantile is None or not finished:
+            limits, counts = None, mergeSketches(sketches)
+        else:
+            limits, counts = outlierLimits(mergeSketches(sketches), outlierQuantile), None
+        finishPartitions(finished, ChunkWriter(outputName, OUTPUTORDER), limits, counts)
@@ -0,0 +1,141 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from jssb25 import COLORMAP, OSMAPPING, SFMAPPING, BRANDMAPPING, MODELINBRAND
+
+# Share of missing values in every raw column, close to the scraped file
+MISSING = {
+    'model': 0.05,
+    'color': 0.13,
+    'harddisk': 0.13,
+    'cpu': 0.02,
+    'OS': 0.01,
+    'special_features': 0.5,
+    'graphics': 0.01,
+    'graphics_coprocessor': 0.4,
+    'cpu_speed': 0.65,
+    'rating': 0.5,
+}
+
+# Share of listings which repeat an earlier one exactly
+DUPLICATES = 0.1
+
+BRANDS = ['dell', 'hp', 'lenovo', 'asus', 'acer', 'msi', 'apple', 'microsoft', 'samsung', 'razer', 'gigabyte',
+          'lg', 'panasonic', 'rokc']
+SERIES = ['thinkpad', 'ideapad', 'xps', 'inspiron', 'precision', 'elitebook', 'pavilion', 'envy', 'zenbook',
+          'vivobook', 'rog strix', 'aspire', 'swift', 'predator', 'katana', 'stealth', 'macbook pro', 'surface laptop',
+          'galaxy book', 'blade', 'aero', 'gram', 'cf']
+# Graphics and CPU texts in the shapes the extract rules of rulesets/gpu.json and cpu.json were written for,
+# each # is a random digit
+GPUTEMPLATES = ['nvidia geforce rtx ####', 'nvidia geforce gtx ####', 'nvidia geforce rtx ### ti', 'nvidia quadro t####',
+                'nvidia rtx a####', 'intel iris xe graphics', 'intel uhd graphics ###', 'intel hd graphics ###',
+                'intel integrated graphics', 'intel', 'amd radeon rx ####m', 'amd radeon vega #', 'amd radeon graphics',
+                'apple m1 pro', 'mediatek', 'arm mali-g## mp3', 'integrated', 'dedicated', 'xps9300-7909slv-pus']
+CPUTEMPLATES = ['intel core i#-####u', 'intel core i#-#####h', 'core i#', 'core i# family', 'intel core i#',
+                'amd ryzen # ####u', 'amd ryzen # ####hs', 'ryzen #', 'intel celeron n####', 'pentium n####',
+                'athlon silver ####u', 'intel atom', 'xeon', 'a-series dual-core a#', 'mediatek cortex a##',
+                'snapdragon', 'unknown']
+OTHERFEATURES = ['miracast technology', 'memory card slot', 'killer wifi', 'thunderbolt', 'usb-c charging']
+SCREENSIZES = ['11.6 Inches', '13.3 Inches', '14 Inches', '15.6 Inches', '16 Inches', '17.3 Inches', '14']
+HARDDISKS = ['64 GB', '128 GB', '256 GB', '500 GB', '512 GB', '1 TB', '1000 GB', '2 TB', '4 TB', '8 TB']
+RAMS = ['4 GB', '8 GB', '12 GB', '16 GB', '32 GB', '64 GB', '128 GB']
+CPUSPEEDS = ['1.1 GHz', '1.2 GHz', '2.4 GHz', '2.8 GHz', '3.5 GHz', '4.7 GHz', '2400 MHz', '3200 MHz']
+
+# Plain words of the alternations of a rule table ('silver|platinum' gives silver and platinum),
+# the spellings its rules were written for. Alternatives with other regex syntax are left out
+def ruleWords(table):
+    words = []
+    for regex in table:
+        words += [word for word in regex.split('|') if re.fullmatch(r'[a-z0-9 &-]+', word)]
+    return words
+
+# Template with every # replaced by a random digit
+def fillTemplate(template, rng):
+    return re.sub('#', lambda _: str(rng.integers(10)), template)
+
+# The ways the same value shows up in the scraped data: as it is, capitalized, upper case,
+# or with stray spaces around it
+def messyVariants(values):
+    variants = []
+    for value in values:
+        variants += [value, value.title(), value.upper(), f' {value.title()} ']
+    return variants
+
+# size distinct texts, each joining 1 to most values picked from words
+def joinedPool(words, size, most, separators, rng):
+    pool = []
+    for _ in range(size):
+        picked = rng.choice(words, size=rng.integers(1, most + 1), replace=False)
+        pool.append(rng.choice(separators).join(picked))
+    return pool
+
+# Pools of raw texts for every column, each row picks one of them
+def vocabularies(rng):
+    brands = BRANDS + ruleWords(BRANDMAPPING) + MODELINBRAND
+    models = [f'{rng.choice(SERIES)} {fillTemplate(rng.choice(["##", "###", "####", "# gen #", "####-##"]), rng)}'
+              for _ in range(5000)]
+    features = ruleWords(SFMAPPING) + OTHERFEATURES
+    return {
+        'brand': messyVariants(brands),
+        'model': models + [model.upper() for model in models[:500]],
+        'screen_size': SCREENSIZES,
+        'color': joinedPool(messyVariants(ruleWords(COLORMAP)) + ['Darkside of the moon'], 400, 3, [', ', '/'], rng),
+        'harddisk': HARDDISKS,
+        'cpu': messyVariants(dict.fromkeys(fillTemplate(template, rng) for template in CPUTEMPLATES * 20)),
+        'ram': RAMS,
+        'OS': messyVariants(ruleWords(OSMAPPING) + ['windows 10 pro', 'windows 11 pro', 'windows 11 home']),
+        'special_features': joinedPool(messyVariants(features), 3000, 5, [', ', ','], rng),
+        'graphics': messyVariants(dict.fromkeys(fillTemplate(template, rng) for template in GPUTEMPLATES * 10)),
+        'graphics_coprocessor': messyVariants(dict.fromkeys(fillTemplate(template, rng) for template in GPUTEMPLATES * 20)),
+        'cpu_speed': CPUSPEEDS,
+        'price': [f'${price:,.2f}' for price in rng.uniform(150, 5000, 20000)],
+    }
+
+# rows raw listings with the columns of the scraped file, drawn from the vocabularies of the mappers
+# Values are picked from pools of texts, so the whole frame is built with array lookups. About
+# DUPLICATES of the listings repeat an earlier one and MISSING gives the share of missing values
+def syntheticListings(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    source = np.arange(rows)
+    repeats = np.flatnonzero(rng.random(rows) < DUPLICATES)
+    source[repeats] = (rng.random(len(repeats)) * repeats).astype(np.int64)
+    while not np.array_equal(source[source], source): # A repeat of a repeat copies the listing it repeats
+        source = source[source]
+
+    columns = {}
+    for column, pool in vocabularies(rng).items():
+        values = np.asarray(pool, dtype=object)[rng.integers(0, len(pool), rows)]
+        values[rng.random(rows) < MISSING.get(column, 0)] = np.nan
+        columns[column] = values[source]
+    rating = np.round(rng.uniform(1, 5, rows), 1)
+    rating[rng.random(rows) < MISSING['rating']] = np.nan
+    columns['rating'] = rating[source]
+    order = ['brand', 'model', 'screen_size', 'color', 'harddisk', 'cpu', 'ram', 'OS', 'special_features',
+             'graphics', 'graphics_coprocessor', 'cpu_speed', 'rating', 'price']
+    return pd.DataFrame(columns)[order]
+
+# Words sellers add to a model title
+TITLEWORDS = ['laptop', 'notebook', 'new', 'pc', 'ultrabook']
+
+# Other titles of the same laptops, the way another seller would write them: cased and spaced differently,
+# with dashes for spaces, a letter mistyped (another letter, dropped or doubled) or a word more.
+# The digits are never changed, a different number is a different laptop
+def perturbedTitles(titles, seed=0):
+    rng = np.random.default_rng(seed)
+    perturbed = []
+    for title, kind in zip(titles, rng.integers(0, 4, len(titles))):
+        letters = [i for i, char in enumerate(title) if char.isalpha()]
+        if kind == 0:
+            title = title.upper().replace(' ', '  ', 1)
+        elif kind == 1:
+            title = title.title().replace(' ', '-')
+        elif kind == 2 and len(letters) > 3:
+            i = letters[rng.integers(len(letters))]
+            title = [title[:i] + chr(rng.integers(97, 123)) + title[i + 1:], title[:i] + title[i + 1:],
+                     title[:i] + title[i] + title[i:]][rng.integers(3)]
+        else:
+            title = f'{title} {rng.choice(TITLEWORDS)}'
+        perturbed.append(title)
+    return perturbed